@@ -0,0 +1,129 @@
+# Нагрузочная проверка оформления заказов: тысячи параллельных заказов, повторов с тем же ключом
+# и возвратов. После каждого прогона проверяется, что деньги не появились и не пропали:
+# для каждого пользователя и валюты начальная сумма равна остатку на счёте плюс сумма его заказов.
+# Запуск из корня проекта: python -m benchmarks.checkout_benchmark
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import tempfile
+import time
+from benchmarks.common import create_catalogue
+from data import db_session
+from data import accounts
+from data import checkout
+from data.cart import CartItem, CartTotal
+from data.currency import Currency
+from data.item import Item
+from data.order import Order, OrderItem, OrderSummary
+from data.user import User
+from data.wallet import Wallet
+
+WORKERS = [1, 2, 4, 8, 16]
+USERS = 100
+ITEMS = 200
+# Количество заказов каждого пользователя за прогон
+ORDERS_PER_USER = 30
+# Доля заказов, отправляемых повторно с тем же ключом, и доля возвратов
+DUPLICATE_SHARE = 0.3
+REFUND_SHARE = 0.2
+# Денег хватает примерно на половину заказов, поэтому часть заказов отклоняется
+START_MONEY = 300
+
+
+def prepare(directory):
+    path = os.path.join(directory, 'bench.db')
+    create_catalogue(path, ITEMS).close()
+    db_session.global_init(path)
+    with db_session.transaction() as db_sess:
+        db_sess.add(Currency(id=1, name='integer', is_integer=True))
+        db_sess.add(Currency(id=2, name='fractional', is_integer=False))
+        # Одинаковая цена у всех товаров упрощает расчёт ожидаемых сумм
+        db_sess.query(Item).update({Item.special_price: 10, Item.special_currency: 1}, synchronize_session=False)
+        for user_id in range(1, USERS + 1):
+            db_sess.add(User(id=user_id, name=f'user{user_id}', got_bonus=0))
+    db_session.remove_session()
+
+
+# Очистка счетов, корзин и заказов перед прогоном
+def reset():
+    with db_session.transaction() as db_sess:
+        for model in [Wallet, CartItem, CartTotal, Order, OrderItem, OrderSummary, checkout.IdempotencyKey]:
+            db_sess.query(model).delete(synchronize_session=False)
+        for user_id in range(1, USERS + 1):
+            accounts.create_account(db_sess, user_id)
+            accounts.add_money(db_sess, user_id, 1, START_MONEY)
+    db_session.remove_session()
+
+
+# Один заказ пользователя: добавление товаров в корзину, оформление, возможный повтор и возврат
+def run_order(user_id, rng_seed):
+    rng = random.Random(rng_seed)
+    try:
+        with db_session.transaction() as db_sess:
+            for item_id in rng.sample(range(1, ITEMS + 1), rng.randint(1, 3)):
+                item = db_sess.query(Item).get(item_id)
+                accounts.add_to_cart(db_sess, user_id, item)
+        key = checkout.new_key()
+        try:
+            order_id = checkout.place_order(user_id, key)
+        except accounts.NotEnoughMoneyError:
+            return 'rejected'
+        if rng.random() < DUPLICATE_SHARE:
+            assert checkout.place_order(user_id, key) == order_id, 'повтор с тем же ключом создал новый заказ'
+        if rng.random() < REFUND_SHARE:
+            refund_key = checkout.new_key()
+            assert checkout.refund_order(user_id, order_id, refund_key)
+            assert checkout.refund_order(user_id, order_id, refund_key), 'повтор возврата вернул другой результат'
+            return 'refunded'
+        return 'ordered'
+    finally:
+        db_session.remove_session()
+
+
+# Проверка целостности счетов и корзин после прогона
+def check():
+    db_sess = db_session.create_standalone_session()
+    try:
+        for user_id in range(1, USERS + 1):
+            wallet = accounts.get_wallet(db_sess, user_id)
+            assert all(amount >= 0 for amount in wallet.values()), f'отрицательный счёт у {user_id}'
+            spent = dict()
+            for order_id in accounts.get_order_ids(db_sess, user_id):
+                for currency_id, amount in accounts.get_order_summary(db_sess, order_id).items():
+                    spent[currency_id] = spent.get(currency_id, 0) + amount
+                items = accounts.get_order_items(db_sess, order_id)
+                assert accounts.get_summary(items) == accounts.get_order_summary(db_sess, order_id)
+            assert wallet[1] + spent.get(1, 0) == START_MONEY, f'расхождение денег у {user_id}'
+            lines = accounts.get_cart(db_sess, user_id)
+            totals = {i.currency_id: i.amount for i in db_sess.query(CartTotal).filter(CartTotal.user_id == user_id)}
+            assert all(totals.get(i, 0) == amount for i, amount in accounts.get_summary(lines).items())
+        orders = db_sess.query(Order).count()
+        keys = db_sess.query(checkout.IdempotencyKey).filter(checkout.IdempotencyKey.action == 'order').count()
+        return orders, keys
+    finally:
+        db_sess.close()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        prepare(directory)
+        print(f'{"потоков":>8} {"заказов/с":>10} {"оформлено":>10} {"возвратов":>10} {"отклонено":>10} {"заказов в базе":>15}')
+        for workers in WORKERS:
+            reset()
+            tasks = [(user_id, f'{workers}:{user_id}:{i}') for user_id in range(1, USERS + 1)
+                     for i in range(ORDERS_PER_USER)]
+            random.Random(workers).shuffle(tasks)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(workers) as executor:
+                results = list(executor.map(lambda task: run_order(*task), tasks))
+            elapsed = time.perf_counter() - start
+            orders, keys = check()
+            assert orders == results.count('ordered'), 'число заказов не совпадает с числом успешных оформлений'
+            assert keys == orders + results.count('refunded')
+            assert len(checkout.user_locks) == 0
+            print(f'{workers:>8} {len(tasks) / elapsed:>10.0f} {results.count("ordered"):>10} '
+                  f'{results.count("refunded"):>10} {results.count("rejected"):>10} {orders:>15}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Общие функции для замеров: синтетический каталог и подсчёт перцентилей
+import random
+import time
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+from data.db_session import SqlAlchemyBase
+from data import __all_models
+from data.item import Item
+from data.attributes import rebuild_attributes
+
+SYLLABLES = ['ка', 'ро', 'ми', 'ту', 'не', 'ла', 'со', 'ви', 'да', 'пе', 'ры', 'го', 'зу', 'шо', 'фа', 'бе', 'лю', 'жи']
+# Словарь из нескольких тысяч слов, чтобы слова встречались в каталоге с реалистичной частотой
+WORDS = sorted({''.join(random.Random(i).choices(SYLLABLES, k=4)) for i in range(20000)})
+BATCH_SIZE = 50000
+# Значения атрибутов товаров вида "Название: значение" для фасетов
+ATTRIBUTES = {
+    'Цвет': ['белый', 'чёрный', 'серый', 'красный', 'синий', 'зелёный', 'жёлтый', 'коричневый'],
+    'Материал': ['дерево', 'металл', 'пластик', 'стекло', 'ткань', 'керамика'],
+    'Страна': ['Россия', 'Швеция', 'Китай', 'Германия', 'Польша'],
+}
+
+
+def make_item(i):
+    return {'name': ' '.join(random.choices(WORDS, k=2)) + f' {i}', 'category': i % 18 + 1,
+            'description': ';'.join([' '.join(random.choices(WORDS, k=4)) for _ in range(3)]
+                                    + [f'{name}: {random.choice(values)}' for name, values in ATTRIBUTES.items()]),
+            'photo_name': 'void.png'}
+
+
+# Создание базы данных со случайным каталогом из size товаров
+def create_catalogue(path, size):
+    engine = sa.create_engine(f'sqlite:///{path}')
+    SqlAlchemyBase.metadata.create_all(engine)
+    for start in range(0, size, BATCH_SIZE):
+        with engine.begin() as conn:
+            conn.execute(Item.__table__.insert(), [make_item(i) for i in range(start, min(start + BATCH_SIZE, size))])
+    # Товары вставлены в обход событий модели, атрибуты разбираются одним проходом
+    with engine.begin() as conn:
+        rebuild_attributes(conn)
+    return orm.sessionmaker(bind=engine)()
+
+
+# Многократный вызов функции, возвращает медиану и 99-й перцентиль в миллисекундах
+def measure(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2] * 1000, times[int(len(times) * 0.99)] * 1000
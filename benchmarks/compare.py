@@ -0,0 +1,41 @@
+# Сравнение двух результатов benchmarks.routes_benchmark, например до и после изменения.
+# Запуск из корня проекта: python -m benchmarks.compare old.json new.json
+import json
+import sys
+
+METRICS = ['p50_ms', 'p99_ms', 'throughput_rps']
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def change(old, new):
+    if not old:
+        return '-'
+    return f'{(new - old) / old * 100:+.1f}%'
+
+
+def main():
+    if len(sys.argv) != 3:
+        print('Использование: python -m benchmarks.compare old.json new.json')
+        sys.exit(1)
+    old, new = load(sys.argv[1]), load(sys.argv[2])
+    print(f'{old.get("commit")} -> {new.get("commit")}')
+    if old['scale'] != new['scale']:
+        print(f'Внимание: размеры баз различаются: {old["scale"]} и {new["scale"]}')
+    print(f'{"маршрут":>22}' + ''.join(f'{name:>26}' for name in METRICS))
+    for route in sorted(set(old['routes']) | set(new['routes'])):
+        if route not in old['routes'] or route not in new['routes']:
+            print(f'{route:>22}  есть только в одном результате')
+            continue
+        cells = []
+        for name in METRICS:
+            before, after = old['routes'][route][name], new['routes'][route][name]
+            cells.append(f'{before:>9.2f} -> {after:>9.2f} {change(before, after):>7}')
+        print(f'{route:>22}' + ''.join(f'{i:>26}' for i in cells))
+
+
+if __name__ == '__main__':
+    main()
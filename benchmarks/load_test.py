@@ -0,0 +1,87 @@
+# Нагрузочный тест сервера gunicorn с разным числом рабочих процессов.
+# Каждый прогон запускает сервер на копии базы данных и нагружает его несколькими процессами-клиентами.
+# Запуск из корня проекта: python -m benchmarks.load_test [число процессов сервера ...]
+# Переменная PAGE_CACHE_SIZE=0 отключает кэш страниц, чтобы измерять работу приложения, а не кэша
+from multiprocessing import Pool
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+DATABASE = 'db/store_database.db'
+PORT = 8091
+# Адреса, которые запрашивают клиенты по кругу
+PATHS = ['/', '/item/1', '/item/5', '/item/12', '/faq', '/delivery_info', '/search?name=%D0%B0&category=0']
+CLIENTS = 16
+DURATION = 10
+START_TIMEOUT = 30
+
+
+# Один клиент: последовательные запросы в течение duration секунд. Возвращает число ответов и ошибок
+def run_client(args):
+    base_url, paths, duration = args
+    done = errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + paths[done % len(paths)], timeout=10) as response:
+                response.read()
+            done += 1
+        except (urllib.error.URLError, OSError):
+            errors += 1
+    return done, errors
+
+
+# Нагрузка сервера несколькими процессами-клиентами. Возвращает запросы в секунду и число ошибок
+def http_load(base_url, paths, clients, duration):
+    with Pool(clients) as pool:
+        results = pool.map(run_client, [(base_url, paths, duration)] * clients)
+    return sum(i[0] for i in results) / duration, sum(i[1] for i in results)
+
+
+def wait_ready(base_url, process):
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('сервер завершился при запуске')
+        try:
+            urllib.request.urlopen(base_url + '/faq', timeout=1).read()
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError('сервер не ответил вовремя')
+
+
+# Запуск сервера на копии базы. env - дополнительные настройки приложения, например {'PAGE_CACHE_SIZE': '0'}
+def run_server(workers, database, threads=4, env=None):
+    env = dict(os.environ, WEB_WORKERS=str(workers), WEB_THREADS=str(threads), WEB_BIND=f'127.0.0.1:{PORT}',
+               DATABASE_URL=database, **(env or dict()))
+    return subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    counts = [int(i) for i in sys.argv[1:]] or sorted({1, 2, os.cpu_count() or 1, (os.cpu_count() or 1) * 2})
+    base_url = f'http://127.0.0.1:{PORT}'
+    print(f'ядер: {os.cpu_count()}, клиентов: {CLIENTS}, длительность прогона: {DURATION} с')
+    print(f'{"процессов":>10} {"запросов/с":>11} {"ошибок":>7}')
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'store.db')
+        shutil.copyfile(DATABASE, database)
+        for workers in counts:
+            process = run_server(workers, database)
+            try:
+                wait_ready(base_url, process)
+                rate, errors = http_load(base_url, PATHS, CLIENTS, DURATION)
+            finally:
+                process.terminate()
+                process.wait()
+            print(f'{workers:>10} {rate:>11.0f} {errors:>7}')
+
+
+if __name__ == '__main__':
+    main()
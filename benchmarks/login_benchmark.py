@@ -0,0 +1,115 @@
+# Замер входа в аккаунт под нагрузкой: часть клиентов непрерывно входит в аккаунты,
+# остальные запрашивают лёгкую страницу у того же процесса сервера. Прогоны отличаются
+# числом потоков хэширования паролей (PASSWORD_HASH_WORKERS, 0 - хэширование в потоке запроса)
+# и показывают, насколько хэширование задерживает остальные запросы.
+# Запуск из корня проекта: python -m benchmarks.login_benchmark [число потоков хэширования ...]
+import argparse
+from http.cookiejar import CookieJar
+from multiprocessing import Pool
+import os
+import random
+import re
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from benchmarks import seed
+from benchmarks import load_test
+
+USERS = 100
+PAGE = '/faq'
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+# Один вход: получение формы с токеном CSRF и отправка пароля. Успешный вход отвечает перенаправлением
+def login(base_url, user_id):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), NoRedirect())
+    with opener.open(base_url + '/login', timeout=30) as response:
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', response.read().decode()).group(1)
+    data = urllib.parse.urlencode({'csrf_token': token, 'email': seed.email(user_id),
+                                   'password': seed.PASSWORD}).encode()
+    try:
+        opener.open(base_url + '/login', data, timeout=30).read()
+    except urllib.error.HTTPError as error:
+        return error.code == 302
+    return False
+
+
+# Клиент: входы в аккаунты или запросы страницы в течение duration секунд.
+# Возвращает роль, число успешных запросов, ошибок и задержки запросов в миллисекундах
+def run_client(args):
+    role, base_url, duration, seed_value = args
+    rng = random.Random(seed_value)
+    done = errors = 0
+    times = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            if role == 'login':
+                ok = login(base_url, rng.randint(1, USERS))
+            else:
+                with urllib.request.urlopen(base_url + PAGE, timeout=30) as response:
+                    response.read()
+                ok = True
+        except (urllib.error.URLError, OSError, AttributeError):
+            ok = False
+        if ok:
+            done += 1
+            times.append((time.perf_counter() - start) * 1000)
+        else:
+            errors += 1
+    return role, done, errors, times
+
+
+def percentile(times, fraction):
+    times = sorted(times)
+    return times[min(int(len(times) * fraction), len(times) - 1)] if times else 0
+
+
+def run(database, hash_workers, args):
+    process = load_test.run_server(1, database, threads=args.threads,
+                                   env={'PASSWORD_HASH_WORKERS': str(hash_workers), 'PAGE_CACHE_SIZE': '0'})
+    base_url = f'http://127.0.0.1:{load_test.PORT}'
+    try:
+        load_test.wait_ready(base_url, process)
+        tasks = [('login', base_url, args.duration, i) for i in range(args.login_clients)]
+        tasks += [('page', base_url, args.duration, i) for i in range(args.page_clients)]
+        with Pool(len(tasks)) as pool:
+            results = pool.map(run_client, tasks)
+    finally:
+        process.terminate()
+        process.wait()
+    logins = sum(i[1] for i in results if i[0] == 'login')
+    page_times = [t for i in results if i[0] == 'page' for t in i[3]]
+    errors = sum(i[2] for i in results)
+    return logins / args.duration, len(page_times) / args.duration, percentile(page_times, 0.5), \
+        percentile(page_times, 0.99), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер входа в аккаунт под нагрузкой')
+    parser.add_argument('hash_workers', type=int, nargs='*', default=[0, 1, 2])
+    parser.add_argument('--threads', type=int, default=8, help='потоков в процессе сервера')
+    parser.add_argument('--login-clients', type=int, default=6)
+    parser.add_argument('--page-clients', type=int, default=2)
+    parser.add_argument('--duration', type=int, default=10)
+    args = parser.parse_args()
+    print(f'ядер: {os.cpu_count()}, потоков сервера: {args.threads}, клиентов входа: {args.login_clients}, '
+          f'клиентов страницы {PAGE}: {args.page_clients}')
+    print(f'{"потоков хэширования":>20} {"входов/с":>9} {"страниц/с":>10} {"p50, мс":>8} {"p99, мс":>8} {"ошибок":>7}')
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'login.db')
+        seed.seed_database(database, items=1000, users=USERS, orders=1)
+        for hash_workers in args.hash_workers:
+            logins, pages, p50, p99, errors = run(database, hash_workers, args)
+            print(f'{hash_workers:>20} {logins:>9.1f} {pages:>10.1f} {p50:>8.1f} {p99:>8.1f} {errors:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# Замер построения индекса рекомендаций (см. data/recommendations.py) на синтетических заказах:
+# полное построение, добавление новых заказов и поиск соседей товара.
+# Популярность товаров убывает с номером товара: номер выбирается как ITEMS в случайной степени от 0 до 1,
+# поэтому немногие товары покупают часто, а большинство - редко, как в настоящих магазинах.
+# Запуск из корня проекта: python -m benchmarks.recommendations_benchmark [число заказов ...]
+import os
+import random
+import sys
+import tempfile
+import time
+from benchmarks.common import create_catalogue, measure
+from benchmarks.seed import insert_batches
+from data.order import Order, OrderItem
+from data.recommendations import Recommendations, build_index, update_index
+
+SIZES = [1000000]
+ITEMS = 100000
+# Доля заказов, добавляемых после полного построения
+UPDATE_SHARE = 0.01
+LOOKUPS = 10000
+
+
+def order_rows(rng, first_order, count):
+    for order_id in range(first_order, first_order + count):
+        for _ in range(rng.choice([1, 2, 2, 3, 3, 4, 5, 8])):
+            yield {'order_id': order_id, 'item_id': int(ITEMS ** rng.random()), 'currency_id': 1,
+                   'price': 100}
+
+
+def add_orders(engine, rng, first_order, count):
+    insert_batches(engine, Order.__table__, ({'id': i, 'user_id': 1} for i in range(first_order, first_order + count)))
+    insert_batches(engine, OrderItem.__table__, order_rows(rng, first_order, count))
+
+
+def main():
+    sizes = [int(i) for i in sys.argv[1:]] or SIZES
+    print(f'{"заказов":>10} {"построение, с":>14} {"пар":>10} {"добавление, с":>14} {"поиск p50, мкс":>15} '
+          f'{"поиск p99, мкс":>15}')
+    for size in sizes:
+        rng = random.Random(size)
+        with tempfile.TemporaryDirectory() as directory:
+            db_sess = create_catalogue(os.path.join(directory, 'bench.db'), ITEMS)
+            engine = db_sess.get_bind()
+            add_orders(engine, rng, 1, size)
+            index_directory = os.path.join(directory, 'recommendations')
+            with engine.connect() as connection:
+                start = time.perf_counter()
+                _, pairs = build_index(connection, index_directory)
+                build = time.perf_counter() - start
+            added = max(int(size * UPDATE_SHARE), 1)
+            add_orders(engine, rng, size + 1, added)
+            with engine.connect() as connection:
+                start = time.perf_counter()
+                update_index(connection, index_directory)
+                update = time.perf_counter() - start
+            index = Recommendations(index_directory)
+            item_ids = iter([rng.randint(1, ITEMS) for _ in range(LOOKUPS)])
+            p50, p99 = measure(lambda: index.get(next(item_ids)), LOOKUPS)
+            print(f'{size:>10} {build:>14.2f} {pairs:>10} {update:>14.2f} {p50 * 1000:>15.1f} {p99 * 1000:>15.1f}')
+            db_sess.close()
+
+
+if __name__ == '__main__':
+    main()
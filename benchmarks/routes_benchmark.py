@@ -0,0 +1,226 @@
+# Замер страниц сайта на синтетической базе заданного размера (см. benchmarks/seed.py).
+# Замеряются все маршруты, кроме выхода из аккаунта, выбора магазина, /metrics и выгрузки каталога.
+# Приложение вызывается в этом же процессе через тестовый клиент flask, с ключом --http
+# дополнительно нагружается настоящий сервер gunicorn (см. benchmarks/load_test.py).
+# Результат - JSON с гистограммами задержек и пропускной способностью по каждому маршруту,
+# его можно сравнить с результатом другой версии: python -m benchmarks.compare old.json new.json
+# Запуск из корня проекта: python -m benchmarks.routes_benchmark --items 100000
+# Результат по умолчанию записывается в benchmark-<коммит>.json
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+from benchmarks.common import WORDS
+from benchmarks import seed
+from benchmarks import load_test
+
+# Верхние границы интервалов гистограммы в миллисекундах
+BUCKETS = [0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+# Пользователь, от имени которого запрашиваются страницы личного кабинета
+BENCH_USER = 1
+
+
+# Маршруты: клиент и функция, возвращающая очередной запрос - адрес GET-запроса или пару (адрес, данные формы)
+# для POST-запроса. Функция вызывается вне замера, поэтому может готовить данные в базе, например заказ
+# для возврата. Клиенты: anonymous - без входа в аккаунт, user - от имени BENCH_USER,
+# visitor - отдельный клиент для входа и регистрации, чтобы они не меняли сессии остальных
+def make_routes(rng, options, order_ids):
+    from data import db_session, accounts, checkout, rates
+    from data.item import Item
+    from data.user import User
+    from data.user_cache import user_cache
+    items = options['items']
+    registered = iter(range(1, 10 ** 9))
+
+    # Новый заказ пользователя из одного случайного товара
+    def new_order():
+        with db_session.transaction() as db_sess:
+            accounts.add_to_cart(db_sess, BENCH_USER, db_sess.query(Item).get(rng.randint(1, items)))
+        order_id = checkout.place_order(BENCH_USER)
+        db_session.remove_session()
+        return order_id
+
+    # Бонус выдаётся один раз, поэтому перед каждым запросом отметка о нём снимается
+    def reset_bonus():
+        with db_session.transaction() as db_sess:
+            db_sess.query(User).filter(User.id == BENCH_USER).update({User.got_bonus: False},
+                                                                     synchronize_session=False)
+        db_session.remove_session()
+        user_cache.invalidate(BENCH_USER)
+        return '/get_bonus'
+
+    def account_form(email):
+        return {'email': email, 'password': seed.PASSWORD, 'password_again': seed.PASSWORD,
+                'name': 'Имя', 'surname': 'Фамилия', 'age': '30', 'address': 'Москва'}
+
+    return {
+        'main_page': ('anonymous', lambda: '/'),
+        'item_page': ('anonymous', lambda: f'/item/{rng.randint(1, items)}'),
+        'search_page': ('anonymous', lambda: f'/search?name={rng.choice(WORDS)[:4]}&category=0'),
+        'search_page_category': ('anonymous',
+                                 lambda: f'/search?name={rng.choice(WORDS)[:4]}&category={rng.randint(1, 18)}'),
+        'catalogue': ('anonymous', lambda: '/catalogue'),
+        'catalogue_category': ('anonymous', lambda: f'/category/{rng.randint(1, 18)}'),
+        'api_items': ('anonymous', lambda: '/api/v1/items'),
+        'faq': ('anonymous', lambda: '/faq'),
+        'delivery_info': ('anonymous', lambda: '/delivery_info'),
+        'login': ('visitor', lambda: ('/login', {'email': seed.email(rng.randint(1, options['users'])),
+                                                 'password': seed.PASSWORD})),
+        'register': ('visitor', lambda: ('/register', account_form(f'new{next(registered)}@bench.ru'))),
+        'user_page': ('user', lambda: '/user_page'),
+        'edit_account': ('user', lambda: ('/edit_account', account_form(seed.email(BENCH_USER)))),
+        'get_bonus': ('user', reset_bonus),
+        'shopping_cart': ('user', lambda: '/shopping_cart'),
+        'add_to_cart': ('user', lambda: f'/add_to_cart?item_id={rng.randint(1, items)}'),
+        'delete_from_cart': ('user', lambda: f'/delete_from_cart/{rng.randint(1, items)}'),
+        'orders': ('user', lambda: '/orders'),
+        'order_page': ('user', lambda: f'/order/{rng.choice(order_ids)}'),
+        'order': ('user', lambda: '/order'),
+        'refund_order': ('user', lambda: f'/refund_order/{new_order()}?key={checkout.new_key()}'),
+        'delete_order': ('user', lambda: f'/delete_order/{new_order()}'),
+        'exchange': ('user', lambda: '/exchange'),
+        'change_currencies': ('user', lambda: f'/change_currencies?first_id=1&second_id=2&amount=1.5'
+                                              f'&version={rates.current_version()}'),
+    }
+
+
+def histogram(times):
+    counts = [0] * (len(BUCKETS) + 1)
+    for value in times:
+        index = next((i for i, bound in enumerate(BUCKETS) if value <= bound), len(BUCKETS))
+        counts[index] += 1
+    return {'buckets_ms': BUCKETS + ['inf'], 'counts': counts}
+
+
+def summarize(times, elapsed, errors):
+    times = sorted(times)
+    return {
+        'requests': len(times),
+        'errors': errors,
+        'throughput_rps': round(len(times) / elapsed, 1) if elapsed else 0,
+        'mean_ms': round(sum(times) / len(times), 3),
+        'p50_ms': round(times[len(times) // 2], 3),
+        'p90_ms': round(times[int(len(times) * 0.9)], 3),
+        'p99_ms': round(times[int(len(times) * 0.99)], 3),
+        'max_ms': round(times[-1], 3),
+        'histogram': histogram(times),
+    }
+
+
+def send(client, request):
+    if isinstance(request, tuple):
+        return client.post(request[0], data=request[1])
+    return client.get(request)
+
+
+# Замер одного маршрута: прогревочные запросы, затем requests замеряемых запросов
+def measure_route(client, make_request, requests, warmup):
+    for _ in range(warmup):
+        send(client, make_request())
+    times = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        request = make_request()
+        request_start = time.perf_counter()
+        response = send(client, request)
+        times.append((time.perf_counter() - request_start) * 1000)
+        if response.status_code >= 400:
+            errors += 1
+    return summarize(times, time.perf_counter() - start, errors)
+
+
+def run_in_process(database, options, args):
+    from main import create_app
+    # Ограничения частоты запросов отключены: замеряется сама обработка, а не ответы 429
+    app = create_app({'DATABASE_URL': database, 'STORE_ID': 1, 'RATE_LIMITS': '',
+                      'PAGE_CACHE_SIZE': 1000 if args.page_cache else 0})
+    app.config['WTF_CSRF_ENABLED'] = False
+    rng = random.Random(args.seed)
+    clients = {'anonymous': app.test_client(), 'user': app.test_client(), 'visitor': app.test_client()}
+    response = clients['user'].post('/login', data={'email': seed.email(BENCH_USER), 'password': seed.PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError('не удалось войти в аккаунт пользователя для замеров')
+    order_ids = list(range((BENCH_USER - 1) * options['orders'] + 1, BENCH_USER * options['orders'] + 1)) or [1]
+    results = dict()
+    for name, (client, make_request) in make_routes(rng, options, order_ids).items():
+        if args.routes and name not in args.routes:
+            continue
+        results[name] = measure_route(clients[client], make_request, args.requests, args.warmup)
+        print(f'{name:>22}  p50 {results[name]["p50_ms"]:>9.2f} мс  p99 {results[name]["p99_ms"]:>9.2f} мс  '
+              f'{results[name]["throughput_rps"]:>8.1f} запр/с', file=sys.stderr)
+    return results
+
+
+# Нагрузка сервера gunicorn анонимными страницами
+def run_http(database, args):
+    process = load_test.run_server(args.http_workers, database)
+    base_url = f'http://127.0.0.1:{load_test.PORT}'
+    try:
+        load_test.wait_ready(base_url, process)
+        paths = ['/', '/item/1', '/item/2', '/faq', '/delivery_info', f'/search?name={quote(WORDS[0][:4])}&category=0']
+        rate, errors = load_test.http_load(base_url, paths, args.http_clients, args.http_duration)
+    finally:
+        process.terminate()
+        process.wait()
+    return {'workers': args.http_workers, 'clients': args.http_clients, 'duration_s': args.http_duration,
+            'throughput_rps': round(rate, 1), 'errors': errors}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер всех страниц сайта')
+    seed.add_arguments(parser)
+    parser.add_argument('--requests', type=int, default=200, help='замеряемых запросов на маршрут')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--routes', nargs='*', help='замерить только указанные маршруты')
+    parser.add_argument('--page-cache', action='store_true', help='включить кэш страниц для анонимных пользователей')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', help='готовая база, созданная benchmarks.seed, вместо новой')
+    parser.add_argument('--http', action='store_true', help='дополнительно нагрузить сервер gunicorn')
+    parser.add_argument('--http-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--http-clients', type=int, default=16)
+    parser.add_argument('--http-duration', type=int, default=10)
+    parser.add_argument('--output', help='файл для результата, по умолчанию benchmark-<коммит>.json')
+    args = parser.parse_args()
+    options = seed.scale_options(args)
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database
+        if database is None:
+            database = os.path.join(directory, 'bench.db')
+            start = time.perf_counter()
+            seed.seed_database(database, seed=args.seed, **options)
+            print(f'База создана за {time.perf_counter() - start:.1f} с', file=sys.stderr)
+        result = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'scale': options,
+            'requests_per_route': args.requests,
+            'page_cache': args.page_cache,
+            'routes': run_in_process(database, options, args),
+        }
+        if args.http:
+            result['http'] = run_http(database, args)
+    output = args.output or f'benchmark-{result["commit"] or "local"}.json'
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(result, file, ensure_ascii=False, indent=1, sort_keys=True)
+        file.write('\n')
+    print(f'Результат записан в {output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
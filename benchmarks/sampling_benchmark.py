@@ -0,0 +1,40 @@
+# Замер времени выборки товаров для главной страницы на каталогах разного размера.
+# Запуск из корня проекта: python -m benchmarks.sampling_benchmark
+import os
+import random
+import tempfile
+from benchmarks.common import create_catalogue, measure
+from data.item import Item
+from data.sampling import ItemSampler
+
+SIZES = [1000, 10000, 100000, 1000000]
+REPEATS = 200
+# Старый способ (загрузка и перемешивание всей таблицы) слишком медленный для больших каталогов
+FULL_SCAN_LIMIT = 100000
+
+
+def full_scan(db_sess):
+    items = db_sess.query(Item).all()
+    random.shuffle(items)
+    return items[:len(items) // 4]
+
+
+def main():
+    print(f'{"товаров":>10} {"выборка p50, мс":>16} {"выборка p99, мс":>16} {"старый p50, мс":>15}')
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            db_sess = create_catalogue(os.path.join(directory, 'bench.db'), size)
+            sampler = ItemSampler()
+            # Первое обращение строит массив идентификаторов и в замер не входит
+            sampler.sample(db_sess, 13)
+            p50, p99 = measure(lambda: sampler.sample(db_sess, 13), REPEATS)
+            old = '-'
+            if size <= FULL_SCAN_LIMIT:
+                old = f'{measure(lambda: full_scan(db_sess), 5)[0]:.2f}'
+                db_sess.expunge_all()
+            print(f'{size:>10} {p50:>16.3f} {p99:>16.3f} {old:>15}')
+            db_sess.close()
+
+
+if __name__ == '__main__':
+    main()
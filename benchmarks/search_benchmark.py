@@ -0,0 +1,41 @@
+# Сравнение поиска через FTS5 со старым поиском через LIKE на синтетическом каталоге.
+# Запуск из корня проекта: python -m benchmarks.search_benchmark [количество товаров]
+import os
+import random
+import sys
+import tempfile
+from benchmarks.common import WORDS, create_catalogue, measure
+from data.item import Item
+from data.search import search_items
+
+SIZE = 500000
+REPEATS = 50
+
+
+# Старый поиск: подстрока в названии, отдельный фильтр по категории
+def like_search(db_sess, text, category_id):
+    query = db_sess.query(Item).filter(Item.name.like(f'%{text}%'))
+    if category_id:
+        query = query.filter(Item.category == category_id)
+    return query.all()
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else SIZE
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'Создание каталога из {size} товаров...')
+        db_sess = create_catalogue(os.path.join(directory, 'bench.db'), size)
+        queries = [(random.choice(WORDS), random.choice([0, random.randint(1, 18)])) for _ in range(REPEATS)]
+        iterator = iter(queries * 2)
+        fts = measure(lambda: search_items(db_sess, *next(iterator)), REPEATS)
+        db_sess.expunge_all()
+        iterator = iter(queries * 2)
+        like = measure(lambda: like_search(db_sess, *next(iterator)), REPEATS)
+        db_sess.close()
+    print(f'{"способ":>8} {"p50, мс":>10} {"p99, мс":>10}')
+    print(f'{"FTS5":>8} {fts[0]:>10.2f} {fts[1]:>10.2f}')
+    print(f'{"LIKE":>8} {like[0]:>10.2f} {like[1]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
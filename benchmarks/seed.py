@@ -0,0 +1,121 @@
+# Создание синтетической базы магазина заданного размера: каталог, справочники, пользователи,
+# счета, корзины и заказы. Все пользователи получают пароль PASSWORD, почта пользователя N - userN@bench.ru
+# Запуск из корня проекта: python -m benchmarks.seed путь_к_базе [--items N] [--users N] ...
+import argparse
+import random
+import sqlalchemy as sa
+from werkzeug.security import generate_password_hash
+from benchmarks.common import create_catalogue, WORDS
+from data.cart import CartItem, CartTotal
+from data.category import Category
+from data.currency import Currency
+from data.order import Order, OrderItem, OrderSummary
+from data.store import Store
+from data.user import User
+from data.wallet import Wallet
+
+PASSWORD = 'Benchmark12'
+CATEGORIES = 18
+# Целые и дробные валюты, как в рабочей базе
+CURRENCIES = [('рубль', 'ruble.svg', False), ('доллар', 'dollar.png', False), ('биткоин', 'bitcoin.png', False),
+              ('лягушка', 'frog.png', True)]
+STORES = 3
+BATCH_SIZE = 20000
+START_MONEY = 10 ** 12
+
+
+def email(user_id):
+    return f'user{user_id}@bench.ru'
+
+
+def insert_batches(engine, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            with engine.begin() as conn:
+                conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        with engine.begin() as conn:
+            conn.execute(table.insert(), batch)
+
+
+# Строки корзины или заказа со случайными товарами и ценами
+def make_lines(rng, items, count):
+    for _ in range(count):
+        currency_id = rng.randint(1, len(CURRENCIES))
+        price = rng.randint(100, 100000)
+        yield rng.randint(1, items), currency_id, price
+
+
+def seed_database(path, items=10000, users=1000, cart_lines=5, orders=10, order_lines=3, seed=0):
+    rng = random.Random(seed)
+    create_catalogue(path, items).close()
+    engine = sa.create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        conn.execute(Category.__table__.insert(), [{'id': i, 'name': f'Категория {i}'}
+                                                   for i in range(1, CATEGORIES + 1)])
+        conn.execute(Currency.__table__.insert(), [{'id': i, 'name': name, 'logotype': logotype, 'is_integer': is_integer}
+                                                   for i, (name, logotype, is_integer) in enumerate(CURRENCIES, 1)])
+        conn.execute(Store.__table__.insert(), [{'id': i, 'name': f'Магазин {i}', 'slogan': ' '.join(WORDS[i:i + 3]),
+                                                 'logotype': 'ali_logo.png', 'icon': 'ali_icon.png'}
+                                                for i in range(1, STORES + 1)])
+    # Хэширование пароля медленное, поэтому у всех пользователей один и тот же хэш
+    hashed_password = generate_password_hash(PASSWORD)
+    insert_batches(engine, User.__table__, ({'id': i, 'name': f'Имя{i}', 'surname': f'Фамилия{i}', 'age': 30,
+                                             'address': 'Москва', 'email': email(i), 'hashed_password': hashed_password,
+                                             'got_bonus': 0} for i in range(1, users + 1)))
+    insert_batches(engine, Wallet.__table__, ({'user_id': i, 'currency_id': j, 'amount': START_MONEY}
+                                              for i in range(1, users + 1) for j in range(1, len(CURRENCIES) + 1)))
+
+    def cart_rows(totals):
+        for user_id in range(1, users + 1):
+            for item_id, currency_id, price in make_lines(rng, items, cart_lines):
+                totals[user_id, currency_id] = totals.get((user_id, currency_id), 0) + price
+                yield {'user_id': user_id, 'item_id': item_id, 'currency_id': currency_id, 'price': price}
+
+    totals = dict()
+    insert_batches(engine, CartItem.__table__, cart_rows(totals))
+    insert_batches(engine, CartTotal.__table__, ({'user_id': user_id, 'currency_id': currency_id, 'amount': amount}
+                                                 for (user_id, currency_id), amount in totals.items()))
+    order_ids = range(1, users * orders + 1)
+    insert_batches(engine, Order.__table__, ({'id': i, 'user_id': (i - 1) // orders + 1} for i in order_ids))
+    summaries = dict()
+
+    def order_rows():
+        for order_id in order_ids:
+            for item_id, currency_id, price in make_lines(rng, items, order_lines):
+                summaries[order_id, currency_id] = summaries.get((order_id, currency_id), 0) + price
+                yield {'order_id': order_id, 'item_id': item_id, 'currency_id': currency_id, 'price': price}
+
+    insert_batches(engine, OrderItem.__table__, order_rows())
+    insert_batches(engine, OrderSummary.__table__, ({'order_id': order_id, 'currency_id': currency_id, 'amount': amount}
+                                                    for (order_id, currency_id), amount in summaries.items()))
+    engine.dispose()
+
+
+def add_arguments(parser):
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--cart-lines', type=int, default=5, help='строк в корзине каждого пользователя')
+    parser.add_argument('--orders', type=int, default=10, help='заказов у каждого пользователя')
+    parser.add_argument('--order-lines', type=int, default=3, help='строк в каждом заказе')
+
+
+def scale_options(args):
+    return {'items': args.items, 'users': args.users, 'cart_lines': args.cart_lines, 'orders': args.orders,
+            'order_lines': args.order_lines}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Создание синтетической базы магазина')
+    parser.add_argument('path')
+    add_arguments(parser)
+    args = parser.parse_args()
+    seed_database(args.path, **scale_options(args))
+    print(f'База создана: {args.path}')
+
+
+if __name__ == '__main__':
+    main()
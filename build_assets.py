@@ -0,0 +1,95 @@
+# Сборка статических файлов для раздачи через web/static_files.py.
+# Каждый файл из static копируется в static/assets под именем с хэшем содержимого,
+# текстовые файлы дополнительно сжимаются в gzip и, если установлен пакет brotli, в brotli.
+# Соответствие исходных имён собранным записывается в static/assets/manifest.json.
+# Повторный запуск обрабатывает только новые и изменённые файлы.
+# Запуск: python build_assets.py
+import gzip
+import os
+import shutil
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from web.manifest import file_hash, load_manifest, save_manifest
+
+STATIC_DIR = 'static'
+OUTPUT_DIR = 'static/assets'
+MANIFEST = os.path.join(OUTPUT_DIR, 'manifest.json')
+# Каталоги, которые не нужно собирать: результат сборки и уже именованные по хэшу копии фотографий
+SKIP_DIRS = ['assets', 'img/derived']
+# Расширения файлов, которые имеет смысл сжимать. Картинки уже сжаты своим форматом
+COMPRESSIBLE = ['.css', '.js', '.json', '.svg', '.txt', '.html', '.xml', '.ico']
+# Сжатая копия сохраняется, только если она заметно меньше исходного файла
+MIN_RATIO = 0.9
+HASH_LENGTH = 12
+
+
+# Относительные пути всех исходных файлов в static
+def find_sources():
+    sources = []
+    for directory, dirs, files in os.walk(STATIC_DIR):
+        relative_dir = os.path.relpath(directory, STATIC_DIR).replace(os.sep, '/')
+        dirs[:] = [i for i in dirs if os.path.normpath(f'{relative_dir}/{i}').replace(os.sep, '/') not in SKIP_DIRS]
+        for name in files:
+            if not name.startswith('.'):
+                sources.append(os.path.normpath(f'{relative_dir}/{name}').replace(os.sep, '/'))
+    return sorted(sources)
+
+
+def is_built(entry):
+    path = os.path.join(STATIC_DIR, entry['path'])
+    return os.path.exists(path) and all(os.path.exists(f'{path}.{i}') for i in entry['encodings'])
+
+
+# Запись сжатой копии, если она оказалась достаточно маленькой
+def write_compressed(path, data, encoding, compressed):
+    if len(compressed) > len(data) * MIN_RATIO:
+        return False
+    with open(f'{path}.{encoding}', 'wb') as file:
+        file.write(compressed)
+    return True
+
+
+def build_asset(filename, source_hash):
+    stem, extension = os.path.splitext(filename)
+    target = f'assets/{stem}.{source_hash[:HASH_LENGTH]}{extension}'
+    path = os.path.join(STATIC_DIR, target)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    shutil.copyfile(os.path.join(STATIC_DIR, filename), path)
+    encodings = []
+    if extension.lower() in COMPRESSIBLE:
+        with open(path, 'rb') as file:
+            data = file.read()
+        # Время изменения не записывается в заголовок gzip, чтобы сборка была воспроизводимой
+        if write_compressed(path, data, 'gz', gzip.compress(data, compresslevel=9, mtime=0)):
+            encodings.append('gz')
+        if brotli is not None and write_compressed(path, data, 'br', brotli.compress(data, quality=11)):
+            encodings.append('br')
+    return {'hash': source_hash, 'path': target, 'encodings': encodings}
+
+
+def main():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    manifest = load_manifest(MANIFEST)
+    sources = find_sources()
+    built = 0
+    for filename in sources:
+        source_hash = file_hash(os.path.join(STATIC_DIR, filename))
+        entry = manifest.get(filename)
+        if entry and entry['hash'] == source_hash and is_built(entry):
+            continue
+        manifest[filename] = build_asset(filename, source_hash)
+        built += 1
+    # Записи об удалённых файлах убираются из манифеста. Старые собранные файлы остаются на диске,
+    # чтобы страницы, закэшированные до сборки, продолжали работать
+    for filename in set(manifest) - set(sources):
+        del manifest[filename]
+    save_manifest(MANIFEST, manifest)
+    if brotli is None:
+        print('Пакет brotli не установлен, файлы сжаты только в gzip')
+    print(f'Собрано файлов: {built}, всего в манифесте: {len(manifest)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Построение уменьшенных копий фотографий товаров из static/img/items.
+# Для каждой фотографии и каждого размера создаются файлы в WebP и запасном формате для старых браузеров:
+# JPEG для фотографий без прозрачности и PNG для остальных.
+# Имена файлов содержат хэш содержимого, поэтому их можно кэшировать в браузере бессрочно.
+# Повторный запуск обрабатывает только новые и изменённые фотографии.
+# Запуск: python build_images.py  (нужен пакет Pillow)
+import os
+import sys
+from web.manifest import file_hash, load_manifest, save_manifest
+
+SOURCE_DIR = 'static/img/items'
+OUTPUT_DIR = 'static/img/derived'
+MANIFEST = os.path.join(OUTPUT_DIR, 'manifest.json')
+# Максимальная ширина каждого размера в пикселях
+SIZES = {
+    'thumb': 200,
+    'card': 400,
+    'full': 800,
+}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+
+# Все файлы записи манифеста существуют на диске
+def is_built(entry):
+    return all(os.path.exists(os.path.join('static', path))
+               for variant in entry['variants'].values() for path in variant['files'].values())
+
+
+def build_image(image_module, photo_name, source_hash):
+    source = image_module.open(os.path.join(SOURCE_DIR, photo_name))
+    source.load()
+    has_alpha = source.mode in ('RGBA', 'LA', 'PA') or 'transparency' in source.info
+    extension, fallback_format = ('png', 'PNG') if has_alpha else ('jpg', 'JPEG')
+    entry = {'hash': source_hash, 'variants': dict()}
+    for size, max_width in SIZES.items():
+        image = source.copy()
+        # Фотографии только уменьшаются, маленькие остаются в исходном размере
+        if image.width > max_width:
+            image = image.resize((max_width, round(image.height * max_width / image.width)), image_module.LANCZOS)
+        if fallback_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        name = f'{source_hash[:16]}-{size}'
+        files = {
+            extension: f'img/derived/{name}.{extension}',
+            'webp': f'img/derived/{name}.webp',
+        }
+        if fallback_format == 'JPEG':
+            image.save(os.path.join('static', files[extension]), 'JPEG', quality=JPEG_QUALITY, optimize=True,
+                       progressive=True)
+        else:
+            image.save(os.path.join('static', files[extension]), 'PNG', optimize=True)
+        image.save(os.path.join('static', files['webp']), 'WEBP', quality=WEBP_QUALITY, method=6)
+        entry['variants'][size] = {'width': image.width, 'height': image.height, 'files': files}
+    return entry
+
+
+def main():
+    try:
+        from PIL import Image
+    except ImportError:
+        print('Для построения изображений нужен пакет Pillow: pip install Pillow')
+        sys.exit(1)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    manifest = load_manifest(MANIFEST)
+    photos = sorted(name for name in os.listdir(SOURCE_DIR) if not name.startswith('.'))
+    built = 0
+    for photo_name in photos:
+        source_hash = file_hash(os.path.join(SOURCE_DIR, photo_name))
+        entry = manifest.get(photo_name)
+        if entry and entry['hash'] == source_hash and is_built(entry):
+            continue
+        try:
+            manifest[photo_name] = build_image(Image, photo_name, source_hash)
+        except OSError as error:
+            print(f'Не удалось обработать {photo_name}: {error}')
+            continue
+        built += 1
+    # Записи об удалённых фотографиях убираются из манифеста
+    for photo_name in set(manifest) - set(photos):
+        del manifest[photo_name]
+    save_manifest(MANIFEST, manifest)
+    print(f'Обработано фотографий: {built}, всего в манифесте: {len(manifest)}')
+
+
+if __name__ == '__main__':
+    main()
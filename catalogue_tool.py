@@ -0,0 +1,271 @@
+# Массовая загрузка и выгрузка каталога: товаров, категорий, валют и магазинов в форматах CSV и NDJSON.
+# Файл читается построчно и записывается в базу пачками, каждая пачка - одна транзакция,
+# поэтому размер файла не ограничен памятью. Строки с уже существующим ключом обновляются.
+# Запуск из корня проекта:
+#   python catalogue_tool.py import items feed.csv [--key id] [--batch 20000]
+#   python catalogue_tool.py export items items.ndjson
+# Вместо имени файла можно указать -, тогда используются стандартные ввод и вывод
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+import sqlalchemy
+from sqlalchemy.dialects import sqlite, postgresql
+from data import db_session
+from data import search
+from data import listing
+from data import attributes
+from data import facets
+from data.item import Item
+from data.category import Category
+from data.currency import Currency
+from data.store import Store
+from data.pricing import ItemPrice
+
+TABLES = {
+    'items': Item.__table__,
+    'categories': Category.__table__,
+    'currencies': Currency.__table__,
+    'stores': Store.__table__,
+}
+INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+BATCH_SIZE = 20000
+# Наибольшее число параметров в одном запросе IN (...)
+IN_CHUNK = 500
+# Как часто выводить прогресс загрузки, в строках
+PROGRESS_EVERY = 100000
+
+
+def detect_format(path, file_format):
+    if file_format:
+        return file_format
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def open_file(path, mode):
+    if path == '-':
+        return os.fdopen(os.dup((sys.stdin if mode == 'r' else sys.stdout).fileno()), mode,
+                         encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+# Значение из CSV в тип столбца: пустая строка означает NULL
+def convert_value(column, value):
+    if value is None or value == '':
+        return None
+    python_type = column.type.python_type
+    if python_type is bool:
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return python_type(value)
+
+
+# Строки файла в виде словарей. В CSV набор столбцов задаёт заголовок,
+# в NDJSON у строк он может различаться, тогда строки попадают в разные пачки (см. batches)
+def read_rows(file, file_format, table):
+    if file_format == 'csv':
+        rows = csv.DictReader(file)
+        columns = rows.fieldnames or []
+        check_columns(table, columns)
+        for row in rows:
+            yield {name: convert_value(table.c[name], row[name]) for name in columns}
+        return
+    columns = None
+    for line in file:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if row.keys() != columns:
+            columns = row.keys()
+            check_columns(table, columns)
+        yield row
+
+
+def check_columns(table, columns):
+    unknown = [i for i in columns if i not in table.c]
+    if unknown:
+        raise ValueError(f'в таблице {table.name} нет столбцов: {", ".join(unknown)}')
+
+
+# Пачки строк с одинаковым набором столбцов: пачка вставляется одним запросом executemany
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        if batch and row.keys() != batch[0].keys():
+            yield batch
+            batch = []
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Запрос вставки пачки. Если в строках есть ключевой столбец, существующие строки обновляются
+# (INSERT ... ON CONFLICT DO UPDATE), причём изменяются только столбцы, присутствующие в файле.
+# Первичный ключ существующей строки не меняется, на него могут ссылаться другие таблицы
+def make_statement(connection, table, columns, key):
+    if key not in columns:
+        return table.insert()
+    insert = INSERTS[connection.dialect.name](table)
+    update = {name: insert.excluded[name] for name in columns if name != key and not table.c[name].primary_key}
+    if not update:
+        return insert.on_conflict_do_nothing(index_elements=[key])
+    return insert.on_conflict_do_update(index_elements=[key], set_=update)
+
+
+# Ключом, отличным от первичного, может быть только столбец с уникальным индексом
+def ensure_key_index(connection, table, key):
+    if table.c[key].primary_key:
+        return
+    connection.execute(sqlalchemy.text(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS ux_{table.name}_{key} ON {table.name} ({key})'))
+
+
+# Перед загрузкой в пустую таблицу SQLite её неуникальные индексы и триггеры удаляются:
+# построить индекс и поисковую таблицу один раз после загрузки быстрее, чем обновлять их на каждой строке.
+# Возвращает SQL удалённых объектов для восстановления
+def drop_secondary_objects(connection, table):
+    objects = connection.execute(sqlalchemy.text(
+        "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = :table AND sql IS NOT NULL "
+        "AND (type = 'trigger' OR (type = 'index' AND sql NOT LIKE 'CREATE UNIQUE%'))"),
+        {'table': table.name}).all()
+    for object_type, name, _ in objects:
+        connection.execute(sqlalchemy.text(f'DROP {object_type.upper()} {name}'))
+    return [sql for _, _, sql in objects]
+
+
+def restore_secondary_objects(connection, table, statements):
+    for sql in statements:
+        connection.execute(sqlalchemy.text(sql))
+    if table is Item.__table__:
+        if search.fts_enabled:
+            search.rebuild_search_index(connection)
+        attributes.rebuild_attributes(connection)
+        # Триггеры версии каталога и журнала изменений во время загрузки были удалены
+        facets.request_rebuild(connection)
+        connection.execute(sqlalchemy.text('UPDATE site_settings SET value = CAST(value AS INTEGER) + 1 '
+                                           'WHERE name = :name'), {'name': listing.CATALOGUE_VERSION})
+    connection.execute(sqlalchemy.text(f'ANALYZE {table.name}'))
+
+
+# Цены изменённых товаров удаляются и будут рассчитаны заново при следующем просмотре (см. data/pricing.py)
+def forget_prices(connection, batch):
+    ids = [row['id'] for row in batch]
+    for start in range(0, len(ids), IN_CHUNK):
+        connection.execute(ItemPrice.__table__.delete().where(ItemPrice.item_id.in_(ids[start:start + IN_CHUNK])))
+
+
+def import_table(table, path, file_format, key, batch_size):
+    with db_session.transaction() as db_sess:
+        connection = db_sess.connection()
+        if key in table.c:
+            ensure_key_index(connection, table, key)
+        bulk = (connection.dialect.name == 'sqlite'
+                and connection.execute(sqlalchemy.select(table).limit(1)).first() is None)
+        dropped = drop_secondary_objects(connection, table) if bulk else []
+    # Атрибуты товаров обновляются по пачкам, если известны идентификаторы строк, иначе перестраиваются в конце
+    rebuild = False
+    count = 0
+    start = time.perf_counter()
+    try:
+        with open_file(path, 'r') as file:
+            for batch in batches(read_rows(file, file_format, table), batch_size):
+                with db_session.transaction() as db_sess:
+                    connection = db_sess.connection()
+                    connection.execute(make_statement(connection, table, batch[0], key), batch)
+                    if table is Item.__table__ and 'id' in batch[0]:
+                        forget_prices(connection, batch)
+                    if table is Item.__table__ and 'description' in batch[0] and not bulk:
+                        if key == 'id' and 'id' in batch[0]:
+                            attributes.update_attributes(connection, [(row['id'], row['description']) for row in batch])
+                        else:
+                            rebuild = True
+                previous = count
+                count += len(batch)
+                if count // PROGRESS_EVERY > previous // PROGRESS_EVERY:
+                    print(f'{table.name}: {count} строк, {count / (time.perf_counter() - start):.0f} строк/с',
+                          file=sys.stderr)
+    finally:
+        # Индексы и триггеры восстанавливаются и после ошибки, загруженные строки остаются в базе
+        if bulk:
+            rebuild_start = time.perf_counter()
+            with db_session.transaction() as db_sess:
+                restore_secondary_objects(db_sess.connection(), table, dropped)
+            print(f'{table.name}: индексы перестроены за {time.perf_counter() - rebuild_start:.1f} с', file=sys.stderr)
+        elif rebuild:
+            with db_session.transaction() as db_sess:
+                attributes.rebuild_attributes(db_sess.connection())
+                facets.request_rebuild(db_sess.connection())
+    elapsed = time.perf_counter() - start
+    print(f'{table.name}: загружено {count} строк за {elapsed:.1f} с ({count / elapsed if elapsed else 0:.0f} строк/с)',
+          file=sys.stderr)
+    return count
+
+
+# Выгрузка таблицы в порядке первичного ключа. Строки читаются курсором пачками, без загрузки всей таблицы
+def export_table(table, path, file_format, batch_size):
+    start = time.perf_counter()
+    count = 0
+    db_sess = db_session.create_standalone_session()
+    try:
+        result = db_sess.connection().execution_options(stream_results=True).execute(
+            sqlalchemy.select(table).order_by(*table.primary_key.columns))
+        with open_file(path, 'w') as file:
+            columns = table.c.keys()
+            writer = None
+            if file_format == 'csv':
+                writer = csv.writer(file)
+                writer.writerow(columns)
+            for rows in iter(lambda: result.fetchmany(batch_size), []):
+                for row in rows:
+                    if writer is not None:
+                        writer.writerow(['' if value is None else value for value in row])
+                    else:
+                        file.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+                count += len(rows)
+    finally:
+        db_sess.close()
+    elapsed = time.perf_counter() - start
+    print(f'{table.name}: выгружено {count} строк за {elapsed:.1f} с ({count / elapsed if elapsed else 0:.0f} строк/с)',
+          file=sys.stderr)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Массовая загрузка и выгрузка каталога')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('table', choices=list(TABLES))
+    parser.add_argument('path', help='файл CSV или NDJSON, - для стандартного ввода или вывода')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='по умолчанию определяется по расширению файла')
+    parser.add_argument('--key', default='id', help='столбец, по которому находятся существующие строки')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE, help='строк в одной транзакции')
+    parser.add_argument('--database', default=os.environ.get('DATABASE_URL', 'db/store_database.db'))
+    args = parser.parse_args()
+    # Сообщение о подключении не должно попасть в выгрузку на стандартный вывод
+    with contextlib.redirect_stdout(sys.stderr):
+        db_session.global_init(args.database)
+    table = TABLES[args.table]
+    file_format = detect_format(args.path, args.format)
+    try:
+        if args.command == 'import':
+            if args.key not in table.c:
+                parser.error(f'в таблице {table.name} нет столбца {args.key}')
+            import_table(table, args.path, file_format, args.key, args.batch)
+            # Работающие процессы сервера держат список товаров и справочники в памяти
+            print('Чтобы сервер увидел новые данные, перезапустите его', file=sys.stderr)
+        else:
+            export_table(table, args.path, file_format, args.batch)
+    except (ValueError, sqlalchemy.exc.IntegrityError) as error:
+        print(f'Ошибка: {error}', file=sys.stderr)
+        sys.exit(1)
+    # Выгрузку на стандартный вывод прервал читатель, например head
+    except BrokenPipeError:
+        pass
+
+
+if __name__ == '__main__':
+    main()
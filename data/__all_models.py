@@ -1 +1 @@
-from . import store, item, currency, category, user
\ No newline at end of file
+from . import store, item, currency, category, user, wallet, cart, order, search, pricing, checkout, store_state, listing, rates, attributes, facets
\ No newline at end of file
@@ -0,0 +1,213 @@
+from .wallet import Wallet
+from .cart import CartItem
+from .order import Order, OrderItem, OrderSummary
+from .reference_cache import reference_cache
+from . import cart_totals
+from . import pricing
+
+# Все суммы в этом модуле - целые числа в минимальных единицах валюты (см. data/pricing.py)
+
+
+# Ошибка, возникающая при нехватке средств на счёте пользователя
+class NotEnoughMoneyError(Exception):
+    pass
+
+
+# Ошибка, возникающая, если строки корзины изменились или уже оформлены параллельным запросом
+class CartChangedError(Exception):
+    pass
+
+
+# Создание пустого счёта нового пользователя: по строке на каждую валюту
+def create_account(db_sess, user_id):
+    for currency_id in reference_cache.currencies():
+        db_sess.add(Wallet(user_id=user_id, currency_id=currency_id, amount=0))
+
+
+# Получение счёта пользователя в виде словаря {идентификатор валюты: сумма}
+def get_wallet(db_sess, user_id):
+    wallets = db_sess.query(Wallet).filter(Wallet.user_id == user_id).order_by(Wallet.currency_id)
+    return {wallet.currency_id: wallet.amount for wallet in wallets}
+
+
+# Зачисление денег на счёт одним UPDATE без чтения всего счёта
+def add_money(db_sess, user_id, currency_id, amount):
+    updated = db_sess.query(Wallet).filter(Wallet.user_id == user_id, Wallet.currency_id == currency_id).update(
+        {Wallet.amount: Wallet.amount + amount}, synchronize_session=False)
+    # Валюта могла появиться уже после регистрации пользователя
+    if not updated:
+        db_sess.add(Wallet(user_id=user_id, currency_id=currency_id, amount=amount))
+        db_sess.flush()
+
+
+# Списание денег со счёта. Проверка остатка и списание выполняются одним запросом,
+# поэтому параллельные запросы не могут увести счёт в минус
+def take_money(db_sess, user_id, currency_id, amount):
+    updated = db_sess.query(Wallet).filter(
+        Wallet.user_id == user_id, Wallet.currency_id == currency_id, Wallet.amount >= amount).update(
+        {Wallet.amount: Wallet.amount - amount}, synchronize_session=False)
+    if not updated:
+        raise NotEnoughMoneyError(currency_id)
+
+
+# Итоговая цена строки корзины или заказа с учётом скидки
+def line_total(line):
+    return line.price if line.discount_price is None else line.discount_price
+
+
+def _add_line(db_sess, user_id, item_id, currency_id, price, discount, discount_price):
+    line = CartItem(user_id=user_id, item_id=item_id, currency_id=currency_id, price=price,
+                    discount=discount, discount_price=discount_price)
+    db_sess.add(line)
+    cart_totals.add(db_sess, user_id, currency_id, line_total(line))
+
+
+# Добавление товара в корзину по цене из таблицы цен, а не по цене, присланной клиентом
+def add_to_cart(db_sess, user_id, item):
+    price = pricing.get_price(db_sess, item, save=False)
+    _add_line(db_sess, user_id, item.id, price.currency_id, price.price, price.discount, price.discount_price)
+
+
+# Получение строк корзины пользователя
+def get_cart(db_sess, user_id):
+    return db_sess.query(CartItem).filter(CartItem.user_id == user_id).order_by(CartItem.id).all()
+
+
+# Подсчёт суммы цен по валютам для списка строк корзины или заказа
+def get_summary(lines):
+    summary = dict()
+    for line in lines:
+        summary[line.currency_id] = summary.get(line.currency_id, 0) + line_total(line)
+    return summary
+
+
+# Удаление одной строки корзины с указанным товаром
+def delete_from_cart(db_sess, user_id, item_id):
+    line = db_sess.query(CartItem).filter(CartItem.user_id == user_id, CartItem.item_id == item_id).first()
+    # Сумма уменьшается, только если строку удалил именно этот запрос
+    if line and db_sess.query(CartItem).filter(CartItem.id == line.id).delete(synchronize_session=False):
+        cart_totals.subtract(db_sess, user_id, line.currency_id, line_total(line))
+
+
+# Оформление заказа из текущей корзины пользователя.
+# Затрагиваются только строки корзины, счёта по валютам корзины и строки нового заказа
+def checkout(db_sess, user_id):
+    # В SQLite запись заказа первой захватывает блокировку базы на запись, поэтому корзина не может
+    # измениться между чтением и списанием. В серверных базах блокируются только строки,
+    # и от повторного оформления той же корзины защищает проверка удалённых строк ниже
+    order = Order(user_id=user_id)
+    db_sess.add(order)
+    db_sess.flush()
+    lines = get_cart(db_sess, user_id)
+    summary = get_summary(lines)
+    # Строки корзины удаляются до списания средств. Запрос, оформляющий ту же корзину в другом процессе,
+    # удалит меньше строк, чем прочитал, и его транзакция откатится, поэтому корзина оплачивается один раз
+    if lines:
+        deleted = db_sess.query(CartItem).filter(CartItem.id.in_([line.id for line in lines])).delete(
+            synchronize_session=False)
+        if deleted != len(lines):
+            raise CartChangedError(user_id)
+    # Списание средств, при нехватке хотя бы одной валюты транзакция откатывается
+    for currency_id, amount in summary.items():
+        take_money(db_sess, user_id, currency_id, amount)
+    for currency_id, amount in summary.items():
+        db_sess.add(OrderSummary(order_id=order.id, currency_id=currency_id, amount=amount))
+        cart_totals.subtract(db_sess, user_id, currency_id, amount)
+    for line in lines:
+        db_sess.add(OrderItem(order_id=order.id, item_id=line.item_id, currency_id=line.currency_id,
+                              price=line.price, discount=line.discount, discount_price=line.discount_price))
+    return order.id
+
+
+# Получение заказа пользователя или None, если заказ принадлежит другому пользователю или не существует
+def get_order(db_sess, user_id, order_id):
+    return db_sess.query(Order).filter(Order.id == order_id, Order.user_id == user_id).first()
+
+
+# Получение идентификаторов всех заказов пользователя
+def get_order_ids(db_sess, user_id):
+    return [i for i, in db_sess.query(Order.id).filter(Order.user_id == user_id).order_by(Order.id)]
+
+
+def get_order_items(db_sess, order_id):
+    return db_sess.query(OrderItem).filter(OrderItem.order_id == order_id).order_by(OrderItem.id).all()
+
+
+def get_order_summary(db_sess, order_id):
+    summaries = db_sess.query(OrderSummary).filter(OrderSummary.order_id == order_id)
+    return {summary.currency_id: summary.amount for summary in summaries}
+
+
+# Удаление заказа вместе с его строками. Возвращает сумму заказа по валютам
+# или None, если заказ не найден или уже удалён параллельным запросом
+def delete_order(db_sess, user_id, order_id):
+    if not db_sess.query(Order).filter(Order.id == order_id, Order.user_id == user_id).delete(
+            synchronize_session=False):
+        return None
+    summary = get_order_summary(db_sess, order_id)
+    db_sess.query(OrderItem).filter(OrderItem.order_id == order_id).delete(synchronize_session=False)
+    db_sess.query(OrderSummary).filter(OrderSummary.order_id == order_id).delete(synchronize_session=False)
+    return summary
+
+
+# Возврат денег за заказ и его удаление в одной транзакции
+def refund_order(db_sess, user_id, order_id):
+    summary = delete_order(db_sess, user_id, order_id)
+    if summary is None:
+        return False
+    for currency_id, amount in summary.items():
+        add_money(db_sess, user_id, currency_id, amount)
+    return True
+
+
+# Ошибка в данных старого json-файла аккаунта. В сообщении указано поле с неверным значением
+class InvalidAccountData(ValueError):
+    pass
+
+
+# Перевод значения из json-файла в минимальные единицы валюты.
+# В старых файлах числа хранились строками, а отсутствие скидки - строкой 'None'
+def _parse_amount(value, currency_id, field):
+    currency = reference_cache.currencies().get(currency_id)
+    if currency is None:
+        raise InvalidAccountData(f'{field}: неизвестная валюта {currency_id}')
+    if value is None or value == 'None':
+        return None
+    return pricing.to_minor(float(value), currency)
+
+
+def _parse_discount(value):
+    if value is None or value == 'None':
+        return None
+    return int(float(value))
+
+
+# Импорт данных одного пользователя из старого формата accounts/user_{id}.json
+def import_account(db_sess, user_id, data):
+    for currency_id, amount in data.get('currencies', {}).items():
+        add_money(db_sess, user_id, int(currency_id), _parse_amount(amount, int(currency_id), f'currencies.{currency_id}'))
+    for i, line in enumerate(data.get('shopping_cart', {}).get('items', [])):
+        currency_id = int(line['currency_id'])
+        field = f'shopping_cart.items[{i}]'
+        _add_line(db_sess, user_id, int(line['item_id']), currency_id,
+                  _parse_amount(line['price'], currency_id, f'{field}.price'), _parse_discount(line['discount']),
+                  _parse_amount(line['discount_price'], currency_id, f'{field}.discount_price'))
+    for key, order_data in data.get('orders', {}).items():
+        # По возможности сохраняется старый номер заказа, чтобы не ломать ссылки
+        order = Order(user_id=user_id)
+        if not db_sess.query(Order).get(int(key)):
+            order.id = int(key)
+        db_sess.add(order)
+        db_sess.flush()
+        for currency_id, amount in order_data.get('summary', {}).items():
+            db_sess.add(OrderSummary(order_id=order.id, currency_id=int(currency_id),
+                                     amount=_parse_amount(amount, int(currency_id),
+                                                          f'orders.{key}.summary.{currency_id}')))
+        for i, line in enumerate(order_data.get('items', [])):
+            currency_id = int(line['currency_id'])
+            field = f'orders.{key}.items[{i}]'
+            db_sess.add(OrderItem(order_id=order.id, item_id=int(line['item_id']), currency_id=currency_id,
+                                  price=_parse_amount(line['price'], currency_id, f'{field}.price'),
+                                  discount=_parse_discount(line['discount']),
+                                  discount_price=_parse_amount(line['discount_price'], currency_id,
+                                                               f'{field}.discount_price')))
@@ -0,0 +1,131 @@
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+from .item import Item
+
+# Свойства товара разделены в описании символом ';'. Свойство вида "Название: значение" становится
+# атрибутом, по которому можно фильтровать и строить фасеты, остальные свойства хранятся как текст без названия
+SEPARATOR = ';'
+NAME_SEPARATOR = ':'
+# Название атрибута длиннее этого считается обычным текстом, в котором встретилось двоеточие
+MAX_NAME_LENGTH = 40
+BATCH_SIZE = 5000
+
+
+# Свойство товара, разобранное из описания один раз при сохранении товара
+class ItemAttribute(SqlAlchemyBase):
+    __tablename__ = 'item_attributes'
+    item_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('items.id'), primary_key=True)
+    position = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    name = sqlalchemy.Column(sqlalchemy.String, nullable=True)
+    value = sqlalchemy.Column(sqlalchemy.String, nullable=False)
+    # Поиск товаров по значению атрибута и подсчёт значений. Идентификатор товара входит в индекс,
+    # поэтому список товаров с данным значением читается из одного индекса, без обращения к таблице
+    __table_args__ = (sqlalchemy.Index('ix_item_attributes_name_value', 'name', 'value', 'item_id'),)
+
+
+# Разбор описания в список (название, значение). У свойства без названия название равно None
+def parse_properties(description):
+    result = []
+    for text in (description or '').split(SEPARATOR):
+        text = text.strip()
+        if not text:
+            continue
+        name, separator, value = text.partition(NAME_SEPARATOR)
+        if separator and 0 < len(name.strip()) <= MAX_NAME_LENGTH and value.strip():
+            result.append((name.strip(), value.strip()))
+        else:
+            result.append((None, text))
+    return result
+
+
+# Свойство в виде строки для показа на странице товара
+def display(name, value):
+    return value if name is None else f'{name}: {value}'
+
+
+def attribute_rows(item_id, description):
+    return [{'item_id': item_id, 'position': position, 'name': name, 'value': value}
+            for position, (name, value) in enumerate(parse_properties(description))]
+
+
+# Перезапись атрибутов товаров по списку (идентификатор, описание) внутри переданного соединения
+def update_attributes(connection, items):
+    table = ItemAttribute.__table__
+    items = list(items)
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        connection.execute(table.delete().where(table.c.item_id.in_([i for i, _ in batch])))
+        rows = [row for item_id, description in batch for row in attribute_rows(item_id, description)]
+        if rows:
+            connection.execute(table.insert(), rows)
+
+
+# Полное перестроение атрибутов всего каталога. Индекс значений строится один раз после вставки всех строк
+def rebuild_attributes(connection):
+    connection.execute(ItemAttribute.__table__.delete())
+    for index in ItemAttribute.__table__.indexes:
+        index.drop(connection)
+    items = Item.__table__
+    result = connection.execute(sqlalchemy.select(items.c.id, items.c.description))
+    count = 0
+    while True:
+        batch = result.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        rows = [row for item_id, description in batch for row in attribute_rows(item_id, description)]
+        if rows:
+            connection.execute(ItemAttribute.__table__.insert(), rows)
+        count += len(batch)
+    for index in ItemAttribute.__table__.indexes:
+        index.create(connection)
+    return count
+
+
+# Условие "у товара есть атрибут name со значением value" через индекс атрибутов
+def has_attribute(name, value):
+    return Item.id.in_(sqlalchemy.select(ItemAttribute.item_id).where(ItemAttribute.name == name,
+                                                                       ItemAttribute.value == value))
+
+
+# Фильтр из параметра адреса вида "Название:значение". Возвращает (название, значение) или None
+def parse_filter(text):
+    name, separator, value = (text or '').partition(NAME_SEPARATOR)
+    if separator and name.strip() and value.strip():
+        return name.strip(), value.strip()
+    return None
+
+
+# Атрибуты товаров {идентификатор товара: [(название, значение), ...]} в порядке свойств в описании
+def get_attributes(db_sess, item_ids):
+    result = {i: [] for i in item_ids}
+    rows = db_sess.query(ItemAttribute).filter(ItemAttribute.item_id.in_(list(result))).order_by(
+        ItemAttribute.item_id, ItemAttribute.position)
+    for row in rows:
+        result[row.item_id].append((row.name, row.value))
+    return result
+
+
+# Атрибуты существующей базы заполняются один раз, когда таблица только что создана
+def create_attributes(target, connection, **kwargs):
+    table = ItemAttribute.__table__
+    if connection.execute(sqlalchemy.select(table.c.item_id).limit(1)).first() is None:
+        rebuild_attributes(connection)
+
+
+def _item_inserted(mapper, connection, target):
+    update_attributes(connection, [(target.id, target.description)])
+
+
+def _item_updated(mapper, connection, target):
+    if sqlalchemy.inspect(target).attrs.description.history.has_changes():
+        update_attributes(connection, [(target.id, target.description)])
+
+
+def _item_deleted(mapper, connection, target):
+    connection.execute(ItemAttribute.__table__.delete().where(ItemAttribute.item_id == target.id))
+
+
+sqlalchemy.event.listen(SqlAlchemyBase.metadata, 'after_create', create_attributes)
+sqlalchemy.event.listen(Item, 'after_insert', _item_inserted)
+sqlalchemy.event.listen(Item, 'after_update', _item_updated)
+sqlalchemy.event.listen(Item, 'before_delete', _item_deleted)
@@ -0,0 +1,24 @@
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+
+
+# Строка корзины. Цены хранятся в минимальных единицах валюты (см. data/pricing.py)
+class CartItem(SqlAlchemyBase):
+    __tablename__ = 'cart_items'
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    user_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('users.id'), index=True, nullable=False)
+    item_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('items.id'), nullable=False)
+    currency_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('currencies.id'), nullable=False)
+    price = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    discount = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+    discount_price = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+
+
+# Текущая сумма корзины пользователя в одной валюте, обновляется при каждом добавлении и удалении
+class CartTotal(SqlAlchemyBase):
+    __tablename__ = 'cart_totals'
+    __table_args__ = (sqlalchemy.UniqueConstraint('user_id', 'currency_id'),)
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    user_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('users.id'), index=True, nullable=False)
+    currency_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('currencies.id'), nullable=False)
+    amount = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, default=0)
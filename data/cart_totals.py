@@ -0,0 +1,22 @@
+from .cart import CartTotal
+
+
+# Текущие суммы корзины по валютам в целых минимальных единицах.
+# Добавление и удаление строки меняет одну строку cart_totals, поэтому суммы не нужно
+# пересчитывать по всей корзине, а целочисленная арифметика не накапливает ошибку округления
+def add(db_sess, user_id, currency_id, amount):
+    updated = db_sess.query(CartTotal).filter(CartTotal.user_id == user_id, CartTotal.currency_id == currency_id).update(
+        {CartTotal.amount: CartTotal.amount + amount}, synchronize_session=False)
+    if not updated:
+        db_sess.add(CartTotal(user_id=user_id, currency_id=currency_id, amount=amount))
+        db_sess.flush()
+
+
+def subtract(db_sess, user_id, currency_id, amount):
+    add(db_sess, user_id, currency_id, -amount)
+
+
+# Получение сумм корзины {идентификатор валюты: сумма}. Валюты с нулевой суммой пропускаются
+def get_totals(db_sess, user_id):
+    totals = db_sess.query(CartTotal).filter(CartTotal.user_id == user_id, CartTotal.amount != 0)
+    return {total.currency_id: total.amount for total in totals.order_by(CartTotal.currency_id)}
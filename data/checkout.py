@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+import datetime
+import threading
+import uuid
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+from . import db_session
+from . import accounts
+from .user import User
+
+# Время хранения ключей идемпотентности
+IDEMPOTENCY_TTL = datetime.timedelta(days=1)
+
+
+# Ключ идемпотентности: повтор запроса с тем же ключом возвращает результат первого запроса,
+# а не выполняет операцию ещё раз. Ключ создаётся при отрисовке страницы со ссылкой на операцию
+class IdempotencyKey(SqlAlchemyBase):
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (sqlalchemy.UniqueConstraint('user_id', 'action', 'key'),)
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    user_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('users.id'), index=True, nullable=False)
+    action = sqlalchemy.Column(sqlalchemy.String, nullable=False)
+    key = sqlalchemy.Column(sqlalchemy.String, nullable=False)
+    result = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+    created_date = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now, nullable=False)
+
+
+# Новый ключ идемпотентности для ссылки на операцию
+def new_key():
+    return uuid.uuid4().hex
+
+
+# Блокировки по ключу. Блокировка существует, пока её держит или ждёт хотя бы один поток,
+# поэтому словарь не растёт с числом пользователей
+class KeyedLocks:
+    def __init__(self):
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._lock:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+# Операции со счётом одного пользователя внутри процесса выполняются по очереди.
+# Между процессами целостность обеспечивают транзакции базы и условные запросы в data/accounts.py,
+# результат которых проверяется: списание с проверкой остатка и удаление строк оформляемой корзины
+user_locks = KeyedLocks()
+
+
+def _find_result(db_sess, user_id, action, key):
+    return db_sess.query(IdempotencyKey.result).filter(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.action == action, IdempotencyKey.key == key).scalar()
+
+
+# Выполнение операции над счётом пользователя под его блокировкой в одной транзакции.
+# Если передан ключ, он записывается первым: параллельный запрос с тем же ключом
+# в другом процессе получит ошибку уникальности и вернёт результат первого запроса
+def _run(user_id, action, key, operation):
+    with user_locks.hold(user_id):
+        if key is None:
+            with db_session.transaction() as db_sess:
+                return operation(db_sess)
+        try:
+            with db_session.transaction() as db_sess:
+                result = _find_result(db_sess, user_id, action, key)
+                if result is not None:
+                    return result
+                record = IdempotencyKey(user_id=user_id, action=action, key=key)
+                db_sess.add(record)
+                db_sess.flush()
+                record.result = operation(db_sess)
+                # Старые ключи пользователя удаляются заодно с записью нового
+                db_sess.query(IdempotencyKey).filter(
+                    IdempotencyKey.user_id == user_id,
+                    IdempotencyKey.created_date < datetime.datetime.now() - IDEMPOTENCY_TTL).delete(
+                    synchronize_session=False)
+                return record.result
+        except sqlalchemy.exc.IntegrityError:
+            with db_session.transaction() as db_sess:
+                result = _find_result(db_sess, user_id, action, key)
+            # Ошибка уникальности возникла не из-за ключа
+            if result is None:
+                raise
+            return result
+
+
+# Оформление заказа из корзины. Возвращает номер заказа
+def place_order(user_id, key=None):
+    return _run(user_id, 'order', key, lambda db_sess: accounts.checkout(db_sess, user_id))
+
+
+# Возврат денег за заказ. Возвращает True, если заказ был найден и удалён
+def refund_order(user_id, order_id, key=None):
+    return bool(_run(user_id, f'refund:{order_id}', key,
+                     lambda db_sess: int(accounts.refund_order(db_sess, user_id, order_id))))
+
+
+# Обмен валют: списание amount_from первой валюты и зачисление amount_to второй
+def exchange_money(user_id, from_id, amount_from, to_id, amount_to):
+    def operation(db_sess):
+        accounts.take_money(db_sess, user_id, from_id, amount_from)
+        accounts.add_money(db_sess, user_id, to_id, amount_to)
+
+    return _run(user_id, 'exchange', None, operation)
+
+
+# Зачисление бонуса {идентификатор валюты: сумма} и отметка о его получении
+def give_bonus(user_id, amounts):
+    def operation(db_sess):
+        # Флаг меняется условным запросом до зачисления: из параллельных запросов, в том числе
+        # в разных процессах, бонус получит только первый. Возвращает True, если бонус выдан
+        granted = db_sess.query(User).filter(
+            User.id == user_id, sqlalchemy.or_(User.got_bonus.is_(None), User.got_bonus.is_(False))).update(
+            {User.got_bonus: True}, synchronize_session=False)
+        if not granted:
+            return False
+        for currency_id, amount in amounts.items():
+            accounts.add_money(db_sess, user_id, currency_id, amount)
+        return True
+
+    return _run(user_id, 'bonus', None, operation)
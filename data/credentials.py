@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import hmac
+import os
+import threading
+from werkzeug.security import generate_password_hash, check_password_hash, gen_salt
+
+# Способ хэширования новых паролей:
+#   pbkdf2:sha256:<итераций> - формат werkzeug, в нём хранятся все существующие пароли;
+#   scrypt:<n>:<r>:<p> - scrypt из hashlib, стоимость задаётся степенью двойки n и размером блока r
+DEFAULT_METHOD = 'pbkdf2:sha256:260000'
+SALT_LENGTH = 16
+
+
+# Все потоки проверки паролей заняты, а очередь заполнена
+class CredentialsBusy(Exception):
+    pass
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt.encode('utf-8'), n=n, r=r, p=p,
+                          maxmem=132 * n * r * p, dklen=64).hex()
+
+
+def make_hash(password, method):
+    if method.startswith('scrypt:'):
+        n, r, p = (int(i) for i in method.split(':')[1:])
+        salt = gen_salt(SALT_LENGTH)
+        return f'{method}${salt}${_scrypt(password, salt, n, r, p)}'
+    return generate_password_hash(password, method, SALT_LENGTH)
+
+
+def check_hash(hashed_password, password):
+    if not hashed_password:
+        return False
+    if hashed_password.startswith('scrypt:'):
+        try:
+            method, salt, expected = hashed_password.split('$', 2)
+            n, r, p = (int(i) for i in method.split(':')[1:])
+        except ValueError:
+            return False
+        return hmac.compare_digest(_scrypt(password, salt, n, r, p), expected)
+    return check_password_hash(hashed_password, password)
+
+
+# Хэширование и проверка паролей на отдельном ограниченном пуле потоков.
+# Хэширование намеренно медленное и почти целиком выполняется без GIL, поэтому
+# пул ограничивает, сколько процессорного времени вход в аккаунт может отнять у остальных запросов.
+# Если пул и очередь из max_pending задач заняты дольше timeout секунд, вызывается CredentialsBusy.
+# workers=0 выполняет хэширование прямо в потоке запроса
+class Credentials:
+    def __init__(self, method=DEFAULT_METHOD, workers=2, max_pending=32, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        # Потоки пула не переживают fork, дочерний процесс создаёт свой пул (см. gunicorn.conf.py)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def configure(self, method=None, workers=None, max_pending=None, timeout=None):
+        if method is not None:
+            self.method = method
+        if workers is not None:
+            self.workers = workers
+        if max_pending is not None:
+            self._slots = threading.BoundedSemaphore(max_pending)
+        if timeout is not None:
+            self.timeout = timeout
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _after_fork(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise CredentialsBusy()
+        try:
+            if self._executor is None:
+                with self._lock:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='credentials')
+            return self._executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash_password(self, password):
+        return self._run(make_hash, password, self.method)
+
+    def verify_password(self, hashed_password, password):
+        return self._run(check_hash, hashed_password, password)
+
+    # Хэш создан другим способом или с другой стоимостью и должен быть пересчитан при входе
+    def needs_rehash(self, hashed_password):
+        return not hashed_password or hashed_password.split('$', 1)[0] != self.method
+
+
+credentials = Credentials()
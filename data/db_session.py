@@ -1,14 +1,57 @@
+from contextlib import contextmanager
+import os
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
 import sqlalchemy.ext.declarative as dec
 
 SqlAlchemyBase = dec.declarative_base()
 
 __factory = None
 
+# Настройки подключения по умолчанию. Каждую можно переопределить аргументом global_init
+# или переменной окружения DB_<ИМЯ>, например DB_POOL_SIZE=10
+DEFAULT_OPTIONS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+    'pool_recycle': 3600,
+    'echo': False,
+    # Только для SQLite: режим журнала и время ожидания блокировки в миллисекундах
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+}
 
-def global_init(db_file):
+
+def _get_options(options):
+    result = dict()
+    for name, default in DEFAULT_OPTIONS.items():
+        value = options.get(name, os.environ.get(f'DB_{name.upper()}'))
+        if value is None:
+            value = default
+        elif isinstance(default, bool) and isinstance(value, str):
+            value = value.lower() in ('1', 'true', 'yes')
+        else:
+            value = type(default)(value)
+        result[name] = value
+    return result
+
+
+# Настройка каждого нового соединения с SQLite: журнал WAL позволяет читать во время записи,
+# а busy_timeout заставляет ждать освобождения блокировки вместо немедленной ошибки
+def _configure_sqlite(engine, journal_mode, busy_timeout):
+    @sa.event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout)}')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+
+# db_file - путь к файлу SQLite или полный адрес подключения, например postgresql://user@host/store
+def global_init(db_file, **options):
     global __factory
 
     if __factory:
@@ -17,17 +60,73 @@ def global_init(db_file):
     if not db_file or not db_file.strip():
         raise Exception("Необходимо указать файл базы данных.")
 
-    conn_str = f'sqlite:///{db_file.strip()}?check_same_thread=False'
-    print(f"Подключение к базе данных по адресу {conn_str}")
+    options = _get_options(options)
+    conn_str = db_file.strip()
+    if '://' not in conn_str:
+        conn_str = f'sqlite:///{conn_str}'
+    url = sa.engine.make_url(conn_str)
+    print(f"Подключение к базе данных по адресу {url!r}")
 
-    engine = sa.create_engine(conn_str, echo=False)
-    __factory = orm.sessionmaker(bind=engine)
+    engine_args = {'echo': options['echo']}
+    if url.get_backend_name() == 'sqlite':
+        engine_args['connect_args'] = {'check_same_thread': False}
+        # Для базы в памяти оставляется пул по умолчанию, иначе каждое соединение видело бы свою базу
+        if url.database and url.database != ':memory:':
+            engine_args.update(poolclass=QueuePool, pool_size=options['pool_size'],
+                               max_overflow=options['max_overflow'], pool_timeout=options['pool_timeout'])
+    else:
+        engine_args.update(pool_size=options['pool_size'], max_overflow=options['max_overflow'],
+                           pool_timeout=options['pool_timeout'], pool_recycle=options['pool_recycle'],
+                           pool_pre_ping=True)
+
+    engine = sa.create_engine(url, **engine_args)
+    if url.get_backend_name() == 'sqlite':
+        _configure_sqlite(engine, options['journal_mode'], options['busy_timeout'])
+    # Одна сессия на поток. В веб-приложении она закрывается в конце каждого запроса через remove_session
+    __factory = orm.scoped_session(orm.sessionmaker(bind=engine))
 
     from . import __all_models
 
     SqlAlchemyBase.metadata.create_all(engine)
 
 
+# Сессия текущего запроса (потока). Повторные вызовы в рамках запроса возвращают ту же сессию
 def create_session() -> Session:
     global __factory
-    return __factory()
\ No newline at end of file
+    return __factory()
+
+
+# Отдельная сессия, не связанная с текущим запросом, например для загрузки кэшей.
+# Закрывать её должен вызывающий код
+def create_standalone_session() -> Session:
+    global __factory
+    return __factory.session_factory()
+
+
+# Закрытие сессии текущего запроса с откатом незафиксированных изменений и возвратом соединения в пул
+def remove_session():
+    global __factory
+    if __factory:
+        __factory.remove()
+
+
+# Сброс пула соединений. Вызывается в дочернем процессе после fork (см. gunicorn.conf.py),
+# чтобы процессы не делили соединения, открытые до fork
+def dispose_connections():
+    global __factory
+    if __factory:
+        __factory.remove()
+        __factory.session_factory.kw['bind'].dispose()
+
+
+# Контекстный менеджер транзакции: все изменения внутри блока
+# либо фиксируются вместе, либо откатываются при любой ошибке
+@contextmanager
+def transaction():
+    session = create_session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
@@ -0,0 +1,239 @@
+import copy
+import threading
+import time
+import numpy as np
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+from . import db_session
+from .item import Item
+from .attributes import ItemAttribute
+
+# Фасеты каталога: число товаров каждой категории и каждого значения атрибута в любом наборе товаров.
+# Для каждого значения хранится битовая карта товаров (бит с номером идентификатора товара),
+# все карты уложены в одну матрицу, поэтому подсчёт по всем значениям - одна векторная операция.
+# Ключ значения - (название атрибута, значение), у категорий название None, как у свойств без названия,
+# которые в фасеты не попадают, поэтому категории не пересекаются с атрибутами
+CATEGORY = None
+# Значения атрибутов, попадающие в фасеты: не реже MIN_COUNT товаров и не больше MAX_VALUES самых частых.
+# Каждое значение занимает в памяти процесса (максимальный идентификатор товара / 8) байт
+MIN_COUNT = 2
+MAX_VALUES = 128
+# Запас места под новые товары, в битах
+HEADROOM = 4096
+# Журнал изменённых товаров хранит столько последних записей. Процесс, отставший сильнее,
+# а также получивший больше MAX_INCREMENTAL изменений за раз, перестраивает фасеты целиком
+CHANGE_LOG_SIZE = 10000
+MAX_INCREMENTAL = 1000
+# Журнал заполняется триггерами, поэтому в него попадают изменения из всех процессов.
+# Запись без товара (item_id IS NULL) требует полного перестроения, её оставляет массовая загрузка
+CHANGE_LOG_SCHEMA = [
+    f"CREATE TRIGGER IF NOT EXISTS items_changes_{event.lower()} AFTER {event} ON items BEGIN "
+    f"INSERT INTO item_changes (item_id) VALUES ({row}.id); "
+    f"DELETE FROM item_changes WHERE id <= last_insert_rowid() - {CHANGE_LOG_SIZE}; END"
+    for event, row in [('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old')]
+]
+
+
+# Журнал изменённых товаров. AUTOINCREMENT не даёт номерам записей повторяться после обрезки журнала
+class ItemChange(SqlAlchemyBase):
+    __tablename__ = 'item_changes'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    item_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+
+
+def create_change_log(target, connection, **kwargs):
+    if connection.dialect.name != 'sqlite':
+        return
+    for statement in CHANGE_LOG_SCHEMA:
+        connection.execute(sqlalchemy.text(statement))
+
+
+sqlalchemy.event.listen(SqlAlchemyBase.metadata, 'after_create', create_change_log)
+
+
+# Запись о необходимости перестроить фасеты, например после загрузки товаров в обход триггеров
+def request_rebuild(connection):
+    connection.execute(ItemChange.__table__.insert(), {'item_id': None})
+
+
+def _words(capacity):
+    return capacity // 64
+
+
+# Битовая карта из массива идентификаторов товаров. Идентификаторы за пределами карты отбрасываются
+def to_bitmap(ids, capacity):
+    bits = np.zeros(capacity, dtype=bool)
+    ids = np.asarray(ids, dtype=np.int64)
+    bits[ids[(ids >= 0) & (ids < capacity)]] = True
+    return np.packbits(bits, bitorder='little').view(np.uint64)
+
+
+# Результат запроса из целых чисел в виде массива строк x столбцов.
+# Строки читаются прямо из курсора драйвера, без объектов строк SQLAlchemy
+def fetch_array(db_sess, statement):
+    result = db_sess.connection().execute(statement)
+    try:
+        columns = len(result.keys())
+        return np.array(result.cursor.fetchall(), dtype=np.int64).reshape(-1, columns)
+    finally:
+        result.close()
+
+
+def to_ids(bitmap):
+    return np.flatnonzero(np.unpackbits(bitmap.view(np.uint8), bitorder='little'))
+
+
+# Снимок фасетов: ключи (фасет, значение), матрица битовых карт и счётчики по всему каталогу
+class FacetTable:
+    def __init__(self, keys, matrix, items, capacity, last_change):
+        self.keys = keys
+        self.positions = {key: i for i, key in enumerate(keys)}
+        self.matrix = matrix
+        self.items = items
+        self.capacity = capacity
+        self.last_change = last_change
+        self.totals = np.bitwise_count(matrix).sum(axis=1, dtype=np.int64)
+
+    # Число товаров каждого значения в наборе bitmap (None - во всём каталоге)
+    def counts(self, bitmap=None):
+        if bitmap is None:
+            values = self.totals
+        else:
+            values = np.bitwise_count(self.matrix & bitmap).sum(axis=1, dtype=np.int64)
+        result = dict()
+        for (facet, value), count in zip(self.keys, values.tolist()):
+            if count:
+                result.setdefault(facet, []).append((value, count))
+        for facet in result:
+            result[facet].sort(key=lambda entry: (-entry[1], str(entry[0])))
+        return result
+
+    # Битовая карта товаров, у которых есть все выбранные значения [(фасет, значение), ...].
+    # Значение, не попавшее в фасеты, даёт пустой набор
+    def select(self, selected, bitmap=None):
+        result = self.items.copy() if bitmap is None else bitmap & self.items
+        for key in selected:
+            position = self.positions.get(key)
+            if position is None:
+                return np.zeros_like(result)
+            result &= self.matrix[position]
+        return result
+
+    def bitmap(self, ids):
+        return to_bitmap(ids, self.capacity) & self.items
+
+    # Копия с собственными картами и счётчиками. Опубликованный снимок читается запросами без блокировки,
+    # поэтому изменения вносятся в копию, которая затем подменяет снимок целиком
+    def copy(self):
+        table = copy.copy(self)
+        table.matrix = self.matrix.copy()
+        table.items = self.items.copy()
+        table.totals = self.totals.copy()
+        return table
+
+    # Обновление одного товара: столбец товара очищается во всех картах и заполняется заново
+    def update_item(self, item_id, keys):
+        word, bit = divmod(item_id, 64)
+        mask = np.uint64(1 << bit)
+        column = self.matrix[:, word]
+        self.totals -= (column & mask != 0)
+        column &= ~mask
+        self.items[word] &= ~mask
+        if keys is None:
+            return
+        self.items[word] |= mask
+        for key in keys:
+            position = self.positions.get(key)
+            if position is not None:
+                column[position] |= mask
+                self.totals[position] += 1
+
+
+# Фасеты текущего процесса. Не чаще раза в ttl секунд журнал изменений проверяется на новые записи,
+# изменённые товары перечитываются из базы и обновляются по одному в копии снимка
+class FacetIndex:
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self._table = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def configure(self, ttl=None):
+        if ttl is not None:
+            self.ttl = ttl
+        self._table = None
+
+    def invalidate(self):
+        self._table = None
+
+    def get(self):
+        table = self._table
+        if table is not None and self._checked > time.monotonic():
+            return table
+        with self._lock:
+            db_sess = db_session.create_standalone_session()
+            try:
+                if self._table is None:
+                    self._table = self._build(db_sess)
+                else:
+                    self._refresh(db_sess)
+            finally:
+                db_sess.close()
+            self._checked = time.monotonic() + self.ttl
+            return self._table
+
+    @staticmethod
+    def _build(db_sess):
+        last_change = db_sess.query(sqlalchemy.func.max(ItemChange.id)).scalar() or 0
+        rows = fetch_array(db_sess, sqlalchemy.select(Item.id, sqlalchemy.func.coalesce(Item.category, -1)))
+        ids, categories = rows[:, 0], rows[:, 1]
+        capacity = ((int(ids.max()) if ids.size else 0) + HEADROOM) // 64 * 64 + 64
+        keys = []
+        bitmaps = []
+        for category_id in np.unique(categories[categories >= 0]).tolist():
+            keys.append((CATEGORY, category_id))
+            bitmaps.append(to_bitmap(ids[categories == category_id], capacity))
+        count = sqlalchemy.func.count(ItemAttribute.item_id)
+        values = db_sess.query(ItemAttribute.name, ItemAttribute.value).filter(
+            ItemAttribute.name.isnot(None)).group_by(ItemAttribute.name, ItemAttribute.value).having(
+            count >= MIN_COUNT).order_by(count.desc()).limit(MAX_VALUES).all()
+        for name, value in values:
+            keys.append((name, value))
+            bitmaps.append(to_bitmap(fetch_array(db_sess, sqlalchemy.select(ItemAttribute.item_id).where(
+                ItemAttribute.name == name, ItemAttribute.value == value))[:, 0], capacity))
+        matrix = np.array(bitmaps, dtype=np.uint64).reshape(len(keys), _words(capacity))
+        return FacetTable(keys, matrix, to_bitmap(ids, capacity), capacity, last_change)
+
+    def _refresh(self, db_sess):
+        table = self._table
+        changes = db_sess.query(ItemChange.id, ItemChange.item_id).filter(
+            ItemChange.id > table.last_change).order_by(ItemChange.id).limit(MAX_INCREMENTAL + 1).all()
+        if not changes:
+            return
+        item_ids = {i for _, i in changes}
+        # Журнал обрезан, изменений слишком много, нужна полная перестройка или новые товары не помещаются в карты
+        if changes[0][0] != table.last_change + 1 or len(changes) > MAX_INCREMENTAL or None in item_ids \
+                or max(item_ids) >= table.capacity:
+            self._table = self._build(db_sess)
+            return
+        current = dict(db_sess.query(Item.id, Item.category).filter(Item.id.in_(item_ids)))
+        # Новой категории нет в матрице
+        if any(i is not None and (CATEGORY, i) not in table.positions for i in current.values()):
+            self._table = self._build(db_sess)
+            return
+        attributes = dict()
+        for item_id, name, value in db_sess.query(ItemAttribute.item_id, ItemAttribute.name, ItemAttribute.value).filter(
+                ItemAttribute.item_id.in_(list(current)), ItemAttribute.name.isnot(None)):
+            attributes.setdefault(item_id, []).append((name, value))
+        table = table.copy()
+        for item_id in item_ids:
+            if item_id not in current:
+                table.update_item(item_id, None)
+            else:
+                table.update_item(item_id, [(CATEGORY, current[item_id])] + attributes.get(item_id, []))
+        table.last_change = changes[-1][0]
+        self._table = table
+
+
+facet_index = FacetIndex()
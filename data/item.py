@@ -7,7 +7,7 @@ class Item(SerializerMixin, SqlAlchemyBase):
     __tablename__ = 'items'
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     name = sqlalchemy.Column(sqlalchemy.String, nullable=True)
-    category = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('categories.id') ,nullable=True)
+    category = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('categories.id'), index=True, nullable=True)
     description = sqlalchemy.Column(sqlalchemy.String, nullable=True)
     special_price = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
     special_currency = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
@@ -0,0 +1,25 @@
+from .item import Item
+
+
+# Пакетная загрузка товаров по идентификаторам.
+# Все запрошенные идентификаторы загружаются одним запросом IN (...), а уже загруженные
+# товары запоминаются, поэтому повторные обращения в рамках запроса не ходят в базу
+class ItemLoader:
+    def __init__(self, db_sess):
+        self.db_sess = db_sess
+        self._items = dict()
+
+    # Получение словаря {идентификатор: товар}. Несуществующие товары в словарь не попадают
+    def load_many(self, ids):
+        ids = set(ids)
+        missing = [i for i in ids if i not in self._items]
+        if missing:
+            for item in self.db_sess.query(Item).filter(Item.id.in_(missing)):
+                self._items[item.id] = item
+            # Отсутствующие в базе товары тоже запоминаются, чтобы не запрашивать их снова
+            for i in missing:
+                self._items.setdefault(i, None)
+        return {i: self._items[i] for i in ids if self._items[i] is not None}
+
+    def load(self, item_id):
+        return self.load_many([item_id]).get(item_id)
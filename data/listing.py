@@ -0,0 +1,147 @@
+from collections import namedtuple
+import base64
+import json
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+from .item import Item
+from .store_state import SiteSetting
+from .attributes import has_attribute
+
+# Столбец ключа страницы: выражение в запросе, атрибут товара и значение, заменяющее NULL.
+# Замена меньше любого настоящего значения (номера категорий начинаются с 1), поэтому товары
+# без категории или названия идут в начале списка, а не выпадают из него при сравнении с NULL
+KeyColumn = namedtuple('KeyColumn', ['expression', 'attribute', 'null'])
+
+
+def _key_column(column, null=None):
+    expression = column if null is None else sqlalchemy.func.coalesce(column, sqlalchemy.literal_column(repr(null)))
+    return KeyColumn(expression, column.key, null)
+
+
+CATEGORY_KEY = _key_column(Item.category, 0)
+NAME_KEY = _key_column(Item.name, '')
+ID_KEY = _key_column(Item.id)
+# Индексы для постраничного просмотра каталога повторяют выражения ключей. Индекс SQLite неявно
+# содержит rowid (items.id), поэтому ix_items_category_key упорядочен как (категория, id),
+# ix_items_category_name_key - как (category, название, id), а ix_items_name - как (название, id).
+# Прежний индекс (category, name) не подходит для выражения с coalesce и удаляется
+LISTING_INDEXES = [
+    'DROP INDEX IF EXISTS ix_items_category_name',
+    "CREATE INDEX IF NOT EXISTS ix_items_category_key ON items (coalesce(category, 0))",
+    "CREATE INDEX IF NOT EXISTS ix_items_category_name_key ON items (category, coalesce(name, ''))",
+    "CREATE INDEX IF NOT EXISTS ix_items_name ON items (coalesce(name, ''), id)",
+]
+# Версия каталога в таблице site_settings. Триггеры увеличивают её при любом изменении товаров,
+# в том числе сделанном в обход ORM, поэтому версия общая для всех процессов
+CATALOGUE_VERSION = 'catalogue_version'
+VERSION_SCHEMA = [
+    f"INSERT OR IGNORE INTO site_settings (name, value) VALUES ('{CATALOGUE_VERSION}', '0')",
+] + [
+    f"CREATE TRIGGER IF NOT EXISTS items_version_{event.lower()} AFTER {event} ON items BEGIN "
+    f"UPDATE site_settings SET value = CAST(value AS INTEGER) + 1 WHERE name = '{CATALOGUE_VERSION}'; END"
+    for event in ['INSERT', 'UPDATE', 'DELETE']
+]
+# Порядок сортировки всего каталога: столбцы ключа страницы, последний из них - уникальный items.id.
+# Без фильтра по категории сортировка по названию идёт по названию, а не по категории
+SORTS = {
+    'id': [CATEGORY_KEY, ID_KEY],
+    'name': [NAME_KEY, ID_KEY],
+}
+# Порядок сортировки внутри одной категории: категория у всех товаров одна и в ключ не входит
+CATEGORY_SORTS = {
+    'id': [ID_KEY],
+    'name': [NAME_KEY, ID_KEY],
+}
+MAX_PER_PAGE = 100
+
+# Страница списка товаров: товары и токен следующей страницы (None, если страница последняя)
+Page = namedtuple('Page', ['items', 'next_token'])
+
+
+# Ошибка разбора токена страницы
+class InvalidPageToken(ValueError):
+    pass
+
+
+def create_listing_indexes(target, connection, **kwargs):
+    if connection.dialect.name != 'sqlite':
+        return
+    for statement in LISTING_INDEXES + VERSION_SCHEMA:
+        connection.execute(sqlalchemy.text(statement))
+
+
+sqlalchemy.event.listen(SqlAlchemyBase.metadata, 'after_create', create_listing_indexes)
+
+
+# Токен страницы содержит ключ последнего товара предыдущей страницы, а также сортировку
+# и категорию, для которых он выдан. Токен не зависит от числа товаров перед ним,
+# поэтому добавление и удаление товаров не сдвигает уже открытые страницы
+def encode_token(sort, category_id, key):
+    data = json.dumps({'s': sort, 'c': category_id, 'k': key}, ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token, sort, category_id):
+    columns = _key_columns(sort, category_id)
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8'))
+        key = data['k']
+        valid = (data['s'] == sort and data['c'] == category_id and isinstance(key, list)
+                 and len(key) == len(columns) and all(map(_valid_key_value, key, columns)))
+    except (ValueError, KeyError, TypeError):
+        raise InvalidPageToken(token)
+    if not valid:
+        raise InvalidPageToken(token)
+    return key
+
+
+# Значение ключа должно иметь тип своего столбца: целое число, помещающееся в INTEGER базы, или строку.
+# true и false из JSON не подходят, хотя bool в Python - подкласс int
+def _valid_key_value(value, column):
+    if type(value) is not column.expression.type.python_type:
+        return False
+    return not isinstance(value, int) or -2 ** 63 <= value < 2 ** 63
+
+
+def _key_columns(sort, category_id):
+    return SORTS[sort] if category_id is None else CATEGORY_SORTS[sort]
+
+
+def _key_value(item, column):
+    value = getattr(item, column.attribute)
+    return column.null if value is None else value
+
+
+# Страница товаров каталога или категории по ключу, без OFFSET: запрос продолжает обход индекса
+# с места, где закончилась предыдущая страница, поэтому любая страница читает не больше per_page + 1 строк
+# подходящих товаров. attributes - список (название, значение), которые должны быть у товара
+def list_items(db_sess, category_id=None, sort='id', token=None, per_page=24, attributes=()):
+    if sort not in SORTS:
+        raise InvalidPageToken(sort)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    columns = _key_columns(sort, category_id)
+    expressions = [column.expression for column in columns]
+    query = db_sess.query(Item)
+    if category_id is not None:
+        query = query.filter(Item.category == category_id)
+    query = query.filter(*[has_attribute(name, value) for name, value in attributes])
+    if token:
+        key = decode_token(token, sort, category_id)
+        # Сравнение строк целиком SQLite не сводит к диапазону индекса по выражению, поэтому отдельное
+        # условие на первый столбец ключа позволяет начать обход индекса сразу с нужного места
+        query = query.filter(expressions[0] >= key[0],
+                             sqlalchemy.tuple_(*expressions) > sqlalchemy.tuple_(*key))
+    # Лишняя строка показывает, есть ли следующая страница
+    items = query.order_by(*expressions).limit(per_page + 1).all()
+    next_token = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_token = encode_token(sort, category_id, [_key_value(last, column) for column in columns])
+    return Page(items, next_token)
+
+
+# Текущая версия каталога или None, если база не поддерживает триггеры версии
+def catalogue_version(db_sess):
+    setting = db_sess.query(SiteSetting).get(CATALOGUE_VERSION)
+    return setting.value if setting is not None else None
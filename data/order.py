@@ -0,0 +1,55 @@
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+
+
+# Суммы хранятся в минимальных единицах валюты (см. data/pricing.py).
+# AUTOINCREMENT не даёт SQLite повторно выдать номер удалённого последнего заказа (возврат денег):
+# номера заказов только растут, на этом построено добавление новых заказов в data/recommendations.py
+class Order(SqlAlchemyBase):
+    __tablename__ = 'orders'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    user_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('users.id'), index=True, nullable=False)
+
+
+class OrderItem(SqlAlchemyBase):
+    __tablename__ = 'order_items'
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    order_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('orders.id'), index=True, nullable=False)
+    item_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('items.id'), nullable=False)
+    currency_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('currencies.id'), nullable=False)
+    price = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    discount = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+    discount_price = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+
+
+class OrderSummary(SqlAlchemyBase):
+    __tablename__ = 'order_summaries'
+    __table_args__ = (sqlalchemy.UniqueConstraint('order_id', 'currency_id'),)
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    order_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('orders.id'), index=True, nullable=False)
+    currency_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('currencies.id'), nullable=False)
+    amount = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+
+
+# Таблица orders, созданная без AUTOINCREMENT, пересоздаётся с теми же заказами. Номер последнего
+# заказа становится начальным значением последовательности, поэтому новые номера будут больше
+def upgrade_orders_table(target, connection, **kwargs):
+    if connection.dialect.name != 'sqlite':
+        return
+    sql = connection.execute(sqlalchemy.text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'orders'")).scalar()
+    if sql is None or 'AUTOINCREMENT' in sql.upper():
+        return
+    table = Order.__table__
+    columns = ', '.join(column.name for column in table.columns)
+    create = str(sqlalchemy.schema.CreateTable(table).compile(dialect=connection.dialect))
+    connection.execute(sqlalchemy.text(create.replace('CREATE TABLE orders (', 'CREATE TABLE orders_new (', 1)))
+    connection.execute(sqlalchemy.text(f'INSERT INTO orders_new ({columns}) SELECT {columns} FROM orders'))
+    # Индексы удаляются вместе со старой таблицей и создаются заново для новой
+    connection.execute(sqlalchemy.text('DROP TABLE orders'))
+    connection.execute(sqlalchemy.text('ALTER TABLE orders_new RENAME TO orders'))
+    for index in table.indexes:
+        index.create(connection)
+
+sqlalchemy.event.listen(SqlAlchemyBase.metadata, 'after_create', upgrade_orders_table)
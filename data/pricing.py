@@ -0,0 +1,182 @@
+import os
+import time
+import numpy as np
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+from .item import Item
+from .reference_cache import reference_cache
+
+# Цены хранятся в целых минимальных единицах валюты: сотых долях для дробных валют
+# и целых единицах для валют с is_integer
+FRACTIONAL_SCALE = 100
+# Вероятность скидки и её максимальный размер в процентах
+DISCOUNT_CHANCE = 10
+MAX_DISCOUNT = 99
+BATCH_SIZE = 5000
+# Базовая цена без специальной: целое от 0 до MAX_VALUE, делённое на 10 в случайной степени
+# от 0 до числа его цифр
+MAX_VALUE = 99999999
+POWERS_OF_TEN = 10 ** np.arange(1, len(str(MAX_VALUE)), dtype=np.int64)
+# Номера случайных величин товара: каждая берётся из своего хэша, поэтому не зависит от остальных
+DRAW_CURRENCY, DRAW_VALUE, DRAW_EXPONENT, DRAW_HAS_DISCOUNT, DRAW_DISCOUNT = range(5)
+
+
+# Цена товара, назначенная на определённую эпоху.
+# На каждый товар приходится одна строка, поэтому цена находится одним запросом по первичному ключу
+class ItemPrice(SqlAlchemyBase):
+    __tablename__ = 'item_prices'
+    item_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('items.id'), primary_key=True)
+    epoch = sqlalchemy.Column(sqlalchemy.Integer, index=True, nullable=False)
+    currency_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('currencies.id'), nullable=False)
+    price = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    discount = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+    discount_price = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+
+
+# Эпоха цен: постоянная (PRICING_EPOCH) или меняющаяся каждые PRICING_PERIOD секунд
+settings = {
+    'epoch': int(os.environ.get('PRICING_EPOCH', 0)),
+    'period': int(os.environ.get('PRICING_PERIOD', 0)),
+}
+
+
+def configure(epoch=None, period=None):
+    if epoch is not None:
+        settings['epoch'] = epoch
+    if period is not None:
+        settings['period'] = period
+
+
+def current_epoch():
+    if settings['period']:
+        return int(time.time() // settings['period'])
+    return settings['epoch']
+
+
+def currency_scale(currency):
+    return 1 if currency.is_integer else FRACTIONAL_SCALE
+
+
+# Перевод цены из минимальных единиц в отображаемое значение
+def to_units(amount, currency):
+    if amount is None:
+        return None
+    scale = currency_scale(currency)
+    return amount // scale if scale == 1 else amount / scale
+
+
+# Перевод отображаемого значения в минимальные единицы
+def to_minor(value, currency):
+    return int(round(value * currency_scale(currency)))
+
+
+# Псевдослучайные числа uint64 для массива товаров: хэш splitmix64 от эпохи, товара и номера величины.
+# Результат зависит только от аргументов, поэтому одна эпоха даёт одинаковые цены во всех процессах,
+# а цены всего каталога считаются сразу массивами numpy
+def _random(epoch, item_ids, draw):
+    with np.errstate(over='ignore'):
+        x = (item_ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+             + np.uint64(epoch % 2 ** 32 * 8 + draw) * np.uint64(0xD1B54A32D192ED03))
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+# Случайные целые в диапазоне [low, high] для каждого товара, high может быть массивом
+def _randint(epoch, item_ids, draw, low, high):
+    return low + (_random(epoch, item_ids, draw) % (np.asarray(high) - low + 1).astype(np.uint64)).astype(np.int64)
+
+
+# Детерминированный расчёт цен пачки товаров. Аргументы - последовательности одной длины,
+# отсутствие специальной цены обозначается None. Возвращает словарь массивов по столбцам item_prices,
+# скидка и цена со скидкой действуют только там, где has_discount
+def calculate_prices(item_ids, special_prices, special_currencies, epoch, currencies):
+    item_ids = np.asarray(item_ids, dtype=np.int64)
+    currency_ids = np.array(sorted(currencies), dtype=np.int64)
+    scales = np.array([currency_scale(currencies[i]) for i in sorted(currencies)], dtype=np.int64)
+    special = np.array([price is not None and currency in currencies
+                        for price, currency in zip(special_prices, special_currencies)], dtype=bool)
+    special_price = np.array([price if has else 0 for price, has in zip(special_prices, special)], dtype=np.int64)
+    special_currency = np.array([currency if has else currency_ids[0]
+                                 for currency, has in zip(special_currencies, special)], dtype=np.int64)
+    # Случайная валюта и значение для товаров без специальной цены
+    random_index = _randint(epoch, item_ids, DRAW_CURRENCY, 0, len(currency_ids) - 1)
+    value = _randint(epoch, item_ids, DRAW_VALUE, 0, MAX_VALUE)
+    digits = np.searchsorted(POWERS_OF_TEN, value, side='right') + 1
+    exponent = _randint(epoch, item_ids, DRAW_EXPONENT, 0, digits)
+    currency_index = np.where(special, np.searchsorted(currency_ids, special_currency), random_index)
+    scale = scales[currency_index]
+    # Округление как в to_minor: round в Python и np.rint округляют половину к чётному
+    random_price = np.rint(value / 10.0 ** exponent * scale).astype(np.int64)
+    price = np.where(special, special_price * scale, random_price)
+    has_discount = _randint(epoch, item_ids, DRAW_HAS_DISCOUNT, 1, DISCOUNT_CHANCE) == DISCOUNT_CHANCE
+    discount = _randint(epoch, item_ids, DRAW_DISCOUNT, 1, MAX_DISCOUNT)
+    return {'item_id': item_ids, 'currency_id': currency_ids[currency_index], 'price': price,
+            'has_discount': has_discount, 'discount': discount, 'discount_price': price * (100 - discount) // 100}
+
+
+# Строки таблицы item_prices из столбцов, рассчитанных calculate_prices
+def _price_rows(prices, epoch):
+    columns = [prices[name].tolist() for name in ('item_id', 'currency_id', 'price', 'has_discount', 'discount',
+                                                   'discount_price')]
+    return [{'item_id': item_id, 'epoch': epoch, 'currency_id': currency_id, 'price': price,
+             'discount': discount if has_discount else None,
+             'discount_price': discount_price if has_discount else None}
+            for item_id, currency_id, price, has_discount, discount, discount_price in zip(*columns)]
+
+
+# Цена одного товара, совпадающая с ценой, которую назначает пакетный пересчёт
+def calculate_price(item_id, special_price, special_currency, epoch, currencies):
+    return _price_rows(calculate_prices([item_id], [special_price], [special_currency], epoch, currencies), epoch)[0]
+
+
+# Цена товара на текущую эпоху. Если цена ещё не назначена или устарела, она рассчитывается.
+# При save=True рассчитанная цена сохраняется в отдельной фиксации сессии, при save=False
+# возвращается несохранённый объект, что позволяет получать цену внутри чужой транзакции
+def get_price(db_sess, item, save=True):
+    epoch = current_epoch()
+    price = db_sess.query(ItemPrice).get(item.id)
+    if price is None or price.epoch != epoch:
+        values = calculate_price(item.id, item.special_price, item.special_currency, epoch,
+                                 reference_cache.currencies())
+        if not save:
+            return ItemPrice(**values)
+        price = db_sess.merge(ItemPrice(**values))
+        try:
+            db_sess.commit()
+        # Цену этого товара одновременно сохранил другой запрос, результат расчёта у них совпадает
+        except sqlalchemy.exc.IntegrityError:
+            db_sess.rollback()
+            price = db_sess.query(ItemPrice).get(item.id)
+    return price
+
+
+# Пересчёт цен всего каталога на указанную эпоху: цены пачки товаров считаются массивами numpy
+# и записываются одной пакетной вставкой.
+# Вызывается внутри транзакции, например: with engine.begin() as connection
+def reprice_all(connection, epoch=None):
+    epoch = current_epoch() if epoch is None else epoch
+    currencies = reference_cache.currencies()
+    items = Item.__table__
+    connection.execute(ItemPrice.__table__.delete())
+    insert = ItemPrice.__table__.insert()
+    rows = connection.execute(sqlalchemy.select(items.c.id, items.c.special_price, items.c.special_currency))
+    count = 0
+    while True:
+        batch = rows.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        item_ids, special_prices, special_currencies = zip(*batch)
+        prices = calculate_prices(item_ids, special_prices, special_currencies, epoch, currencies)
+        connection.execute(insert, _price_rows(prices, epoch))
+        count += len(batch)
+    return count
+
+
+# Изменение или удаление товара сбрасывает его цену, она будет рассчитана заново при следующем просмотре
+def _forget_price(mapper, connection, target):
+    connection.execute(ItemPrice.__table__.delete().where(ItemPrice.item_id == target.id))
+
+
+sqlalchemy.event.listen(Item, 'after_update', _forget_price)
+sqlalchemy.event.listen(Item, 'before_delete', _forget_price)
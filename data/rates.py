@@ -0,0 +1,160 @@
+import datetime
+import os
+import random
+import threading
+import time
+import numpy as np
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+from . import db_session
+from . import pricing
+from .reference_cache import reference_cache
+
+# Курсы валют. Для каждой версии курсов хранится стоимость единицы каждой валюты в условных единицах,
+# из которой строится плотная матрица курсов N x N. Курсы любых двух валют согласованы между собой,
+# поэтому цепочка обменов не может дать больше денег, чем прямой обмен
+
+# Диапазон стоимости единицы валюты: от 10^-2 до 10^3 условных единиц
+MIN_EXPONENT = -2
+MAX_EXPONENT = 3
+# Результат пересчёта должен быть меньше по модулю: большие значения не помещаются в int64
+INT64_LIMIT = 2.0 ** 63
+
+
+class ExchangeRate(SqlAlchemyBase):
+    __tablename__ = 'exchange_rates'
+    version = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    currency_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('currencies.id'), primary_key=True)
+    value = sqlalchemy.Column(sqlalchemy.Float, nullable=False)
+    created_date = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
+
+
+# Версия курсов меняется каждые RATES_PERIOD секунд, 0 - курсы не меняются
+settings = {
+    'period': int(os.environ.get('RATES_PERIOD', 3600)),
+}
+
+
+def configure(period=None):
+    if period is not None:
+        settings['period'] = period
+    rates.invalidate()
+
+
+def current_version():
+    if settings['period']:
+        return int(time.time() // settings['period'])
+    return 0
+
+
+# Детерминированная стоимость валюты в версии: все процессы, одновременно создающие версию, получат одно и то же
+def calculate_value(version, currency_id):
+    rng = random.Random(f'rates:{version}:{currency_id}')
+    return 10 ** rng.uniform(MIN_EXPONENT, MAX_EXPONENT)
+
+
+# Снимок курсов одной версии. matrix[i, j] - сколько минимальных единиц валюты j дают
+# за одну минимальную единицу валюты i, где i и j - позиции валют в ids
+class RateTable:
+    def __init__(self, version, values, currencies):
+        self.version = version
+        self.ids = np.array(sorted(values), dtype=np.int64)
+        self.positions = {currency_id: i for i, currency_id in enumerate(self.ids.tolist())}
+        # Таблица перевода идентификатора валюты в позицию для векторных вызовов, -1 - неизвестная валюта
+        self._lookup = np.full(int(self.ids.max()) + 1 if len(self.ids) else 1, -1, dtype=np.int64)
+        self._lookup[self.ids] = np.arange(len(self.ids))
+        self.scales = np.array([pricing.currency_scale(currencies[i]) for i in self.ids.tolist()], dtype=np.int64)
+        # Стоимость одной минимальной единицы каждой валюты
+        minor_values = np.array([values[i] for i in self.ids.tolist()], dtype=np.float64) / self.scales
+        self.matrix = minor_values[:, np.newaxis] / minor_values[np.newaxis, :]
+        self.matrix.flags.writeable = False
+
+    def _positions(self, currency_ids):
+        currency_ids = np.asarray(currency_ids, dtype=np.int64)
+        if currency_ids.size and (currency_ids.min() < 0 or currency_ids.max() >= len(self._lookup)):
+            raise KeyError('неизвестная валюта')
+        positions = self._lookup[currency_ids]
+        if (positions < 0).any():
+            raise KeyError('неизвестная валюта')
+        return positions
+
+    # Перевод массива сумм в минимальных единицах из валют from_ids в валюты to_ids (одну или по одной на сумму).
+    # Результат - целые минимальные единицы: для валют с is_integer это целые единицы валюты.
+    # Обмен округляется вниз (floor), чтобы округление не создавало деньги, показ - к ближайшему.
+    # Бесконечные суммы и суммы за пределами int64 вызывают OverflowError
+    def convert(self, amounts, from_ids, to_ids, rounding=np.rint):
+        amounts = np.asarray(amounts, dtype=np.float64)
+        result = rounding(amounts * self.matrix[self._positions(from_ids), self._positions(to_ids)])
+        if not (np.abs(result) < INT64_LIMIT).all():
+            raise OverflowError('сумма вне допустимого диапазона')
+        return result.astype(np.int64)
+
+    def convert_one(self, amount, from_id, to_id, rounding=np.rint):
+        return int(self.convert([amount], [from_id], [to_id], rounding)[0])
+
+    # Сколько минимальных единиц to_id получит пользователь, отдав amount минимальных единиц from_id
+    def exchange_amount(self, amount, from_id, to_id):
+        return self.convert_one(amount, from_id, to_id, np.floor)
+
+    # Предложения обмена валют from_ids на валюту to_id. Лот - наименьшее число 10^k целых единиц валюты,
+    # за которое дают хотя бы одну минимальную единицу to_id. Возвращает лоты и суммы к получению
+    # в минимальных единицах
+    def offers(self, from_ids, to_id):
+        from_positions = self._positions(from_ids)
+        unit_rates = self.matrix[from_positions, self._positions(to_id)] * self.scales[from_positions]
+        exponents = np.maximum(np.ceil(-np.log10(unit_rates) + 1e-9), 0)
+        lots = (10 ** exponents).astype(np.int64) * self.scales[from_positions]
+        return lots, self.convert(lots, from_ids, to_id, np.floor)
+
+    # Сумма словаря {идентификатор валюты: сумма}, например счёта или итогов корзины, в одной валюте
+    def total(self, amounts, to_id):
+        if not amounts:
+            return 0
+        return int(self.convert(list(amounts.values()), list(amounts), to_id).sum())
+
+
+# Кэш курсов текущей версии. Смена версии проверяется при каждом обращении без запросов к базе,
+# новая версия загружается из базы или рассчитывается и сохраняется один раз
+class Rates:
+    def __init__(self):
+        self._table = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._table = None
+
+    def get(self):
+        version = current_version()
+        table = self._table
+        if table is not None and table.version == version:
+            return table
+        with self._lock:
+            if self._table is None or self._table.version != version:
+                self._table = self._load(version)
+            return self._table
+
+    @staticmethod
+    def _load(version):
+        currencies = reference_cache.currencies()
+        db_sess = db_session.create_standalone_session()
+        try:
+            values = {i.currency_id: i.value
+                      for i in db_sess.query(ExchangeRate).filter(ExchangeRate.version == version)}
+            missing = [i for i in currencies if i not in values]
+            if missing:
+                for currency_id in missing:
+                    values[currency_id] = calculate_value(version, currency_id)
+                    db_sess.add(ExchangeRate(version=version, currency_id=currency_id, value=values[currency_id]))
+                try:
+                    db_sess.commit()
+                # Эту версию одновременно сохранил другой процесс, значения у них совпадают
+                except sqlalchemy.exc.IntegrityError:
+                    db_sess.rollback()
+        finally:
+            db_sess.close()
+        # Курсы удалённых валют не нужны
+        values = {i: value for i, value in values.items() if i in currencies}
+        return RateTable(version, values, currencies)
+
+
+rates = Rates()
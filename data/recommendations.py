@@ -0,0 +1,289 @@
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+import sqlalchemy
+from .order import Order, OrderItem
+from .item import Item
+
+# Рекомендации "С этим товаром покупают". Пакетная задача (см. recommendations_tool.py) читает все заказы
+# и считает разреженную матрицу совместных покупок: сколько заказов содержат оба товара.
+# Для каждого товара сохраняются TOP_K самых частых соседей. Матрица хранится в формате CSR:
+# indptr[i]..indptr[i + 1] - диапазон соседей товара i в массивах columns и counts,
+# поэтому соседи любого товара находятся за O(1), а файл отображается в память без чтения целиком
+TOP_K = 10
+# Заказы с большим числом разных товаров - оптовые закупки, связи между их товарами случайны
+MAX_ORDER_ITEMS = 50
+# Строки заказов читаются из базы пачками по столько строк
+READ_CHUNK = 200000
+# Накопленные пары сливаются в общий счётчик, когда их становится больше этого числа
+MERGE_SIZE = 5000000
+# Файлы индекса: соседи для страниц сайта и полная матрица для добавления новых заказов
+TOP_FILE = 'top.npy'
+PAIRS_FILE = 'pairs.npy'
+# Файл - массив int32: заголовок [FORMAT, число строк, номер последнего учтённого заказа в двух частях],
+# затем indptr, columns и counts
+FORMAT = 1
+HEADER = 4
+ORDER_BASE = 2 ** 30
+# Наибольшее значение, которое можно сохранить в файл: смещения, номера товаров и счётчики
+INT32_MAX = int(np.iinfo(np.int32).max)
+
+PairMatrix = namedtuple('PairMatrix', ['indptr', 'columns', 'counts'])
+
+
+def _empty_pairs():
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+
+# Строки заказов после заказа after_order пачками (номера заказов, номера товаров), упорядоченные по заказу.
+# Строки последнего заказа пачки переносятся в следующую, поэтому заказ никогда не разрезается
+def read_order_items(connection, after_order=0, chunk=READ_CHUNK):
+    result = connection.execute(sqlalchemy.select(OrderItem.order_id, OrderItem.item_id).where(
+        OrderItem.order_id > after_order).order_by(OrderItem.order_id, OrderItem.item_id))
+    carry = np.zeros((0, 2), dtype=np.int64)
+    try:
+        while True:
+            rows = result.cursor.fetchmany(chunk)
+            if not rows:
+                break
+            rows = np.concatenate([carry, np.array(rows, dtype=np.int64).reshape(-1, 2)])
+            last = np.searchsorted(rows[:, 0], rows[-1, 0])
+            carry = rows[last:]
+            if last:
+                yield rows[:last, 0], rows[:last, 1]
+    finally:
+        result.close()
+    if len(carry):
+        yield carry[:, 0], carry[:, 1]
+
+
+# Пары товаров, купленных вместе, в обоих направлениях. order_ids упорядочены, товары внутри заказа тоже.
+# Пары строятся сдвигом: на шаге d каждая строка заказа соединяется со строкой на d позиций дальше
+def order_pairs(order_ids, item_ids):
+    if not len(order_ids):
+        return _empty_pairs()
+    # Повторные строки одного товара в заказе считаются одной покупкой
+    keep = np.r_[True, (order_ids[1:] != order_ids[:-1]) | (item_ids[1:] != item_ids[:-1])]
+    order_ids, item_ids = order_ids[keep], item_ids[keep]
+    starts = np.flatnonzero(np.r_[True, order_ids[1:] != order_ids[:-1]])
+    sizes = np.diff(np.r_[starts, len(order_ids)])
+    small = sizes <= MAX_ORDER_ITEMS
+    item_ids = item_ids[np.repeat(small, sizes)]
+    sizes = sizes[small]
+    if not len(sizes) or sizes.max() < 2:
+        return _empty_pairs()
+    # Для каждой строки - позиция, следующая за последней строкой её заказа
+    ends = np.repeat(np.cumsum(sizes), sizes)
+    positions = np.arange(len(item_ids))
+    first, second = [], []
+    for shift in range(1, int(sizes.max())):
+        rows = np.flatnonzero(positions + shift < ends)
+        first.append(item_ids[rows])
+        second.append(item_ids[rows + shift])
+    first, second = np.concatenate(first), np.concatenate(second)
+    return np.concatenate([first, second]), np.concatenate([second, first])
+
+
+# Сложение счётчиков с одинаковыми ключами. Возвращает упорядоченные уникальные ключи и их суммы
+def _sum_by_key(keys, counts):
+    if not len(keys):
+        return keys, counts
+    order = np.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+def _to_keys(matrix, rows):
+    first = np.repeat(np.arange(len(matrix.indptr) - 1, dtype=np.int64), np.diff(matrix.indptr))
+    return first * rows + matrix.columns
+
+
+def _from_keys(keys, counts, rows):
+    first = keys // rows
+    indptr = np.zeros(rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(first, minlength=rows), out=indptr[1:])
+    return PairMatrix(indptr, keys % rows, counts)
+
+
+# Добавление заказов к матрице совместных покупок (None - пустая матрица).
+# chunks - пачки строк заказов из read_order_items, rows - наибольший номер товара + 1
+def count_pairs(chunks, rows, matrix=None):
+    rows = max(rows, len(matrix.indptr) - 1 if matrix is not None else 0)
+    if matrix is not None and len(matrix.columns):
+        keys, counts = _to_keys(matrix, rows), np.asarray(matrix.counts, dtype=np.int64)
+    else:
+        keys, counts = _empty_pairs()
+    pending, pending_size = [], 0
+    for order_ids, item_ids in chunks:
+        first, second = order_pairs(order_ids, item_ids)
+        inside = (first < rows) & (second < rows)
+        chunk_keys, chunk_counts = _sum_by_key(first[inside] * rows + second[inside],
+                                               np.ones(int(inside.sum()), dtype=np.int64))
+        pending.append((chunk_keys, chunk_counts))
+        pending_size += len(chunk_keys)
+        if pending_size > max(len(keys), MERGE_SIZE):
+            keys, counts = _sum_by_key(np.concatenate([keys] + [i for i, _ in pending]),
+                                       np.concatenate([counts] + [i for _, i in pending]))
+            pending, pending_size = [], 0
+    if pending:
+        keys, counts = _sum_by_key(np.concatenate([keys] + [i for i, _ in pending]),
+                                   np.concatenate([counts] + [i for _, i in pending]))
+    return _from_keys(keys, counts, rows)
+
+
+# Не больше top_k соседей каждого товара: по убыванию числа совместных покупок, при равенстве - по номеру
+def top_neighbours(matrix, top_k=TOP_K):
+    rows = len(matrix.indptr) - 1
+    first = np.repeat(np.arange(rows, dtype=np.int64), np.diff(matrix.indptr))
+    order = np.lexsort((matrix.columns, -matrix.counts, first))
+    first = first[order]
+    rank = np.arange(len(order)) - matrix.indptr[first]
+    keep = order[rank < top_k]
+    indptr = np.zeros(rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(first[rank < top_k], minlength=rows), out=indptr[1:])
+    return PairMatrix(indptr, matrix.columns[keep], matrix.counts[keep])
+
+
+# Запись матрицы в файл. Файл пишется рядом и подменяется целиком, поэтому процессы сайта,
+# отобразившие старый файл в память, продолжают читать его до перезагрузки
+def save_matrix(path, matrix, last_order):
+    rows = len(matrix.indptr) - 1
+    # Приведение к int32 молча обрезало бы большие значения и испортило бы матрицу.
+    # Смещения в indptr не убывают, поэтому наибольшее из них - последнее, оно же равно числу пар
+    largest = max([rows, int(matrix.indptr[-1])] + [int(array.max()) for array in (matrix.columns, matrix.counts)
+                                                    if len(array)])
+    if largest > INT32_MAX:
+        raise OverflowError(f'матрица рекомендаций не помещается в int32: значение {largest}')
+    header = np.array([FORMAT, rows, last_order // ORDER_BASE, last_order % ORDER_BASE], dtype=np.int64)
+    data = np.concatenate([header, matrix.indptr, matrix.columns, matrix.counts]).astype(np.int32)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix='.npy')
+    with os.fdopen(descriptor, 'wb') as file:
+        np.save(file, data)
+    os.replace(temp_path, path)
+
+
+# Чтение матрицы, отображённой в память. Возвращает матрицу и номер последнего учтённого заказа
+def load_matrix(path):
+    data = np.load(path, mmap_mode='r')
+    if data[0] != FORMAT:
+        raise ValueError(f'неизвестный формат файла рекомендаций: {path}')
+    rows = int(data[1])
+    last_order = int(data[2]) * ORDER_BASE + int(data[3])
+    indptr = data[HEADER:HEADER + rows + 1]
+    size = int(indptr[-1])
+    start = HEADER + rows + 1
+    return PairMatrix(indptr, data[start:start + size], data[start + size:start + 2 * size]), last_order
+
+
+# Строки заказов с номерами в (after_order, last_order]. Заказы, записанные во время чтения,
+# войдут в следующее обновление
+def read_order_items_until(connection, after_order, last_order):
+    for order_ids, item_ids in read_order_items(connection, after_order):
+        inside = order_ids <= last_order
+        if inside.any():
+            yield order_ids[inside], item_ids[inside]
+
+
+def _rows(connection):
+    max_item = connection.execute(sqlalchemy.select(sqlalchemy.func.max(Item.id))).scalar() or 0
+    max_ordered = connection.execute(sqlalchemy.select(sqlalchemy.func.max(OrderItem.item_id))).scalar() or 0
+    return max(max_item, max_ordered) + 1
+
+
+# Граница учтённых заказов - последний выданный номер заказа, а не наибольший номер среди оставшихся:
+# номера заказов только растут (см. data/order.py), поэтому все заказы, записанные позже,
+# получат номера больше границы, даже если заказ с наибольшим номером уже удалён возвратом.
+# В SQLite номер берётся из последовательности AUTOINCREMENT, в серверных базах последовательность
+# тоже не выдаёт номера повторно, и используется наибольший номер заказа
+def _last_order(connection):
+    if connection.dialect.name == 'sqlite':
+        last = connection.execute(sqlalchemy.text(
+            "SELECT seq FROM sqlite_sequence WHERE name = :name"), {'name': Order.__tablename__}).scalar()
+    else:
+        last = connection.execute(sqlalchemy.select(sqlalchemy.func.max(Order.id))).scalar()
+    return last or 0
+
+
+# Полное построение индекса по всем заказам. Возвращает число учтённых заказов и пар товаров
+def build_index(connection, directory, top_k=TOP_K):
+    last_order = _last_order(connection)
+    matrix = count_pairs(read_order_items_until(connection, 0, last_order), _rows(connection))
+    save_matrix(os.path.join(directory, PAIRS_FILE), matrix, last_order)
+    save_matrix(os.path.join(directory, TOP_FILE), top_neighbours(matrix, top_k), last_order)
+    return last_order, len(matrix.columns)
+
+
+# Добавление заказов, появившихся после прошлого построения. Заказы, удалённые после построения
+# (возврат денег), из матрицы не вычитаются - их убирает следующее полное построение.
+# Возвращает, на сколько продвинулась граница учтённых заказов, или None, если полного индекса ещё нет
+def update_index(connection, directory, top_k=TOP_K):
+    pairs_path = os.path.join(directory, PAIRS_FILE)
+    if not os.path.exists(pairs_path):
+        return None
+    matrix, previous = load_matrix(pairs_path)
+    last_order = _last_order(connection)
+    if last_order <= previous:
+        return 0
+    matrix = count_pairs(read_order_items_until(connection, previous, last_order), _rows(connection), matrix)
+    save_matrix(pairs_path, matrix, last_order)
+    save_matrix(os.path.join(directory, TOP_FILE), top_neighbours(matrix, top_k), last_order)
+    return last_order - previous
+
+
+# Соседи товаров для страниц сайта. Файл индекса отображается в память и перечитывается,
+# когда пакетная задача подменяет его; проверка файла выполняется не чаще раза в ttl секунд
+class Recommendations:
+    def __init__(self, directory='cache/recommendations', ttl=30):
+        self.directory = directory
+        self.ttl = ttl
+        self._matrix = None
+        self._stamp = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def configure(self, directory=None, ttl=None):
+        if directory is not None:
+            self.directory = directory
+        if ttl is not None:
+            self.ttl = ttl
+        self._matrix = None
+        self._stamp = None
+        self._checked = 0
+
+    def _get_matrix(self):
+        if self._checked > time.monotonic():
+            return self._matrix
+        with self._lock:
+            if self._checked > time.monotonic():
+                return self._matrix
+            path = os.path.join(self.directory, TOP_FILE)
+            try:
+                stat = os.stat(path)
+                stamp = (stat.st_ino, stat.st_mtime_ns)
+                if stamp != self._stamp:
+                    self._matrix = load_matrix(path)[0]
+                    self._stamp = stamp
+            except (OSError, ValueError):
+                # Индекс ещё не построен
+                self._matrix = None
+                self._stamp = None
+            self._checked = time.monotonic() + self.ttl
+            return self._matrix
+
+    # Идентификаторы товаров, которые чаще всего покупают вместе с item_id, от самых частых
+    def get(self, item_id, limit=TOP_K):
+        matrix = self._get_matrix()
+        if matrix is None or not 0 <= item_id < len(matrix.indptr) - 1:
+            return []
+        start = int(matrix.indptr[item_id])
+        end = min(int(matrix.indptr[item_id + 1]), start + limit)
+        return matrix.columns[start:end].tolist()
+
+
+recommendations = Recommendations()
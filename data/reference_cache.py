@@ -0,0 +1,126 @@
+from collections import namedtuple
+from types import MappingProxyType
+import threading
+import time
+import sqlalchemy
+from . import db_session
+from .currency import Currency
+from .category import Category
+from .store import Store, StoreHost
+
+# Неизменяемые снимки строк справочных таблиц. Ссылки на картинки вычисляются один раз при загрузке,
+# у магазина заранее собраны и настройки для шаблонов страниц (settings)
+CurrencyInfo = namedtuple('CurrencyInfo', ['id', 'name', 'logotype', 'is_integer', 'logo_url'])
+CategoryInfo = namedtuple('CategoryInfo', ['id', 'name'])
+StoreInfo = namedtuple('StoreInfo', ['id', 'name', 'slogan', 'logotype', 'icon', 'logotype_url', 'icon_url',
+                                     'settings'])
+
+
+# Кэш небольших, редко меняющихся таблиц: валют, категорий, магазинов и адресов магазинов.
+# Каждая таблица хранится как неизменяемый словарь {идентификатор: снимок строки},
+# поэтому чтение не требует блокировок, а перезагрузка просто подменяет словарь целиком
+class ReferenceCache:
+    def __init__(self, static_url='/static', ttl=None):
+        self.static_url = static_url
+        # Функция, возвращающая путь собранной копии статического файла (см. web/static_files.py)
+        self.asset_path = lambda filename: filename
+        # Время жизни снимка в секундах, None - до явной инвалидации
+        self.ttl = ttl
+        self._snapshots = dict()
+        self._lock = threading.Lock()
+        self._loaders = {
+            'currencies': self._load_currencies,
+            'categories': self._load_categories,
+            'stores': self._load_stores,
+            'hosts': self._load_hosts,
+        }
+
+    def configure(self, static_url=None, ttl=None, asset_path=None):
+        if static_url is not None:
+            self.static_url = static_url
+        if asset_path is not None:
+            self.asset_path = asset_path
+        # 0 - снимок живёт до явной инвалидации, как и None
+        if ttl is not None:
+            self.ttl = ttl or None
+        self.invalidate()
+
+    def _static(self, filename):
+        return f'{self.static_url}/{self.asset_path(filename)}'
+
+    def _load_currencies(self, db_sess):
+        return {i.id: CurrencyInfo(i.id, i.name, i.logotype, i.is_integer,
+                                   self._static(f'img/currencies/{i.logotype}'))
+                for i in db_sess.query(Currency).order_by(Currency.id)}
+
+    def _load_categories(self, db_sess):
+        return {i.id: CategoryInfo(i.id, i.name) for i in db_sess.query(Category).order_by(Category.id)}
+
+    def _load_stores(self, db_sess):
+        result = dict()
+        for i in db_sess.query(Store).order_by(Store.id):
+            logotype_url = self._static(f'img/logotypes/{i.logotype}')
+            icon_url = self._static(f'img/icons/{i.icon}')
+            settings = MappingProxyType({'title': i.name, 'slogan': i.slogan, 'logotype': logotype_url,
+                                         'icon': icon_url})
+            result[i.id] = StoreInfo(i.id, i.name, i.slogan, i.logotype, i.icon, logotype_url, icon_url, settings)
+        return result
+
+    # Адреса сайтов {адрес в нижнем регистре: идентификатор магазина}
+    def _load_hosts(self, db_sess):
+        return {i.host.lower(): i.store_id for i in db_sess.query(StoreHost)}
+
+    def _get(self, name):
+        snapshot = self._snapshots.get(name)
+        if snapshot and (self.ttl is None or time.monotonic() - snapshot[0] < self.ttl):
+            return snapshot[1]
+        with self._lock:
+            # Другой поток мог уже загрузить таблицу, пока этот ждал блокировку
+            snapshot = self._snapshots.get(name)
+            if snapshot and (self.ttl is None or time.monotonic() - snapshot[0] < self.ttl):
+                return snapshot[1]
+            db_sess = db_session.create_standalone_session()
+            try:
+                data = MappingProxyType(self._loaders[name](db_sess))
+            finally:
+                db_sess.close()
+            self._snapshots[name] = (time.monotonic(), data)
+            return data
+
+    def currencies(self):
+        return self._get('currencies')
+
+    def categories(self):
+        return self._get('categories')
+
+    def stores(self):
+        return self._get('stores')
+
+    def hosts(self):
+        return self._get('hosts')
+
+    # Сброс одной таблицы или всего кэша. Следующее обращение загрузит данные заново
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(name, None)
+
+
+reference_cache = ReferenceCache()
+
+
+# Изменение строк справочных таблиц через ORM сбрасывает соответствующий снимок
+def _watch(model, name):
+    def invalidate(*args):
+        reference_cache.invalidate(name)
+
+    for event in ['after_insert', 'after_update', 'after_delete']:
+        sqlalchemy.event.listen(model, event, invalidate)
+
+
+_watch(Currency, 'currencies')
+_watch(Category, 'categories')
+_watch(Store, 'stores')
+_watch(StoreHost, 'hosts')
@@ -0,0 +1,45 @@
+from array import array
+import random
+import threading
+import sqlalchemy
+from .item import Item
+
+
+# Выборка случайных товаров без загрузки всей таблицы.
+# Хранит компактный массив идентификаторов товаров, который перестраивается
+# только после изменения таблицы items, а сами товары загружаются одним запросом IN (...)
+class ItemSampler:
+    def __init__(self):
+        self._ids = array('q')
+        self._stale = True
+        self._lock = threading.Lock()
+
+    # Пометка массива идентификаторов как устаревшего
+    def invalidate(self, *args):
+        self._stale = True
+
+    def _get_ids(self, db_sess):
+        if self._stale:
+            with self._lock:
+                if self._stale:
+                    # Сначала снимается флаг, чтобы изменение во время загрузки снова его выставило
+                    self._stale = False
+                    self._ids = array('q', (i for i, in db_sess.query(Item.id).order_by(Item.id)))
+        return self._ids
+
+    # Получение count случайных товаров в случайном порядке
+    def sample(self, db_sess, count):
+        ids = self._get_ids(db_sess)
+        chosen = random.sample(ids, min(count, len(ids)))
+        if not chosen:
+            return []
+        items = {item.id: item for item in db_sess.query(Item).filter(Item.id.in_(chosen))}
+        # Товар мог быть удалён после построения массива
+        return [items[i] for i in chosen if i in items]
+
+
+sampler = ItemSampler()
+
+# Любое добавление или удаление товара делает массив идентификаторов устаревшим
+sqlalchemy.event.listen(Item, 'after_insert', sampler.invalidate)
+sqlalchemy.event.listen(Item, 'after_delete', sampler.invalidate)
@@ -0,0 +1,129 @@
+import re
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+from .item import Item
+from .attributes import has_attribute
+
+# Полнотекстовый индекс по названию и свойствам товара (свойства разделены ';',
+# токенизатор считает этот символ разделителем). Индекс ссылается на таблицу items
+# и поддерживается в актуальном состоянии триггерами
+FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5("
+    "name, description, content='items', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN "
+    "INSERT INTO items_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN "
+    "INSERT INTO items_fts(items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE ON items BEGIN "
+    "INSERT INTO items_fts(items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO items_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+]
+# Вес совпадения в названии относительно совпадения в свойствах
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+# Флаг доступности FTS5. Если SQLite собран без него, поиск работает через LIKE
+fts_enabled = False
+
+
+# Создание поискового индекса после создания таблиц
+def create_search_index(target, connection, **kwargs):
+    global fts_enabled
+    if connection.dialect.name != 'sqlite':
+        return
+    connection.execute(sqlalchemy.text('CREATE INDEX IF NOT EXISTS ix_items_category ON items (category)'))
+    exists = connection.execute(sqlalchemy.text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'")).first()
+    try:
+        for statement in FTS_SCHEMA:
+            connection.execute(sqlalchemy.text(statement))
+    except sqlalchemy.exc.OperationalError:
+        print('SQLite собран без FTS5, поиск будет работать без индекса')
+        return
+    fts_enabled = True
+    # Индекс для уже существующей базы заполняется один раз
+    if not exists:
+        rebuild_search_index(connection)
+
+
+# Полное перестроение индекса, например после массовой загрузки товаров
+def rebuild_search_index(connection):
+    connection.execute(sqlalchemy.text("INSERT INTO items_fts(items_fts) VALUES ('rebuild')"))
+
+
+sqlalchemy.event.listen(SqlAlchemyBase.metadata, 'after_create', create_search_index)
+
+
+# Преобразование пользовательского запроса в запрос FTS5:
+# каждое слово ищется как префикс, все слова должны встретиться
+def make_match_query(text):
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# Условие поиска FTS5 и его параметры. attributes - список (название, значение), которые должны быть у товара
+def _match_condition(match, category_id, attributes):
+    condition = 'items_fts MATCH :match'
+    params = {'match': match}
+    if category_id:
+        condition += ' AND items.category = :category'
+        params['category'] = category_id
+    for i, (name, value) in enumerate(attributes):
+        condition += (f' AND items.id IN (SELECT item_id FROM item_attributes '
+                      f'WHERE name = :name_{i} AND value = :value_{i})')
+        params[f'name_{i}'] = name
+        params[f'value_{i}'] = value
+    # CROSS JOIN фиксирует порядок: сначала индекс FTS, затем поиск товаров по первичному ключу.
+    # Иначе SQLite может выбрать обход индекса категорий с проверкой MATCH для каждой строки
+    return f'FROM items_fts CROSS JOIN items ON items.id = items_fts.rowid WHERE {condition}', params
+
+
+# Поиск товаров с ранжированием и разбиением на страницы.
+# Возвращает список товаров текущей страницы и общее число найденных товаров
+def search_items(db_sess, text, category_id=None, page=1, per_page=24, attributes=()):
+    if not fts_enabled:
+        return _search_items_like(db_sess, text, category_id, page, per_page, attributes)
+    match = make_match_query(text)
+    if not match:
+        return [], 0
+    source, params = _match_condition(match, category_id, attributes)
+    total = db_sess.execute(sqlalchemy.text(f'SELECT count(*) {source}'), params).scalar()
+    params.update(weight_name=NAME_WEIGHT, weight_description=DESCRIPTION_WEIGHT,
+                  limit=per_page, offset=(page - 1) * per_page)
+    ids = [i for i, in db_sess.execute(sqlalchemy.text(
+        f'SELECT items.id {source} ORDER BY bm25(items_fts, :weight_name, :weight_description), items.id '
+        f'LIMIT :limit OFFSET :offset'), params)]
+    if not ids:
+        return [], total
+    items = {item.id: item for item in db_sess.query(Item).filter(Item.id.in_(ids))}
+    return [items[i] for i in ids if i in items], total
+
+
+# Идентификаторы всех товаров, подходящих под запрос, без ранжирования и проверки таблицы товаров.
+# Нужны для подсчёта фасетов, поэтому строки читаются прямо из курсора драйвера, без объектов строк SQLAlchemy
+def search_item_ids(db_sess, text):
+    if not fts_enabled:
+        result = db_sess.connection().execute(_like_query(sqlalchemy.select(Item.id), text))
+    else:
+        match = make_match_query(text)
+        if not match:
+            return []
+        result = db_sess.connection().execute(sqlalchemy.text('SELECT rowid FROM items_fts WHERE items_fts MATCH :match'),
+                                 {'match': match})
+    try:
+        return [row[0] for row in result.cursor.fetchall()]
+    finally:
+        result.close()
+
+
+def _like_query(query, text):
+    return query.where(sqlalchemy.or_(Item.name.like(f'%{text}%'), Item.description.like(f'%{text}%')))
+
+
+# Запасной поиск по подстроке в названии и описании
+def _search_items_like(db_sess, text, category_id, page, per_page, attributes):
+    query = _like_query(db_sess.query(Item), text)
+    if category_id:
+        query = query.filter(Item.category == category_id)
+    query = query.filter(*[has_attribute(name, value) for name, value in attributes])
+    return query.order_by(Item.id).offset((page - 1) * per_page).limit(per_page).all(), query.count()
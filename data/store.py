@@ -10,3 +10,11 @@ class Store(SqlAlchemyBase, SerializerMixin):
     slogan = sqlalchemy.Column(sqlalchemy.String, nullable=True)
     logotype = sqlalchemy.Column(sqlalchemy.String, nullable=True)
     icon = sqlalchemy.Column(sqlalchemy.String, nullable=True)
+
+
+# Адрес сайта, по которому открывается магазин. Один процесс сервера обслуживает все магазины,
+# магазин выбирается для каждого запроса по заголовку Host
+class StoreHost(SqlAlchemyBase):
+    __tablename__ = 'store_hosts'
+    host = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+    store_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('stores.id'), nullable=False)
@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+from . import db_session
+from .reference_cache import reference_cache
+
+CURRENT_STORE = 'current_store'
+
+
+# Настройки сайта, общие для всех процессов сервера
+class SiteSetting(SqlAlchemyBase):
+    __tablename__ = 'site_settings'
+    name = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+    value = sqlalchemy.Column(sqlalchemy.String, nullable=True)
+
+
+# Магазин по умолчанию - для запросов, магазин которых не определён адресом сайта или выбором посетителя
+# (см. resolve_store_id). Хранится в базе данных, поэтому все процессы сервера показывают один магазин.
+# Магазин по умолчанию можно закрепить настройкой STORE_ID, иначе он выбирается случайно один раз.
+# Процесс перечитывает выбор не чаще раза в ttl секунд
+class CurrentStore:
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self.fixed_id = None
+        self._cached = None
+        self._lock = threading.Lock()
+
+    def configure(self, store_id=None, ttl=None):
+        self.fixed_id = store_id
+        if ttl is not None:
+            self.ttl = ttl
+        self._cached = None
+
+    def _remember(self, store_id):
+        self._cached = (time.monotonic() + self.ttl, store_id)
+        return store_id
+
+    def get_id(self):
+        if self.fixed_id is not None:
+            return self.fixed_id
+        cached = self._cached
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        with self._lock:
+            db_sess = db_session.create_standalone_session()
+            try:
+                setting = db_sess.query(SiteSetting).get(CURRENT_STORE)
+                if setting is not None and int(setting.value) in reference_cache.stores():
+                    return self._remember(int(setting.value))
+                # Магазин ещё не выбран или удалён. Если другой процесс успел выбрать магазин
+                # одновременно с этим, используется его выбор
+                store_id = random.choice(list(reference_cache.stores()))
+                if setting is None:
+                    db_sess.add(SiteSetting(name=CURRENT_STORE, value=str(store_id)))
+                else:
+                    setting.value = str(store_id)
+                try:
+                    db_sess.commit()
+                except sqlalchemy.exc.IntegrityError:
+                    db_sess.rollback()
+                    store_id = int(db_sess.query(SiteSetting).get(CURRENT_STORE).value)
+                return self._remember(store_id)
+            finally:
+                db_sess.close()
+
+
+current_store = CurrentStore()
+
+
+# Адрес сайта без порта, в нижнем регистре
+def normalize_host(host):
+    host = (host or '').lower()
+    if host.startswith('['):
+        return host.partition(']')[0] + ']'
+    return host.rpartition(':')[0] if host.count(':') == 1 else host
+
+
+# Магазин запроса. Адрес сайта, закреплённый за магазином в таблице store_hosts, важнее всего,
+# затем магазин, выбранный посетителем (chosen_id), затем магазин по умолчанию.
+# Все данные берутся из кэшей процесса, поэтому определение магазина не обращается к базе
+def resolve_store_id(host, chosen_id=None):
+    stores = reference_cache.stores()
+    store_id = reference_cache.hosts().get(normalize_host(host))
+    if store_id in stores:
+        return store_id
+    if chosen_id in stores:
+        return chosen_id
+    return current_store.get_id()
@@ -1,6 +1,6 @@
 import sqlalchemy
 from .db_session import SqlAlchemyBase
-from werkzeug.security import generate_password_hash, check_password_hash
+from .credentials import credentials
 from flask_login import UserMixin
 
 
@@ -16,7 +16,7 @@ class User(SqlAlchemyBase, UserMixin):
     got_bonus = sqlalchemy.Column(sqlalchemy.Boolean, nullable=True)
 
     def set_password(self, password):
-        self.hashed_password = generate_password_hash(password)
+        self.hashed_password = credentials.hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.hashed_password, password)
\ No newline at end of file
+        return credentials.verify_password(self.hashed_password, password)
\ No newline at end of file
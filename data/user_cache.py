@@ -0,0 +1,87 @@
+from collections import namedtuple, OrderedDict
+import threading
+import time
+from flask_login import UserMixin
+
+
+# Неизменяемый снимок пользователя с полями, нужными страницам сайта.
+# В отличие от объекта User не привязан к сессии базы данных
+class CachedUser(namedtuple('CachedUser', ['id', 'name', 'surname', 'email', 'address', 'age', 'got_bonus']),
+                 UserMixin):
+    __slots__ = ()
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.name, user.surname, user.email, user.address, user.age, user.got_bonus)
+
+
+# Кэш пользователей по идентификатору с вытеснением давно не использованных записей (LRU)
+# и ограниченным временем жизни записи (TTL)
+class UserCache:
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                del self._users[user_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user):
+        with self._lock:
+            self._users[user.id] = (time.monotonic() + self.ttl, user)
+            self._users.move_to_end(user.id)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+                self.evictions += 1
+        return user
+
+    # Получение пользователя из кэша, при промахе - через функцию загрузки
+    def get_or_load(self, user_id, loader):
+        user = self.get(user_id)
+        if user is None:
+            db_user = loader(user_id)
+            if db_user is None:
+                return None
+            user = self.put(CachedUser.from_user(db_user))
+        return user
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+    # Статистика для подбора размера кэша
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._users),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / requests if requests else 0.0,
+            }
+
+
+user_cache = UserCache()
@@ -0,0 +1,12 @@
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+
+
+# Суммы хранятся в минимальных единицах валюты (см. data/pricing.py)
+class Wallet(SqlAlchemyBase):
+    __tablename__ = 'wallets'
+    __table_args__ = (sqlalchemy.UniqueConstraint('user_id', 'currency_id'),)
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    user_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('users.id'), index=True, nullable=False)
+    currency_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('currencies.id'), nullable=False)
+    amount = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, default=0)
@@ -4,6 +4,10 @@ from wtforms.validators import DataRequired
 
 
 class SearchForm(FlaskForm):
+    # Поиск ничего не меняет на сервере и отправляется GET-запросом, токен CSRF ему не нужен
+    class Meta:
+        csrf = False
+
     name = StringField('Наименование товара', validators=[DataRequired()])
-    category = SelectField('Категория', choices=[])
+    category = SelectField('Категория', choices=[], coerce=int)
     submit = SubmitField('Поиск')
@@ -0,0 +1,30 @@
+# Настройки gunicorn. Запуск: gunicorn -c gunicorn.conf.py wsgi:app
+# Число процессов и потоков задаётся переменными окружения WEB_WORKERS и WEB_THREADS
+import multiprocessing
+import os
+
+bind = os.environ.get('WEB_BIND', '127.0.0.1:8080')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Каждый процесс обслуживает запросы в нескольких потоках. Сессии базы данных привязаны к потоку
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+# Соединений на процесс, включая ожидающие свободного потока. Лишние соединения остаются в очереди
+# ядра; запросы сверх MAX_CONCURRENT_REQUESTS приложение отклоняет ответом 503 (см. web/limits.py)
+worker_connections = int(os.environ.get('WEB_CONNECTIONS', 1000))
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+keepalive = 5
+# Приложение создаётся один раз в главном процессе, рабочие процессы получают
+# уже заполненные кэши справочников и списка товаров
+preload_app = True
+raw_env = ['PRELOAD_CACHES=1']
+# Перезапуск процессов после заданного числа запросов ограничивает рост памяти
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('WEB_ACCESS_LOG')
+
+
+# Соединения с базой, открытые главным процессом при загрузке приложения,
+# нельзя использовать в нескольких процессах после fork
+def post_fork(server, worker):
+    from data import db_session
+    db_session.dispose_connections()
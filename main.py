@@ -1,53 +1,277 @@
-from flask import Flask, url_for, redirect, render_template, request, abort
+from flask import Flask, Blueprint, redirect, render_template, request, abort, g
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from data import db_session
-from data.store import Store
-from data.category import Category
 from data.item import Item
-from data.currency import Currency
 from data.user import User
+from data import accounts
+from data.sampling import sampler
+from data.search import search_items, search_item_ids
+from data.reference_cache import reference_cache
+from data.item_loader import ItemLoader
+from data.user_cache import user_cache
+from data import pricing
+from data import cart_totals
+from data import checkout
+from data import listing
+from data import attributes
+from data.facets import facet_index, CATEGORY
+from data.rates import rates
+from data.recommendations import recommendations
+from data.credentials import credentials, CredentialsBusy
+from data.store_state import current_store, resolve_store_id
 from forms.register_form import RegisterForm
 from forms.login_form import LoginForm
 from forms.search_form import SearchForm
+from web.page_cache import page_cache, MemoryBackend, DiskBackend
+from web.images import image_manifest, item_image, item_image_webp
+from web.static_files import init_static_files, asset_path
+from web.metrics import init_metrics, phase
+from web.api import api
+from web.limits import rate_limiter, parse_rules, MemoryBuckets, SharedBuckets, RateLimited, AdmissionControl
+import sqlalchemy
+import math
 import random
-import json
+import os
+import urllib.parse
 
 
-# Запуск приложения через flask
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'yandexlyceum_store_secret_key'
+# Маршруты сайта. Приложение собирается функцией create_app
+bp = Blueprint('store', __name__)
 # Создание менеджера логинов
 login_manager = LoginManager()
-login_manager.init_app(app)
-# Подключение к базе данных
-db_session.global_init("db/store_database.db")
-# Создание магазина - заглушки
-store = Store()
-
-
-# Функция выбирает случайный магазин из базы данных
-def set_current_store():
-    global store
-    session = db_session.create_session()
-    stores = session.query(Store).all()
-    store = random.choice(stores)
-
-
-# Получение данных от текущего магазина
-# Это нужно, чтобы легко менять название страниц
+# Cookie с магазином, выбранным посетителем по ссылке /store/<id>, и время его хранения в секундах
+STORE_COOKIE = 'store'
+STORE_COOKIE_AGE = 30 * 24 * 3600
+# Количество товаров на главной странице, не считая особого предложения
+FRONT_PAGE_ITEMS = 12
+# Количество товаров на одной странице результатов поиска
+SEARCH_PAGE_ITEMS = 24
+# Количество товаров на одной странице каталога
+CATALOGUE_PAGE_ITEMS = 24
+# Количество товаров в блоке "С этим товаром покупают"
+RELATED_ITEMS = 6
+# Наибольшее число одновременно выбранных значений атрибутов и число значений, показываемых в одном фасете
+MAX_FILTERS = 5
+FACET_VALUES = 10
+# Наибольшая сумма одного обмена в единицах валюты. При самом большом разбросе курсов
+# сумма к получению в минимальных единицах остаётся в пределах 64-битного целого
+MAX_EXCHANGE_AMOUNT = 10 ** 9
+# Настройки приложения по умолчанию. Каждую можно переопределить аргументом create_app
+# или одноимённой переменной окружения, например DATABASE_URL=postgresql://user@host/store
+DEFAULT_CONFIG = {
+    'SECRET_KEY': 'yandexlyceum_store_secret_key',
+    'DATABASE_URL': 'db/store_database.db',
+    # Магазин по умолчанию для адресов сайта, не закреплённых за магазином в таблице store_hosts.
+    # Если не задан, магазин выбирается случайно и хранится в базе данных
+    'STORE_ID': None,
+    # Как часто процесс перечитывает выбранный магазин, в секундах
+    'STORE_TTL': 5,
+    # Время жизни кэша справочников (валюты, категории, магазины) в секундах, 0 - до явной инвалидации
+    'REFERENCE_TTL': 0,
+    # Кэш страниц для анонимных пользователей: memory или disk
+    'PAGE_CACHE_BACKEND': 'memory',
+    'PAGE_CACHE_DIR': 'cache/pages',
+    # Наибольшее число страниц: в памяти - у каждого магазина, на диске - всего
+    'PAGE_CACHE_SIZE': 1000,
+    'PAGE_CACHE_TIMEOUT': 300,
+    # Загрузка справочников и списка товаров при создании приложения, а не при первом запросе
+    'PRELOAD_CACHES': False,
+    # Измерения запросов и страница /metrics в формате Prometheus (см. web/metrics.py)
+    'METRICS_ENABLED': True,
+    # Стеки запросов дольше указанного времени в миллисекундах записываются в PROFILE_DIR, 0 - не записываются
+    'PROFILE_SLOW_REQUESTS_MS': 0,
+    'PROFILE_DIR': 'cache/profiles',
+    # Хэширование паролей (см. data/credentials.py): способ и стоимость для новых хэшей,
+    # число потоков хэширования (0 - в потоке запроса) и длина очереди к ним
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:260000',
+    'PASSWORD_HASH_WORKERS': 2,
+    'PASSWORD_HASH_QUEUE': 32,
+    # Как часто процесс проверяет журнал изменённых товаров для обновления фасетов, в секундах
+    'FACETS_TTL': 5,
+    # Индекс рекомендаций, построенный recommendations_tool.py, и как часто процесс проверяет его обновление
+    'RECOMMENDATIONS_DIR': 'cache/recommendations',
+    'RECOMMENDATIONS_TTL': 30,
+    # Ограничение частоты запросов пользователя или адреса IP (см. web/limits.py): правила "имя=запросов/секунд"
+    # и хранилище вёдер: memory - в каждом процессе своё, shared - общий файл для всех процессов сервера
+    'RATE_LIMITS': 'login=10/60,get_bonus=3/3600,add_to_cart=60/60,change_currencies=20/60',
+    'RATE_LIMIT_BACKEND': 'memory',
+    'RATE_LIMIT_PATH': 'cache/rate_limits.db',
+    # Наибольшее число одновременно обрабатываемых запросов процесса, сверх него сразу отвечается 503.
+    # 0 - без ограничения. Имеет смысл при WEB_THREADS больше этого числа
+    'MAX_CONCURRENT_REQUESTS': 0,
+}
+
+
+def _load_config(config):
+    result = dict()
+    for name, default in DEFAULT_CONFIG.items():
+        value = config.get(name, os.environ.get(name))
+        if value is None:
+            value = default
+        elif isinstance(default, bool) and isinstance(value, str):
+            value = value.lower() in ('1', 'true', 'yes')
+        elif isinstance(default, int) or name == 'STORE_ID':
+            value = int(value)
+        result[name] = value
+    return result
+
+
+# Создание приложения. Процессы сервера (см. wsgi.py и gunicorn.conf.py) получают одинаковые
+# настройки, а текущий магазин хранится в базе данных, поэтому все процессы показывают один магазин
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(_load_config(config or dict()))
+    login_manager.init_app(app)
+    db_session.global_init(app.config['DATABASE_URL'])
+    # Статические файлы раздаются из сборки build_assets.py: со сжатием, хэшами в именах и долгим кэшированием
+    init_static_files(app)
+    # Справочные таблицы кэшируются вместе с готовыми ссылками на картинки
+    reference_cache.configure(static_url=app.static_url_path, ttl=app.config['REFERENCE_TTL'],
+                              asset_path=asset_path)
+    current_store.configure(store_id=app.config['STORE_ID'], ttl=app.config['STORE_TTL'])
+    credentials.configure(method=app.config['PASSWORD_HASH_METHOD'], workers=app.config['PASSWORD_HASH_WORKERS'],
+                          max_pending=app.config['PASSWORD_HASH_QUEUE'])
+    facet_index.configure(ttl=app.config['FACETS_TTL'])
+    recommendations.configure(directory=app.config['RECOMMENDATIONS_DIR'], ttl=app.config['RECOMMENDATIONS_TTL'])
+    if app.config['RATE_LIMIT_BACKEND'] == 'shared':
+        buckets = SharedBuckets(app.config['RATE_LIMIT_PATH'])
+    else:
+        buckets = MemoryBuckets()
+    rate_limiter.configure(rules=parse_rules(app.config['RATE_LIMITS']), backend=buckets)
+    # Кэш страниц для анонимных пользователей: в памяти процесса или на диске
+    if app.config['PAGE_CACHE_BACKEND'] == 'disk':
+        page_cache.configure(backend=DiskBackend(app.config['PAGE_CACHE_DIR'], app.config['PAGE_CACHE_SIZE']))
+    else:
+        page_cache.configure(backend=MemoryBackend(app.config['PAGE_CACHE_SIZE']))
+    page_cache.configure(timeout=app.config['PAGE_CACHE_TIMEOUT'], store_key=get_store_id)
+    # Любое изменение товаров сбрасывает кэш страниц
+    for event in ['after_insert', 'after_update', 'after_delete']:
+        if not sqlalchemy.event.contains(Item, event, page_cache.invalidate):
+            sqlalchemy.event.listen(Item, event, page_cache.invalidate)
+    # Уменьшенные копии фотографий товаров (см. build_images.py) доступны шаблонам через item_image
+    image_manifest.configure(os.path.join(app.static_folder, 'img', 'derived', 'manifest.json'))
+    app.jinja_env.globals.update(item_image=item_image, item_image_webp=item_image_webp)
+    # Ссылки на оформление заказа и возврат денег содержат ключ, чтобы повторный переход не повторял операцию
+    app.jinja_env.globals.update(idempotency_key=checkout.new_key)
+    app.teardown_appcontext(shutdown_session)
+    if app.config['METRICS_ENABLED']:
+        init_metrics(app)
+    app.register_blueprint(bp)
+    app.register_blueprint(api)
+    # Ответ при перегрузке готовится заранее, чтобы отказ не стоил процессу ничего
+    if app.config['MAX_CONCURRENT_REQUESTS']:
+        with app.app_context():
+            body = render_template('503.html').encode('utf-8')
+        app.wsgi_app = AdmissionControl(app.wsgi_app, app.config['MAX_CONCURRENT_REQUESTS'], body)
+    if app.config['PRELOAD_CACHES']:
+        preload_caches()
+    return app
+
+
+# Заполнение кэшей до начала работы. При запуске gunicorn с preload_app это выполняется
+# один раз в главном процессе, и рабочие процессы получают готовые кэши после fork
+def preload_caches():
+    reference_cache.currencies()
+    reference_cache.categories()
+    reference_cache.stores()
+    reference_cache.hosts()
+    current_store.get_id()
+    rates.get()
+    facet_index.get()
+    db_sess = db_session.create_standalone_session()
+    try:
+        sampler.sample(db_sess, 1)
+    finally:
+        db_sess.close()
+
+
+# Магазин текущего запроса: по адресу сайта или выбору посетителя (см. data/store_state.py).
+# Определяется один раз за запрос, поэтому все части страницы и ключ кэша страниц относятся к одному магазину
+def get_store_id():
+    if 'store_id' not in g:
+        g.store_id = resolve_store_id(request.host, request.cookies.get(STORE_COOKIE, type=int))
+    return g.store_id
+
+
+def get_current_store():
+    return reference_cache.stores()[get_store_id()]
+
+
+# Получение данных магазина текущего запроса
+# Это нужно, чтобы легко менять название страниц. Настройки собраны заранее в кэше справочников,
+# копия нужна, потому что страницы меняют в ней заголовок
 def get_store_settings():
-    store_settings = dict()
-    store_settings['title'] = store.name
-    store_settings['slogan'] = store.slogan
-    store_settings['logotype'] = url_for('static', filename=f'img/logotypes/{store.logotype}')
-    store_settings['icon'] = url_for('static', filename=f'img/icons/{store.icon}')
-    return store_settings
-
-
-# Запуск сервера и выбор случайного магазина
+    return dict(get_current_store().settings)
+
+
+# Ответ, запоминающий выбранный посетителем магазин
+def choose_store(store_id):
+    response = redirect('/')
+    response.set_cookie(STORE_COOKIE, str(store_id), max_age=STORE_COOKIE_AGE, httponly=True, samesite='Lax')
+    return response
+
+
+# Сумма в нескольких валютах {идентификатор валюты: сумма} в пересчёте на основную валюту
+# (с наименьшим идентификатором) по текущим курсам, одним векторным вызовом
+def converted_total(amounts):
+    table = rates.get()
+    currency_id = int(table.ids[0])
+    currency = reference_cache.currencies()[currency_id]
+    total = table.total({i: amount for i, amount in amounts.items() if i in table.positions}, currency_id)
+    return {'currency': currency.logo_url, 'price': pricing.to_units(total, currency)}
+
+
+# Выбранные значения атрибутов из параметров адреса attr=Название:значение
+def selected_attributes():
+    result = []
+    for text in request.args.getlist('attr'):
+        value = attributes.parse_filter(text)
+        if value and value not in result:
+            result.append(value)
+    return result[:MAX_FILTERS]
+
+
+# Часть адреса с выбранными значениями атрибутов, добавляемая к ссылкам страницы
+def filter_query(selected):
+    return ''.join('&' + urllib.parse.urlencode({'attr': f'{name}:{value}'}) for name, value in selected)
+
+
+# Фасеты атрибутов для показа: значения с числом товаров в наборе base (битовая карта или None - весь каталог)
+# и ссылки, выбирающие или снимающие значение. Выбор значения заменяет выбранное значение того же атрибута,
+# поэтому числа для атрибута считаются без его собственного фильтра
+def facet_groups(table, base, selected, url):
+    counts = table.counts(table.select(selected, base))
+    for name in {name for name, _ in selected}:
+        others = [i for i in selected if i[0] != name]
+        counts[name] = table.counts(table.select(others, base)).get(name, [])
+    groups = []
+    for name in sorted(i for i in counts if i != CATEGORY):
+        values = [(value, count) for value, count in counts[name][:FACET_VALUES]]
+        values += [(value, 0) for i, value in selected if i == name and value not in dict(values)]
+        entries = []
+        for value, count in values:
+            active = (name, value) in selected
+            chosen = [i for i in selected if i[0] != name] + ([] if active else [(name, value)])
+            entries.append({'value': value, 'count': count, 'active': active, 'url': url + filter_query(chosen)})
+        groups.append({'name': name, 'values': entries})
+    return groups
+
+
+# Закрытие сессии базы данных в конце каждого запроса
+def shutdown_session(exception=None):
+    db_session.remove_session()
+
+
+# Загрузчик товаров, общий для всего запроса
+def get_item_loader(db_sess):
+    if 'item_loader' not in g:
+        g.item_loader = ItemLoader(db_sess)
+    return g.item_loader
+
+
+# Запуск отладочного сервера. Для работы под нагрузкой используется gunicorn (см. gunicorn.conf.py)
 def main():
-    set_current_store()
-    app.run(port=8080, host='127.0.0.1')
+    create_app().run(port=8080, host='127.0.0.1')
 
 
 def check_password(password):
@@ -66,21 +290,30 @@ def check_password(password):
 
 
 # Главная страница
-@app.route('/')
+@bp.route('/')
+@page_cache.cached()
 def main_page():
     # Создание сессии
     session = db_session.create_session()
     # Получение данных текущего магазина
     store_settings = get_store_settings()
-    items = session.query(Item).all()
-    # Перестановка товаров в случайном порядке
-    random.shuffle(items)
-    items = items[:len(items) // 4]
+    # Выборка случайных товаров без загрузки всего каталога
+    items = sampler.sample(session, FRONT_PAGE_ITEMS + 1)
     # Выбор товара для особого предложения
-    special_offer = items.pop()
-    # Установка фото и описания для особого предложения
-    special_offer.photo_name = url_for('static', filename=f'img/items/{special_offer.photo_name}')
-    special_offer.description = special_offer.description.split(';')[0]
+    item = items.pop()
+    # Установка фото и описания для особого предложения. Сам товар не изменяется,
+    # чтобы изменения не попали в базу при фиксации сессии запроса
+    special_offer = {
+        'id': item.id,
+        'name': item.name,
+        'photo_name': item_image(item.photo_name, 'card'),
+        'photo_webp': item_image_webp(item.photo_name, 'card'),
+        'description': ''
+    }
+    # Свойства товара разобраны из описания при сохранении (см. data/attributes.py)
+    properties = attributes.get_attributes(session, [item.id])[item.id]
+    if properties:
+        special_offer['description'] = attributes.display(*properties[0])
     # Создание словаря для товаров на главной странице
     items = {
         'items': items,
@@ -91,7 +324,8 @@ def main_page():
 
 
 # Страница товара
-@app.route('/item/<int:item_id>')
+@bp.route('/item/<int:item_id>')
+@page_cache.cached()
 def item_page(item_id):
     store_settings = get_store_settings()
     session = db_session.create_session()
@@ -106,39 +340,30 @@ def item_page(item_id):
         item_info = dict()
         item_info['item_id'] = item_id
         item_info['name'] = item.name
-        item_info['source'] = url_for('static', filename=f'img/items/{item.photo_name}')
+        item_info['source'] = item_image(item.photo_name, 'full')
+        item_info['source_webp'] = item_image_webp(item.photo_name, 'full')
         store_settings['title'] = item.name
-        item_info['properties'] = item.description.split(';')
-        # Если у товара есть особая цена и валюта, добавляю их в словарь
-        if item.special_price:
-            item_info['price'] = item.special_price
-            currency = session.query(Currency).get(item.special_currency)
-        # Если нет, выбираем случайные цену и валюту и заносим их в словарь
-        else:
-            item_info['price'] = random.randint(0, 99999999)
-            item_info['price'] /= 10 ** random.randint(0, len(str(item_info['price'])))
-            currency = random.choice(session.query(Currency).all())
+        item_info['properties'] = [attributes.display(name, value)
+                                   for name, value in attributes.get_attributes(session, [item_id])[item_id]]
+        # Цена, валюта и скидка назначаются товару один раз на эпоху цен
+        price = pricing.get_price(session, item)
+        currency = reference_cache.currencies()[price.currency_id]
         item_info['currency_id'] = currency.id
+        item_info['price'] = pricing.to_units(price.price, currency)
+        item_info['discount'] = price.discount
+        item_info['discount_price'] = pricing.to_units(price.discount_price, currency)
         # Загрузка фото для валюты
-        item_info['currency'] = url_for('static', filename=f'img/currencies/'f'{currency.logotype}')
-        # Если будет скидка, определяю её размер и новую цену
-        if random.randint(1, 10) == 10:
-            # Размер скидки в процентах
-            item_info['discount'] = random.randint(1, 400)
-            # Преобразование цены в зависимости от размера скидки
-            item_info['discount_price'] = item_info['price'] - item_info['price'] * item_info['discount'] / 100
-            if currency.is_integer:
-                item_info['price'] = int(item_info['price'])
-                item_info['discount_price'] = int(item_info['discount_price'])
-        # Если нет, ставлю заглушку в словарь
-        else:
-            item_info['discount_price'] = None
-            item_info['discount'] = None
+        item_info['currency'] = currency.logo_url
+        # Товары, которые чаще всего покупают вместе с этим, из индекса совместных покупок.
+        # Соседей берётся с запасом на случай, если часть товаров удалена
+        related_ids = recommendations.get(item_id)
+        related = get_item_loader(session).load_many(related_ids)
+        item_info['related'] = [related[i] for i in related_ids if i in related][:RELATED_ITEMS]
         return render_template('item_page.html', **store_settings, **item_info)
 
 
 # Страница регистрации
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     # Загрузка формы регистрации
     form = RegisterForm()
@@ -155,34 +380,33 @@ def register():
         if not form.age.data.isnumeric():
             return render_template('register.html', form=form,
                                    message="Неверный возраст", **store_settings)
-        db_sess = db_session.create_session()
-        if db_sess.query(User).filter(User.email == form.email.data).first():
-            return render_template('register.html', form=form,
-                                   message="Такой пользователь уже есть", **store_settings)
-        # Создание нового пользователя и занесение в базу данных
-        user = User(
-            name=form.name.data,
-            email=form.email.data,
-            surname=form.surname.data,
-            age=int(form.age.data),
-            address=form.address.data,
-            got_bonus=0
-        )
-        user.set_password(form.password.data)
-        db_sess.add(user)
-        db_sess.commit()
-        # Создание json-файла с данными нового пользователя: счёт, корзина и заказы
-        with open(f'accounts/user_{user.id}.json', 'w', encoding='utf-8') as jsonfile:
-            data = {'shopping_cart': {'items': [], 'summary': {}}, 'orders': {}, 'currencies': dict()}
-            for i in db_sess.query(Currency).all():
-                data['currencies'][i.id] = 0
-            json.dump(data, jsonfile)
+        with db_session.transaction() as db_sess:
+            if db_sess.query(User).filter(User.email == form.email.data).first():
+                return render_template('register.html', form=form,
+                                       message="Такой пользователь уже есть", **store_settings)
+            # Создание нового пользователя и занесение в базу данных
+            user = User(
+                name=form.name.data,
+                email=form.email.data,
+                surname=form.surname.data,
+                age=int(form.age.data),
+                address=form.address.data,
+                got_bonus=0
+            )
+            with phase('password'):
+                user.set_password(form.password.data)
+            db_sess.add(user)
+            db_sess.flush()
+            # Создание пустого мультивалютного счёта нового пользователя
+            accounts.create_account(db_sess, user.id)
+        user_cache.invalidate(user.id)
         return redirect("/")
     return render_template('register.html', form=form, **store_settings)
 
 
 # Страница входа в аккаунт
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
+@rate_limiter.limit('login', methods=['POST'])
 def login():
     form = LoginForm()
     store_settings = get_store_settings()
@@ -191,7 +415,14 @@ def login():
     if form.validate_on_submit():
         db_sess = db_session.create_session()
         user = db_sess.query(User).filter(User.email == form.email.data).first()
-        if user and user.check_password(form.password.data):
+        with phase('password'):
+            password_ok = user is not None and user.check_password(form.password.data)
+        if password_ok:
+            # Пароль, сохранённый прежним способом или с прежней стоимостью, пересчитывается при входе
+            if credentials.needs_rehash(user.hashed_password):
+                with phase('password'):
+                    user.set_password(form.password.data)
+                db_sess.commit()
             login_user(user, remember=form.remember_me.data)
             return redirect("/")
         # Возврат страницы с сообщением в случае ошибки
@@ -199,7 +430,7 @@ def login():
             return render_template('login.html',
                                    message="Пользователь не найден",
                                    form=form, **store_settings)
-        elif not user.check_password(form.password.data):
+        else:
             return render_template('login.html',
                                    message="Неверный пароль",
                                    form=form, **store_settings)
@@ -207,7 +438,7 @@ def login():
 
 
 # Страница изменения данных аккаунта
-@app.route('/edit_account', methods=['GET', 'POST'])
+@bp.route('/edit_account', methods=['GET', 'POST'])
 @login_required
 def edit_account():
     store_settings = get_store_settings()
@@ -238,360 +469,368 @@ def edit_account():
         user.surname = edit_form.surname.data
         user.age = int(edit_form.age.data)
         user.address = edit_form.address.data
-        user.set_password(edit_form.password.data)
+        with phase('password'):
+            user.set_password(edit_form.password.data)
         db_sess.commit()
+        user_cache.invalidate(user.id)
         return redirect('/user_page')
     return render_template('register.html', form=edit_form, **store_settings)
 
 
 # Загрузка пользователя из базы данных
-@login_manager.user_loader
-def load_user(user_id):
+def load_user_from_db(user_id):
     db_sess = db_session.create_session()
     return db_sess.query(User).get(user_id)
 
 
+# Загрузка пользователя для каждого запроса, в базу данных обращается только при промахе кэша
+@login_manager.user_loader
+def load_user(user_id):
+    return user_cache.get_or_load(int(user_id), load_user_from_db)
+
+
 # Функция для выхода из аккаунта
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
     return redirect("/")
 
 
-# Обновление страницы со сменой магазина
-@app.route('/refresh')
+# Обновление страницы со сменой магазина. Магазин меняется только для этого посетителя,
+# страницы других магазинов остаются в кэше
+@bp.route('/refresh')
 def refresh():
-    set_current_store()
-    return redirect('/')
+    store_id = get_store_id()
+    others = [i for i in reference_cache.stores() if i != store_id]
+    return choose_store(random.choice(others) if others else store_id)
+
+
+# Переход в магазин по ссылке. Адрес сайта, закреплённый за другим магазином, важнее выбора
+@bp.route('/store/<int:store_id>')
+def store_page(store_id):
+    if store_id not in reference_cache.stores():
+        abort(404)
+    return choose_store(store_id)
 
 
 # Личный кабинет пользователя
-@app.route('/user_page')
+@bp.route('/user_page')
 @login_required
 def user_page():
     store_settings = get_store_settings()
     store_settings['title'] = 'Личный кабинет'
     db_sess = db_session.create_session()
-    # Загрузка данных о счёте из json-файла пользователя
-    with open(f'accounts/user_{current_user.id}.json', 'r', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)['currencies']
+    # Загрузка данных о счёте пользователя
+    data = accounts.get_wallet(db_sess, current_user.id)
+    currencies = reference_cache.currencies()
     money = []
     # Загрузка фотографий валют
     for i in data.keys():
-        logo = db_sess.query(Currency).filter(Currency.id == int(i)).first().logotype
-        money.append(
-            [url_for('static', filename=f'img/currencies/{logo}'), data[i]])
-    return render_template('user_page.html', money=money, **store_settings)
+        money.append([currencies[i].logo_url, pricing.to_units(data[i], currencies[i])])
+    return render_template('user_page.html', money=money, total=converted_total(data), **store_settings)
 
 
-# Получение бонуса пользователем
-@app.route('/get_bonus')
+# Получение бонуса пользователем. Бонус выдаётся один раз
+@bp.route('/get_bonus')
 @login_required
+@rate_limiter.limit('get_bonus')
 def get_bonus():
-    # Загрузка данных пользователя из json-файла
-    with open(f'accounts/user_{current_user.id}.json', 'r+', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)
-        jsonfile.seek(0)
-        db_sess = db_session.create_session()
-        # Добавление случайного количества каждой валюты
-        for i in db_sess.query(Currency).all():
-            money = random.randint(0, 9999)
-            money /= 10 ** random.randint(0, len(str(money)))
-            if i.is_integer == 1:
-                money = int(money)
-            data['currencies'][str(i.id)] += money
-        # Запись в json-файл новых данных
-        json.dump(data, jsonfile)
-        # Смена значения логического флага got_bonus для текущего пользователя и записи в базе данных
-        user = db_sess.query(User).filter(User.id == current_user.id).first()
-        user.got_bonus = 1
-        current_user.got_bonus = 1
-        db_sess.commit()
+    if current_user.got_bonus:
+        return redirect('/user_page')
+    # Случайное количество каждой валюты
+    amounts = dict()
+    for i in reference_cache.currencies().values():
+        money = random.randint(0, 9999)
+        money /= 10 ** random.randint(0, len(str(money)))
+        amounts[i.id] = pricing.to_minor(money, i)
+    # Зачисление бонуса и смена флага got_bonus выполняются в одной транзакции. Повторный запрос,
+    # в том числе параллельный, бонус не получит
+    if checkout.give_bonus(current_user.id, amounts):
+        user_cache.invalidate(current_user.id)
     return redirect(f'/user_page')
 
 
 # Добавление товара в корзину
-@app.route('/add_to_cart')
+@bp.route('/add_to_cart')
 @login_required
+@rate_limiter.limit('add_to_cart')
 def add_to_cart():
-    info = dict()
-    # Получение информации из запроса
-    for i in ['item_id', 'currency_id', 'price', 'discount', 'discount_price']:
-        info[i] = request.args.get(i)
-    # Загрузка данных из файла пользователя
-    with open(f'accounts/user_{current_user.id}.json', 'r+', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)
-        # Добавление информации о товаре
-        data['shopping_cart']['items'].append(info)
-        # Добавление цены товара к сумме цен товаров в корзине
-        if info['currency_id'] not in data['shopping_cart']['summary'].keys():
-            data['shopping_cart']['summary'][info['currency_id']] = 0
-        if info['discount_price'] != 'None':
-            data['shopping_cart']['summary'][info['currency_id']] += float(info['discount_price'])
-        else:
-            data['shopping_cart']['summary'][info['currency_id']] += float(info['price'])
-        # Перезапись данных
-        jsonfile.seek(0)
-        json.dump(data, jsonfile)
+    # Из запроса берётся только идентификатор товара, цена определяется на сервере
+    item_id = request.args.get('item_id', type=int)
+    with db_session.transaction() as db_sess:
+        item = db_sess.query(Item).get(item_id) if item_id is not None else None
+        if not item:
+            return abort(404)
+        # Добавление одной строки в корзину пользователя
+        accounts.add_to_cart(db_sess, current_user.id, item)
     return redirect('/')
 
 
 # Страница корзины
-@app.route('/shopping_cart')
+@bp.route('/shopping_cart')
 @login_required
 def shopping_cart(message=None):
     items = []
     summary = {}
-    currencies = dict()
     db_sess = db_session.create_session()
-    # Создание словаря с фотографиями валюты
-    for i in db_sess.query(Currency).all():
-        currencies[str(i.id)] = url_for('static', filename=f'img/currencies/{i.logotype}')
-    # Загрузка данных из файла
-    with open(f'accounts/user_{current_user.id}.json', 'r+', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)
-        # Заполенение списка с информацией о товарах
-        for i in data['shopping_cart']['items']:
-            item = db_sess.query(Item).filter(Item.id == i['item_id']).first()
-            items.append({'name': item.name, 'price': i['price'], 'discount': i['discount'],
-                          'discount_price': i['discount_price'], 'currency': currencies[i['currency_id']],
-                          'image': url_for('static', filename=f'img/items/{item.photo_name}'), 'id': i['item_id']})
-        # Заполнение словаря с суммой цен товаров в корзине
-        for i in data['shopping_cart']['summary'].keys():
-            summary[i] = {'currency': currencies[i], 'price':  data['shopping_cart']['summary'][i]}
+    # Словарь валют с готовыми ссылками на фотографии
+    currencies = reference_cache.currencies()
+    # Загрузка строк корзины
+    lines = accounts.get_cart(db_sess, current_user.id)
+    # Загрузка всех товаров корзины одним запросом
+    cart_items = get_item_loader(db_sess).load_many([i.item_id for i in lines])
+    # Заполенение списка с информацией о товарах
+    for i in lines:
+        item = cart_items[i.item_id]
+        currency = currencies[i.currency_id]
+        items.append({'name': item.name, 'price': pricing.to_units(i.price, currency), 'discount': i.discount,
+                      'discount_price': pricing.to_units(i.discount_price, currency), 'currency': currency.logo_url,
+                      'image': item_image(item.photo_name, 'thumb'),
+                      'image_webp': item_image_webp(item.photo_name, 'thumb'), 'id': i.item_id})
+    # Заполнение словаря с суммой цен товаров в корзине из текущих сумм, без пересчёта по строкам
+    cart_summary = cart_totals.get_totals(db_sess, current_user.id)
+    for i in cart_summary.keys():
+        summary[i] = {'currency': currencies[i].logo_url, 'price': pricing.to_units(cart_summary[i], currencies[i])}
     store_settings = get_store_settings()
     store_settings['title'] = 'Корзина'
-    return render_template('shopping_cart.html', items=items, summary=summary, message=message, **store_settings)
+    return render_template('shopping_cart.html', items=items, summary=summary, total=converted_total(cart_summary),
+                           message=message, **store_settings)
 
 
 # Удаление товара из корзины
-@app.route('/delete_from_cart/<int:item_id>')
+@bp.route('/delete_from_cart/<int:item_id>')
 @login_required
 def delete_from_cart(item_id):
-    # Загрузка данных
-    with open(f'accounts/user_{current_user.id}.json', 'r+', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)
-        for i in range(len(data['shopping_cart']['items'])):
-            # Удаление записи о товаре
-            if data['shopping_cart']['items'][i]['item_id'] == str(item_id):
-                item = data['shopping_cart']['items'][i]
-                del data['shopping_cart']['items'][i]
-                # Вычет цены из суммы цен товаров
-                if item['discount_price'] == 'None':
-                    data['shopping_cart']['summary'][item['currency_id']] -= float(item['price'])
-                else:
-                    data['shopping_cart']['summary'][item['currency_id']] -= float(item['discount_price'])
-                break
-        # Перезапись данных
-        jsonfile.seek(0)
-        jsonfile.truncate()
-        json.dump(data, jsonfile)
+    # Удаление записи о товаре
+    with db_session.transaction() as db_sess:
+        accounts.delete_from_cart(db_sess, current_user.id, item_id)
     return redirect('/shopping_cart')
 
 
 # Страница поиска
-@app.route('/search', methods=['GET', 'POST'])
+@bp.route('/search', methods=['GET', 'POST'])
+@page_cache.cached(params=('name', 'category', 'page', 'attr'))
 def search_page():
-    # Загрузка формы
-    form = SearchForm()
+    # Загрузка формы. Поиск и переход по страницам результатов выполняются GET-запросом,
+    # поэтому результаты можно кэшировать
+    form = SearchForm(request.values)
     db_sess = db_session.create_session()
-    # Занесение категорий в форму
-    form.category.choices = ['Всё']
-    form.category.choices.extend([i.name for i in db_sess.query(Category).all()])
+    # Занесение категорий в форму, 0 означает поиск по всем категориям
+    form.category.choices = [(0, 'Всё')]
+    form.category.choices.extend([(i.id, i.name) for i in reference_cache.categories().values()])
     store_settings = get_store_settings()
     store_settings['title'] = 'Поиск'
     # Обработка поиска
-    if form.validate_on_submit():
-        # Поиск только по имени
-        if form.category.data != 'Всё':
-            category_id = db_sess.query(Category).filter(Category.name == form.category.data).first().id
-            items = db_sess.query(Item).filter(Item.name.like(f"%{form.name.data}%"), Item.category == category_id).all()
-        # Поиск по имени и категории
-        else:
-            items = db_sess.query(Item).filter(Item.name.like(f"%{form.name.data}%")).all()
+    if 'name' in request.values and form.validate():
+        page = max(request.args.get('page', 1, type=int), 1)
+        selected = selected_attributes()
+        # Поиск по имени и свойствам товара с фильтром по категории и атрибутам через индексы
+        items, total = search_items(db_sess, form.name.data, form.category.data, page, SEARCH_PAGE_ITEMS, selected)
         # Заполенение словаря получеными данными
         items = {'items': items, 'rows': len(items) // 3 if len(items) % 3 == 0 else len(items) // 3 + 1,
-                 'length': len(items)}
-        # Возврат результатов
-        return render_template('search.html', items=items, form=form, **store_settings)
-    return render_template('search.html', items={'items': []}, form=form, **store_settings)
+                 'length': len(items), 'page': page, 'pages': (total + SEARCH_PAGE_ITEMS - 1) // SEARCH_PAGE_ITEMS,
+                 'total': total}
+        # Фасеты считаются по всем найденным товарам: категории - без фильтра по категории,
+        # атрибуты - внутри выбранной категории
+        table = facet_index.get()
+        found = table.bitmap(search_item_ids(db_sess, form.name.data))
+        category_counts = dict(table.counts(table.select(selected, found)).get(CATEGORY, []))
+        if form.category.data:
+            found = table.select([(CATEGORY, form.category.data)], found)
+        query = urllib.parse.urlencode({'name': form.name.data})
+        url = f'/search?{query}&category={form.category.data}'
+        categories = [{'name': category.name, 'count': category_counts[category.id],
+                       'active': category.id == form.category.data,
+                       'url': f'/search?{query}&category={category.id}' + filter_query(selected)}
+                      for category in reference_cache.categories().values() if category.id in category_counts]
+        return render_template('search.html', items=items, form=form, facets=facet_groups(table, found, selected, url),
+                               categories=categories, filters=filter_query(selected), **store_settings)
+    return render_template('search.html', items={'items': []}, form=form, facets=[], categories=[], filters='',
+                           **store_settings)
+
+
+# Каталог товаров, целиком или по категории. Страницы выбираются по ключу последнего
+# показанного товара (см. data/listing.py), поэтому время ответа не зависит от номера страницы
+@bp.route('/catalogue')
+@bp.route('/category/<int:category_id>')
+@page_cache.cached(params=('sort', 'after', 'attr'))
+def catalogue(category_id=None):
+    categories = reference_cache.categories()
+    if category_id is not None and category_id not in categories:
+        abort(404)
+    store_settings = get_store_settings()
+    store_settings['title'] = categories[category_id].name if category_id is not None else 'Каталог'
+    sort = request.args.get('sort', 'id')
+    token = request.args.get('after')
+    selected = selected_attributes()
+    db_sess = db_session.create_session()
+    try:
+        page = listing.list_items(db_sess, category_id, sort, token, CATALOGUE_PAGE_ITEMS, selected)
+    except listing.InvalidPageToken:
+        abort(400)
+    # Число товаров каждой категории с выбранными атрибутами и фасеты атрибутов внутри текущей категории
+    table = facet_index.get()
+    category_counts = dict(table.counts(table.select(selected)).get(CATEGORY, []))
+    base = None if category_id is None else table.select([(CATEGORY, category_id)])
+    facets = facet_groups(table, base, selected, f'{request.path}?sort={sort}')
+    return render_template('category.html', items=page.items, next_token=page.next_token, first_page=not token,
+                           sort=sort, category_id=category_id, categories=categories.values(),
+                           category_counts=category_counts, facets=facets, filters=filter_query(selected),
+                           base_url=request.path, **store_settings)
 
 
 # Оформление заказа
-@app.route('/order')
+@bp.route('/order')
 @login_required
 def order():
-    # Логический флаг для идентификации успеха заказа
-    success = True
-    # Загрузка данных пользователя
-    with open(f'accounts/user_{current_user.id}.json', 'r+', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)
-        # Перебор значений валют в сумме цен товаров в корзине
-        # Если какой-то валюты не хватает, меняю значение флага на False
-        for i in data['shopping_cart']['summary'].keys():
-            if data['currencies'][i] < data['shopping_cart']['summary'][i]:
-                success = False
-                break
-        # В случае нехватки средств возвращаю страницу корзины с соответствувющим сообщением
-        if not success:
-            return shopping_cart('На вашем счёте недостаточно средств для оформления заказа')
-        else:
-            # В противном случае генерирую идентификатор заказа
-            while True:
-                key = random.randint(100000, 999999)
-                if key not in data['orders'].keys():
-                    break
-            # Заношу данные о заказе в данные опльзователя
-            data['orders'][key] = dict()
-            data['orders'][key]['summary'] = data['shopping_cart']['summary'].copy()
-            # Вычитаю сумму цен заказа
-            for i in list(data['shopping_cart']['summary']):
-                data['currencies'][i] -= data['shopping_cart']['summary'][i]
-                del data['shopping_cart']['summary'][i]
-            data['orders'][key]['items'] = data['shopping_cart']['items']
-            data['shopping_cart']['items'] = []
-            # Перезаписываю данные в файл
-            jsonfile.seek(0)
-            jsonfile.truncate()
-            json.dump(data, jsonfile)
-            return redirect('/orders')
+    # Списание средств, перенос корзины в заказ и её очистка выполняются в одной транзакции.
+    # Повторный переход по той же ссылке (с тем же ключом) не создаёт второй заказ
+    try:
+        checkout.place_order(current_user.id, request.args.get('key'))
+    # В случае нехватки средств возвращаю страницу корзины с соответствувющим сообщением
+    except accounts.NotEnoughMoneyError:
+        return shopping_cart('На вашем счёте недостаточно средств для оформления заказа')
+    except accounts.CartChangedError:
+        return shopping_cart('Корзина изменилась во время оформления заказа, проверьте её и повторите')
+    return redirect('/orders')
 
 
 # Страница заказов
-@app.route('/orders')
+@bp.route('/orders')
 @login_required
 def orders():
     store_settings = get_store_settings()
     store_settings['title'] = 'Заказы'
-    # Загрузка данных пользователя
-    with open(f'accounts/user_{current_user.id}.json', 'r+', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)
-    return render_template('orders.html', orders=data['orders'], **store_settings)
+    # Загрузка номеров заказов пользователя
+    db_sess = db_session.create_session()
+    return render_template('orders.html', orders=accounts.get_order_ids(db_sess, current_user.id), **store_settings)
 
 
 # Удаление заказа
-@app.route('/delete_order/<int:order_id>')
+@bp.route('/delete_order/<int:order_id>')
 @login_required
 def delete_order(order_id):
-    order_id = str(order_id)
-    # Загрузка данных
-    with open(f'accounts/user_{current_user.id}.json', 'r+', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)
-        # Проверка на наличие заказа в данных по идентификатору
-        if order_id in data['orders'].keys():
-            # Удаление заказа и перезпись
-            del data['orders'][order_id]
-            jsonfile.seek(0)
-            jsonfile.truncate()
-            json.dump(data, jsonfile)
-            return redirect('/orders')
-        else:
-            return abort(404)
+    # Проверка на наличие заказа по идентификатору и его удаление
+    with db_session.transaction() as db_sess:
+        deleted = accounts.delete_order(db_sess, current_user.id, order_id)
+    if deleted is None:
+        return abort(404)
+    return redirect('/orders')
 
 
 # Страница заказа
-@app.route('/order/<int:order_id>')
+@bp.route('/order/<int:order_id>')
 @login_required
 def order_page(order_id):
     store_settings = get_store_settings()
     order_id = str(order_id)
     store_settings['title'] = 'Заказ №' + order_id
-    # Загрузка данных
-    with open(f'accounts/user_{current_user.id}.json', 'r+', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)
-        if order_id not in data['orders'].keys():
-            return abort(404)
-    order_data = {'items': [], 'summary': {}}
     db_sess = db_session.create_session()
-    currencies = dict()
-    # Создание словаря с фото валют
-    for i in db_sess.query(Currency).all():
-        currencies[str(i.id)] = url_for('static', filename=f'img/currencies/{i.logotype}')
+    # Проверка наличия заказа у пользователя
+    if not accounts.get_order(db_sess, current_user.id, int(order_id)):
+        return abort(404)
+    order_data = {'items': [], 'summary': {}}
+    # Словарь валют с готовыми ссылками на фотографии
+    currencies = reference_cache.currencies()
+    lines = accounts.get_order_items(db_sess, int(order_id))
+    # Загрузка всех товаров заказа одним запросом
+    order_items = get_item_loader(db_sess).load_many([i.item_id for i in lines])
     # Заполнение списка товаров в заказе
-    for i in data['orders'][order_id]['items']:
-        item = db_sess.query(Item).filter(Item.id == int(i['item_id'])).first()
-        order_data['items'].append({'name': item.name, 'price': i['price'], 'discount': i['discount'],
-                          'discount_price': i['discount_price'], 'currency': currencies[i['currency_id']],
-                          'image': url_for('static', filename=f'img/items/{item.photo_name}'), 'id': i['item_id']})
+    for i in lines:
+        item = order_items[i.item_id]
+        currency = currencies[i.currency_id]
+        order_data['items'].append({'name': item.name, 'price': pricing.to_units(i.price, currency),
+                          'discount': i.discount, 'discount_price': pricing.to_units(i.discount_price, currency),
+                          'currency': currency.logo_url,
+                          'image': item_image(item.photo_name, 'thumb'),
+                          'image_webp': item_image_webp(item.photo_name, 'thumb'), 'id': i.item_id})
     # Заполенение словаря с суммой
-    for i in data['orders'][order_id]['summary'].keys():
-        order_data['summary'][i] = {'currency': currencies[i], 'price':  data['orders'][order_id]['summary'][i]}
+    order_summary = accounts.get_order_summary(db_sess, int(order_id))
+    for i in order_summary.keys():
+        order_data['summary'][i] = {'currency': currencies[i].logo_url,
+                                    'price': pricing.to_units(order_summary[i], currencies[i])}
+    order_data['total'] = converted_total(order_summary)
     return render_template('order.html', order_data=order_data, order_id=order_id, **store_settings)
 
 
 # Возвращение денег за заказ
-@app.route('/refund_order/<int:order_id>')
+@bp.route('/refund_order/<int:order_id>')
 @login_required
 def refund_order(order_id):
-    order_id = str(order_id)
-    # Загрузка данных
-    with open(f'accounts/user_{current_user.id}.json', 'r+', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)
-        # Поиск заказа по идентификатору
-        if order_id not in data['orders'].keys():
-            return abort(404)
-        # Возврат денег
-        for i in data['orders'][order_id]['summary'].keys():
-            data['currencies'][i] += data['orders'][order_id]['summary'][i]
-        # Перезапись данных
-        jsonfile.seek(0)
-        jsonfile.truncate()
-        json.dump(data, jsonfile)
-    # Редирект на страницу удаления заказа
-    return delete_order(order_id)
+    # Возврат денег и удаление заказа в одной транзакции
+    refunded = checkout.refund_order(current_user.id, order_id, request.args.get('key'))
+    if not refunded:
+        return abort(404)
+    return redirect('/orders')
 
 
 # Страница обмена валют
-@app.route('/exchange')
+@bp.route('/exchange')
 @login_required
-def exchange(message=None):
+def exchange(message=None, target_id=None):
     store_settings = get_store_settings()
     store_settings['title'] = 'Обмен валют'
-    db_sess = db_session.create_session()
+    currencies = reference_cache.currencies()
+    table = rates.get()
+    # Валюта, на которую меняются остальные, выбирается параметром to
+    if target_id is None:
+        target_id = request.args.get('to', type=int)
+    if target_id not in table.positions:
+        target_id = int(table.ids[0])
+    sources = [i for i in table.ids.tolist() if i != target_id]
+    # Курсы всех валют к выбранной рассчитываются одним векторным вызовом по кэшированной матрице курсов
+    lots, received = table.offers(sources, target_id)
     data = []
-    currencies = db_sess.query(Currency).all()
-    # Случайное определение валюты и цены
-    for i in currencies:
-        j = random.choice(currencies)
-        price = random.randint(0, 9999)
-        price /= 10 ** random.randint(0, len(str(price)))
-        if j.is_integer == 1:
-            price = int(price)
-        # Занесение курса в список
-        data.append({'first_id': i.id, 'first_logo': url_for('static', filename=f'img/currencies/{i.logotype}'),
-                     'second_id': j.id, 'second_logo': url_for('static', filename=f'img/currencies/{j.logotype}'),
-                     'amount': price})
-    return render_template('exchange.html', message=message, data=data, **store_settings)
-
-
-# Обработка обмена валют
-@app.route('/change_currencies')
+    for currency_id, lot, amount in zip(sources, lots.tolist(), received.tolist()):
+        data.append({'first_id': currency_id, 'first_logo': currencies[currency_id].logo_url,
+                     'first_amount': pricing.to_units(lot, currencies[currency_id]),
+                     'second_id': target_id, 'second_logo': currencies[target_id].logo_url,
+                     'amount': pricing.to_units(amount, currencies[target_id])})
+    targets = [{'id': i, 'logo': currencies[i].logo_url} for i in table.ids.tolist()]
+    return render_template('exchange.html', message=message, data=data, targets=targets, target_id=target_id,
+                           version=table.version, **store_settings)
+
+
+# Обработка обмена валют. Сумма к получению рассчитывается по курсу на сервере, а не берётся из запроса
+@bp.route('/change_currencies')
 @login_required
+@rate_limiter.limit('change_currencies')
 def change_currencies():
-    info = dict()
-    # Получение данных из запроса
-    for i in ['first_id', 'second_id', 'amount']:
-        info[i] = request.args.get(i)
-    # Загрузка данных пользователя
-    with open(f'accounts/user_{current_user.id}.json', 'r+', encoding='utf-8') as jsonfile:
-        data = json.load(jsonfile)
-        # Проверка наличия достаточного количества денег у пользователя
-        if data['currencies'][info['first_id']] < 1:
-            return exchange('На вашем счёте недостаточно средств для совершения обмена')
-        else:
-            # Совершение обмена
-            data['currencies'][info['first_id']] -= 1
-            data['currencies'][info['second_id']] += float(info['amount'])
-            # Перезапись данных
-            jsonfile.seek(0)
-            jsonfile.truncate()
-            json.dump(data, jsonfile)
-            return redirect('/exchange')
+    # Получение данных из запроса: сколько единиц первой валюты обменять и по какой версии курсов
+    first_id = request.args.get('first_id', type=int)
+    second_id = request.args.get('second_id', type=int)
+    amount = request.args.get('amount', type=float)
+    version = request.args.get('version', type=int)
+    currencies = reference_cache.currencies()
+    table = rates.get()
+    if first_id not in table.positions or second_id not in table.positions or first_id == second_id \
+            or amount is None or not math.isfinite(amount) or not amount > 0:
+        return abort(404)
+    # Пользователь видел предложение по прежним курсам
+    if version != table.version:
+        return exchange('Курсы валют изменились, проверьте новые условия обмена', second_id)
+    if amount > MAX_EXCHANGE_AMOUNT:
+        return exchange('Сумма слишком велика для обмена', second_id)
+    amount_from = pricing.to_minor(amount, currencies[first_id])
+    try:
+        amount_to = table.exchange_amount(amount_from, first_id, second_id)
+    except OverflowError:
+        return exchange('Сумма слишком велика для обмена', second_id)
+    if amount_from <= 0 or amount_to <= 0:
+        return exchange('Сумма слишком мала для обмена', second_id)
+    # Списание и зачисление выполняются в одной транзакции
+    try:
+        checkout.exchange_money(current_user.id, first_id, amount_from, second_id, amount_to)
+    # Проверка наличия достаточного количества денег у пользователя
+    except accounts.NotEnoughMoneyError:
+        return exchange('На вашем счёте недостаточно средств для совершения обмена', second_id)
+    return redirect(f'/exchange?to={second_id}')
 
 
 # FAQ по доставке
-@app.route('/delivery_info')
+@bp.route('/delivery_info')
+@page_cache.cached()
 def delivery_info():
     store_settings = get_store_settings()
     store_settings['title'] = 'Условия доставки'
@@ -599,7 +838,8 @@ def delivery_info():
 
 
 # Общее FAQ
-@app.route('/faq')
+@bp.route('/faq')
+@page_cache.cached()
 def faq():
     store_settings = get_store_settings()
     store_settings['title'] = 'Частые вопросы'
@@ -607,21 +847,33 @@ def faq():
 
 
 # Замена стандартных страниц ошибок
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found(error):
     return render_template('404.html')
 
 
-@app.errorhandler(401)
+@bp.app_errorhandler(401)
 def unauthorized(error):
     return render_template('401.html')
 
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def server_error(error):
     return render_template('500.html')
 
 
+# Очередь к потокам хэширования паролей переполнена
+@bp.app_errorhandler(CredentialsBusy)
+def credentials_busy(error):
+    return render_template('503.html'), 503, {'Retry-After': '5'}
+
+
+# Превышение частоты запросов (см. web/limits.py)
+@bp.app_errorhandler(RateLimited)
+def rate_limited(error):
+    return render_template('429.html', retry_after=error.retry_after), 429, {'Retry-After': str(error.retry_after)}
+
+
 # Главный цикл
 if __name__ == '__main__':
     main()
@@ -0,0 +1,55 @@
+# Одноразовый перенос данных пользователей из accounts/user_{id}.json в базу данных.
+# После успешного импорта файл переименовывается, поэтому повторный запуск его не затронет
+from data import db_session
+from data import accounts
+from data.user import User
+import glob
+import json
+import os
+import re
+
+
+# Чтение файла аккаунта. Старый код перезаписывал файл без усечения, и после json-объекта
+# могли остаться байты прежнего содержимого: в этом случае берётся объект из начала файла
+def read_account(path):
+    with open(path, 'r', encoding='utf-8') as jsonfile:
+        text = jsonfile.read()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        data, _ = json.JSONDecoder().raw_decode(text.lstrip())
+        print(f'Файл {path}: после данных аккаунта лишние символы, они отброшены')
+        return data
+
+
+def migrate(accounts_dir='accounts'):
+    imported = 0
+    skipped = 0
+    for path in sorted(glob.glob(os.path.join(accounts_dir, 'user_*.json'))):
+        user_id = int(re.search(r'user_(\d+)\.json$', path).group(1))
+        # Повреждённый файл пропускается и остаётся на месте, остальные аккаунты переносятся
+        try:
+            data = read_account(path)
+        except json.JSONDecodeError as error:
+            print(f'Файл {path} не прочитан: {error}')
+            skipped += 1
+            continue
+        # Каждый пользователь переносится в отдельной транзакции
+        try:
+            with db_session.transaction() as db_sess:
+                if not db_sess.query(User).get(user_id):
+                    print(f'Пользователь {user_id} не найден, файл {path} пропущен')
+                    continue
+                accounts.import_account(db_sess, user_id, data)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            print(f'Файл {path} не перенесён: {error!r}')
+            skipped += 1
+            continue
+        os.rename(path, path + '.imported')
+        imported += 1
+    print(f'Перенесено аккаунтов: {imported}, пропущено с ошибками: {skipped}')
+
+
+if __name__ == '__main__':
+    db_session.global_init("db/store_database.db")
+    migrate()
@@ -0,0 +1,45 @@
+# Построение индекса рекомендаций "С этим товаром покупают" (см. data/recommendations.py).
+# build - полное построение по всем заказам, update - добавление заказов, появившихся после прошлого запуска.
+# Запуск из корня проекта:
+#   python recommendations_tool.py build
+#   python recommendations_tool.py update [--watch 60]
+import argparse
+import os
+import time
+from data import db_session
+from data import recommendations
+
+
+def run(command, directory, top_k):
+    start = time.perf_counter()
+    with db_session.transaction() as db_sess:
+        connection = db_sess.connection()
+        if command == 'update':
+            count = recommendations.update_index(connection, directory, top_k)
+            if count is not None:
+                if count:
+                    print(f'Граница учтённых заказов продвинута на {count} за {time.perf_counter() - start:.2f} с')
+                return
+            print('Индекс ещё не построен, выполняется полное построение')
+        last_order, pairs = recommendations.build_index(connection, directory, top_k)
+    print(f'Индекс построен по заказам до {last_order}: {pairs} пар товаров за {time.perf_counter() - start:.2f} с')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Построение индекса рекомендаций')
+    parser.add_argument('command', choices=['build', 'update'])
+    parser.add_argument('--watch', type=float, default=0,
+                        help='повторять обновление с этим интервалом в секундах, 0 - выполнить один раз')
+    parser.add_argument('--directory', default=os.environ.get('RECOMMENDATIONS_DIR', 'cache/recommendations'))
+    parser.add_argument('--top-k', type=int, default=recommendations.TOP_K)
+    parser.add_argument('--database', default=os.environ.get('DATABASE_URL', 'db/store_database.db'))
+    args = parser.parse_args()
+    db_session.global_init(args.database)
+    run(args.command, args.directory, args.top_k)
+    while args.watch:
+        time.sleep(args.watch)
+        run('update', args.directory, args.top_k)
+
+
+if __name__ == '__main__':
+    main()
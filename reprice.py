@@ -0,0 +1,20 @@
+# Пересчёт цен всего каталога на текущую или указанную эпоху.
+# Запуск: python reprice.py [эпоха]
+from data import db_session
+from data import pricing
+import os
+import sys
+import time
+
+
+def main():
+    epoch = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    db_session.global_init(os.environ.get('DATABASE_URL', "db/store_database.db"))
+    start = time.perf_counter()
+    with db_session.transaction() as db_sess:
+        count = pricing.reprice_all(db_sess.connection(), epoch)
+    print(f'Пересчитано цен: {count} за {time.perf_counter() - start:.2f} с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# Общие фикстуры тестов: приложение на небольшой синтетической базе (см. benchmarks/seed.py).
+# Подключение к базе в data/db_session создаётся один раз на процесс, поэтому приложение одно на все тесты
+import pytest
+import sqlalchemy as sa
+from benchmarks.seed import seed_database, email, PASSWORD
+from data import db_session
+import main
+
+USERS = 10
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    path = tmp_path_factory.mktemp('db') / 'store.db'
+    seed_database(str(path), items=500, users=USERS, cart_lines=0, orders=0)
+    app = main.create_app({'DATABASE_URL': str(path), 'PRELOAD_CACHES': False, 'METRICS_ENABLED': False,
+                           'RATE_LIMITS': '', 'RECOMMENDATIONS_DIR': str(tmp_path_factory.mktemp('recommendations'))})
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return app
+
+
+# Клиент, вошедший под пользователем user_id
+@pytest.fixture
+def login(app):
+    def login(user_id):
+        client = app.test_client()
+        response = client.post('/login', data={'email': email(user_id), 'password': PASSWORD})
+        assert response.status_code == 302
+        return client
+    return login
+
+
+# Счётчик запросов к базе: внутри блока with queries считаются все выполненные SQL-запросы
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        sa.event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *args):
+        sa.event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+@pytest.fixture
+def queries(app):
+    db_sess = db_session.create_standalone_session()
+    engine = db_sess.get_bind()
+    db_sess.close()
+    return QueryCounter(engine)
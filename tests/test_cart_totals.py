@@ -0,0 +1,46 @@
+# Суммы корзины в cart_totals меняются на каждой операции (см. data/cart_totals.py) и должны всегда
+# совпадать с суммой, посчитанной заново по строкам корзины. Проверяются тысячи случайных
+# последовательностей добавлений, удалений и оформлений заказа с фиксированным зерном генератора
+import random
+from data import db_session
+from data import accounts
+from data import cart_totals
+from data import checkout
+from data.item import Item
+
+SEED = 10
+STEPS = 3000
+USER_IDS = [5, 6, 7]
+# Небольшой набор товаров, чтобы удаления чаще попадали в товары, лежащие в корзине
+ITEMS = 30
+
+
+def expected_totals(db_sess, user_id):
+    summary = accounts.get_summary(accounts.get_cart(db_sess, user_id))
+    return {currency_id: amount for currency_id, amount in sorted(summary.items()) if amount}
+
+
+def random_step(rng, user_id, item_ids):
+    operation = rng.choices(['add', 'delete', 'checkout'], weights=[6, 3, 1])[0]
+    if operation == 'checkout':
+        checkout.place_order(user_id)
+        return
+    with db_session.transaction() as db_sess:
+        item_id = rng.choice(item_ids)
+        if operation == 'add':
+            accounts.add_to_cart(db_sess, user_id, db_sess.query(Item).get(item_id))
+        else:
+            accounts.delete_from_cart(db_sess, user_id, item_id)
+
+
+def test_cart_totals_match_cart_lines(app):
+    rng = random.Random(SEED)
+    db_sess = db_session.create_session()
+    item_ids = [i for i, in db_sess.query(Item.id).order_by(Item.id).limit(ITEMS)]
+    db_session.remove_session()
+    for step in range(STEPS):
+        user_id = rng.choice(USER_IDS)
+        random_step(rng, user_id, item_ids)
+        db_sess = db_session.create_session()
+        assert cart_totals.get_totals(db_sess, user_id) == expected_totals(db_sess, user_id), f'шаг {step}'
+        db_session.remove_session()
@@ -0,0 +1,84 @@
+# Одна корзина оплачивается один раз, даже если её оформляют одновременно несколько процессов
+# (воркеры gunicorn): блокировки data/checkout.py действуют только внутри процесса
+import multiprocessing
+import pytest
+from data import db_session
+from data import accounts
+from data import checkout
+from data.item import Item
+
+LINES = 20
+PROCESSES = 4
+
+
+def fill_cart(user_id, lines):
+    with db_session.transaction() as db_sess:
+        for item in db_sess.query(Item).order_by(Item.id).limit(lines):
+            accounts.add_to_cart(db_sess, user_id, item)
+    db_session.remove_session()
+
+
+def read_account(user_id):
+    db_sess = db_session.create_session()
+    cart = accounts.get_summary(accounts.get_cart(db_sess, user_id))
+    wallet = accounts.get_wallet(db_sess, user_id)
+    orders = accounts.get_order_ids(db_sess, user_id)
+    db_session.remove_session()
+    return cart, wallet, orders
+
+
+def charged(before, after):
+    return {currency_id: amount - after[currency_id] for currency_id, amount in before.items()
+            if amount != after[currency_id]}
+
+
+# Запускается в отдельном процессе со своим подключением к базе
+def place_order(database, user_id, barrier, results):
+    db_session.global_init(database)
+    barrier.wait()
+    try:
+        results.put(checkout.place_order(user_id))
+    except accounts.CartChangedError:
+        results.put(None)
+
+
+def test_concurrent_checkouts_charge_cart_once(app):
+    user_id = 8
+    fill_cart(user_id, LINES)
+    cart, wallet, orders = read_account(user_id)
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(PROCESSES)
+    results = context.Queue()
+    processes = [context.Process(target=place_order, args=(app.config['DATABASE_URL'], user_id, barrier, results))
+                 for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    placed = [results.get(timeout=5) for _ in processes]
+    _, new_wallet, new_orders = read_account(user_id)
+    assert charged(wallet, new_wallet) == cart
+    db_sess = db_session.create_session()
+    lines = sum(len(accounts.get_order_items(db_sess, order_id)) for order_id in new_orders if order_id not in orders)
+    db_session.remove_session()
+    assert lines == LINES
+    assert len([order_id for order_id in placed if order_id is not None]) == len(new_orders) - len(orders)
+
+
+# Оформление по строкам корзины, прочитанным до того, как другой процесс уже оформил её:
+# так выглядит гонка в серверной базе, где транзакции не упорядочены блокировкой всей базы
+def test_checkout_of_already_ordered_cart_is_rolled_back(app, monkeypatch):
+    user_id = 9
+    fill_cart(user_id, LINES)
+    db_sess = db_session.create_session()
+    stale_lines = accounts.get_cart(db_sess, user_id)
+    db_sess.expunge_all()
+    db_session.remove_session()
+    checkout.place_order(user_id)
+    _, wallet, orders = read_account(user_id)
+    monkeypatch.setattr(accounts, 'get_cart', lambda db_sess, user_id: stale_lines)
+    with pytest.raises(accounts.CartChangedError):
+        checkout.place_order(user_id)
+    monkeypatch.undo()
+    assert read_account(user_id)[1:] == (wallet, orders)
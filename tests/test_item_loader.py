@@ -0,0 +1,43 @@
+# Товары корзины и заказа загружаются одним запросом (см. data/item_loader.py),
+# поэтому число запросов к базе не зависит от числа строк
+from data import db_session
+from data import accounts
+from data import checkout
+from data.item import Item
+
+SMALL = 1
+LARGE = 200
+
+
+def fill_cart(user_id, lines):
+    with db_session.transaction() as db_sess:
+        items = db_sess.query(Item).order_by(Item.id).limit(lines).all()
+        for item in items:
+            accounts.add_to_cart(db_sess, user_id, item)
+    db_session.remove_session()
+
+
+# Число запросов при повторном открытии страницы: первое открытие заполняет кэши пользователя и справочников
+def count_queries(client, queries, url):
+    assert client.get(url).status_code == 200
+    with queries:
+        assert client.get(url).status_code == 200
+    return queries.count
+
+
+def test_cart_queries_do_not_depend_on_cart_size(login, queries):
+    counts = []
+    for user_id, lines in [(1, SMALL), (2, LARGE)]:
+        fill_cart(user_id, lines)
+        counts.append(count_queries(login(user_id), queries, '/shopping_cart'))
+    assert counts[0] == counts[1]
+
+
+def test_order_queries_do_not_depend_on_order_size(login, queries):
+    counts = []
+    for user_id, lines in [(3, SMALL), (4, LARGE)]:
+        fill_cart(user_id, lines)
+        order_id = checkout.place_order(user_id)
+        db_session.remove_session()
+        counts.append(count_queries(login(user_id), queries, f'/order/{order_id}'))
+    assert counts[0] == counts[1]
@@ -0,0 +1,41 @@
+# Постраничный обход каталога по токенам (см. data/listing.py) выдаёт каждый товар ровно один раз
+# и в порядке сортировки, в том числе товары без категории или названия
+import pytest
+from data import db_session
+from data import listing
+from data.item import Item
+
+PER_PAGE = 7
+CATEGORY_ID = 2
+
+
+def all_pages(db_sess, category_id, sort):
+    items, token = [], None
+    while True:
+        page = listing.list_items(db_sess, category_id, sort, token, PER_PAGE)
+        items += page.items
+        token = page.next_token
+        if not token:
+            return [item.id for item in items]
+
+
+def expected_order(sort, category_id):
+    if sort == 'name':
+        return lambda item: (item.name or '', item.id)
+    return lambda item: (item.id,) if category_id is not None else (item.category or 0, item.id)
+
+
+@pytest.mark.parametrize('sort', ['id', 'name'])
+@pytest.mark.parametrize('category_id', [None, CATEGORY_ID])
+def test_pages_cover_catalogue_in_sort_order(app, sort, category_id):
+    with db_session.transaction() as db_sess:
+        if not db_sess.query(Item).filter(Item.category.is_(None)).count():
+            db_sess.add_all([Item(name=None, category=None), Item(name='Без категории', category=None),
+                             Item(name=None, category=CATEGORY_ID)])
+    db_sess = db_session.create_session()
+    query = db_sess.query(Item)
+    if category_id is not None:
+        query = query.filter(Item.category == category_id)
+    expected = [item.id for item in sorted(query, key=expected_order(sort, category_id))]
+    assert all_pages(db_sess, category_id, sort) == expected
+    db_session.remove_session()
@@ -0,0 +1,135 @@
+import hashlib
+import json
+from flask import Blueprint, request, jsonify, Response
+from data import db_session
+from data import listing
+from data.item import Item
+from data.category import Category
+from data.currency import Currency
+from data.store import Store
+
+# JSON API каталога. Все ответы только для чтения и поддерживают условные запросы по ETag
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+# Строк, которые выгрузка получает из базы за один раз
+EXPORT_BATCH = 1000
+
+
+# Ошибка запроса к API, отдаётся в виде {"error": "..."}
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@api.errorhandler(ApiError)
+def api_error(error):
+    response = jsonify({'error': error.message})
+    response.status_code = error.status
+    return response
+
+
+# Выбор полей параметром fields, например ?fields=id,name. По умолчанию отдаются все столбцы модели
+def selected_fields(model):
+    columns = model.__table__.columns.keys()
+    if not request.args.get('fields'):
+        return columns
+    fields = request.args['fields'].split(',')
+    unknown = [i for i in fields if i not in columns]
+    if unknown:
+        raise ApiError(f'неизвестные поля: {", ".join(unknown)}')
+    return fields
+
+
+def serialize(row, fields):
+    data = row.to_dict()
+    return {i: data[i] for i in fields}
+
+
+# Ответ с ETag по содержимому: клиент с актуальной копией получает 304 без тела
+def conditional_json(data):
+    response = jsonify(data)
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def reference_list(model):
+    fields = selected_fields(model)
+    rows = db_session.create_session().query(model).order_by(model.id)
+    return conditional_json([serialize(i, fields) for i in rows])
+
+
+@api.route('/categories')
+def categories():
+    return reference_list(Category)
+
+
+@api.route('/currencies')
+def currencies():
+    return reference_list(Currency)
+
+
+@api.route('/stores')
+def stores():
+    return reference_list(Store)
+
+
+# Страница товаров: /api/v1/items?category=1&sort=name&limit=50&after=<токен>.
+# Токен следующей страницы возвращается в поле next, на последней странице он равен null
+@api.route('/items')
+def items():
+    fields = selected_fields(Item)
+    category_id = request.args.get('category', type=int)
+    limit = request.args.get('limit', 24, type=int)
+    try:
+        page = listing.list_items(db_session.create_session(), category_id, request.args.get('sort', 'id'),
+                                  request.args.get('after'), limit)
+    except listing.InvalidPageToken:
+        raise ApiError('неверный токен страницы или сортировка')
+    return conditional_json({'items': [serialize(i, fields) for i in page.items], 'next': page.next_token})
+
+
+@api.route('/items/<int:item_id>')
+def item(item_id):
+    fields = selected_fields(Item)
+    found = db_session.create_session().query(Item).get(item_id)
+    if found is None:
+        raise ApiError('товар не найден', 404)
+    return conditional_json(serialize(found, fields))
+
+
+# Строки выгрузки читаются из базы пачками по EXPORT_BATCH, поэтому память не зависит от размера каталога.
+# Выбираются только запрошенные столбцы, без создания объектов модели
+def export_rows(columns, category_id):
+    db_sess = db_session.create_standalone_session()
+    try:
+        query = db_sess.query(*columns).order_by(Item.id)
+        if category_id is not None:
+            query = query.filter(Item.category == category_id)
+        for row in query.yield_per(EXPORT_BATCH):
+            yield json.dumps(row._asdict(), ensure_ascii=False) + '\n'
+    finally:
+        db_sess.close()
+
+
+# Выгрузка всех товаров (или одной категории) в формате NDJSON: один товар в строке.
+# ETag строится по версии каталога, поэтому проверка актуальности не читает сами товары
+@api.route('/items/export')
+def export_items():
+    fields = selected_fields(Item)
+    category_id = request.args.get('category', type=int)
+    version = listing.catalogue_version(db_session.create_session())
+    etag = None
+    if version is not None:
+        key = f'{version}:{",".join(fields)}:{category_id}'
+        etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+    response = Response(export_rows([getattr(Item, i) for i in fields], category_id),
+                        mimetype='application/x-ndjson')
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
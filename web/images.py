@@ -0,0 +1,33 @@
+from flask import url_for
+from .static_files import JsonManifest, asset_path
+
+
+# Манифест уменьшенных копий фотографий товаров
+class ImageManifest(JsonManifest):
+    # Путь к копии нужного размера и формата внутри static или None, если копии нет
+    def find(self, photo_name, size, image_format=None):
+        entry = self.entries().get(photo_name)
+        if entry is None or size not in entry['variants']:
+            return None
+        files = entry['variants'][size]['files']
+        if image_format is None:
+            return next(path for file_format, path in files.items() if file_format != 'webp')
+        return files.get(image_format)
+
+
+# Уменьшенные копии фотографий строит скрипт build_images.py
+image_manifest = ImageManifest('static/img/derived/manifest.json')
+
+
+# Ссылка на фотографию товара нужного размера (thumb, card, full).
+# Если копия не построена, возвращается ссылка на исходную фотографию
+def item_image(photo_name, size='card'):
+    path = image_manifest.find(photo_name, size)
+    return url_for('static', filename=path or asset_path(f'img/items/{photo_name}'))
+
+
+# Ссылка на WebP-копию фотографии или None, если её нет
+def item_image_webp(photo_name, size='card'):
+    path = image_manifest.find(photo_name, size, 'webp')
+    return url_for('static', filename=path) if path else None
+
@@ -0,0 +1,180 @@
+from collections import OrderedDict
+from functools import wraps
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from flask import request
+from flask_login import current_user
+from werkzeug.wsgi import ClosingIterator
+
+# Ограничение частоты запросов к дорогим и опасным адресам по алгоритму "ведро с жетонами":
+# у каждого пользователя (или адреса IP для анонимных) в ведре не больше capacity жетонов,
+# ведро пополняется со скоростью capacity / period жетонов в секунду, каждый запрос забирает жетон.
+# Правила задаются строкой вида "login=10/60,get_bonus=3/3600": не больше 10 запросов за 60 секунд
+# подряд, дальше - по мере пополнения
+
+# Сколько вёдер хранится в памяти процесса. Давно не использованные вёдра полны и удаляются первыми
+MAX_BUCKETS = 100000
+# Вёдра в общем хранилище, не использованные дольше этого времени, удаляются
+SHARED_BUCKET_TTL = 24 * 3600
+
+
+# Превышение частоты запросов. retry_after - через сколько секунд появится жетон
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+# Разбор строки правил в словарь {имя правила: (capacity, жетонов в секунду)}
+def parse_rules(text):
+    rules = dict()
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        name, _, spec = part.partition('=')
+        count, _, period = spec.partition('/')
+        rules[name.strip()] = (int(count), int(count) / float(period or 1))
+    return rules
+
+
+# Новое состояние ведра: число жетонов после запроса и время ожидания (0 - запрос разрешён)
+def take_token(tokens, elapsed, capacity, rate):
+    tokens = min(capacity, tokens + max(elapsed, 0) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+# Вёдра в памяти процесса. Каждый процесс сервера считает запросы отдельно
+class MemoryBuckets:
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens, wait = take_token(tokens, now - updated, capacity, rate)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Вёдра в файле SQLite на локальном диске, общие для всех процессов сервера.
+# Ведро читается и обновляется в одной транзакции с блокировкой на запись
+class SharedBuckets:
+    def __init__(self, path='cache/rate_limits.db'):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # Соединение, унаследованное от родительского процесса после fork, использовать нельзя
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets '
+                               '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def take(self, key, capacity, rate):
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (capacity, now)
+            tokens, wait = take_token(tokens, now - updated, capacity, rate)
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+            # Изредка удаляются заброшенные вёдра, чтобы файл не рос
+            if random.random() < 0.001:
+                connection.execute('DELETE FROM buckets WHERE updated < ?', (now - SHARED_BUCKET_TTL,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+
+# Ограничитель частоты запросов. Правила и хранилище вёдер задаются при создании приложения
+class RateLimiter:
+    def __init__(self, rules=None, backend=None):
+        self.rules = rules or dict()
+        self.backend = backend or MemoryBuckets()
+
+    def configure(self, rules=None, backend=None):
+        if rules is not None:
+            self.rules = rules
+        if backend is not None:
+            self.backend = backend
+
+    # Запросы считаются отдельно для каждого пользователя, анонимные - по адресу IP
+    @staticmethod
+    def client_key():
+        if current_user.is_authenticated:
+            return f'user:{current_user.id}'
+        return f'ip:{request.remote_addr}'
+
+    # Проверка правила name для текущего клиента. При превышении вызывается RateLimited
+    def check(self, name):
+        rule = self.rules.get(name)
+        if rule is None:
+            return
+        capacity, rate = rule
+        wait = self.backend.take(f'{name}:{self.client_key()}', capacity, rate)
+        if wait:
+            raise RateLimited(math.ceil(wait))
+
+    # Декоратор представления. methods - методы запроса, к которым применяется правило, None - все
+    def limit(self, name, methods=None):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if methods is None or request.method in methods:
+                    self.check(name)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+rate_limiter = RateLimiter()
+
+
+# Ограничение числа одновременно обрабатываемых запросов процесса. Запрос сверх лимита сразу получает
+# готовый ответ 503 и не занимает поток, пока остальные ждут базу или хэширование паролей.
+# Место освобождается, когда ответ полностью отправлен, в том числе потоковый
+class AdmissionControl:
+    def __init__(self, app, max_requests, body=b'', retry_after=1):
+        self.app = app
+        self.max_requests = max_requests
+        self.body = body
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_requests)
+
+    def __call__(self, environ, start_response):
+        if not self._slots.acquire(blocking=False):
+            start_response('503 Service Unavailable', [('Content-Type', 'text/html; charset=utf-8'),
+                                                       ('Content-Length', str(len(self.body))),
+                                                       ('Retry-After', str(self.retry_after))])
+            return [self.body]
+        try:
+            return ClosingIterator(self.app(environ, start_response), [self._slots.release])
+        except BaseException:
+            self._slots.release()
+            raise
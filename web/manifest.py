@@ -0,0 +1,30 @@
+import hashlib
+import json
+import os
+
+# Общие функции скриптов сборки build_assets.py и build_images.py. Манифест сборки - JSON-файл
+# {исходный файл: запись о собранных копиях}, который сайт читает через web/static_files.py
+
+
+# Хэш содержимого файла. Файл читается частями, чтобы не загружать большие фотографии целиком
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return dict()
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+# Запись во временный файл с переименованием, чтобы сайт не прочитал манифест наполовину
+def save_manifest(path, manifest):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
@@ -0,0 +1,243 @@
+from collections import Counter
+from contextlib import contextmanager
+import os
+import sys
+import threading
+import time
+import sqlalchemy
+from flask import request, Response, template_rendered, before_render_template
+from data.user_cache import user_cache
+
+# Границы интервалов гистограммы времени ответа в секундах
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+# Фазы обработки запроса. Время вне перечисленных фаз считается фазой other
+PHASES = ['sql', 'template', 'file_io', 'password']
+
+
+# Измерения одного запроса
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.sql_queries = 0
+        self.template_start = None
+
+
+# Накопленные измерения процесса. У каждого процесса сервера свои счётчики,
+# поэтому Prometheus должен опрашивать процессы по отдельности или суммировать их
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.requests = dict()
+        self.phase_seconds = Counter()
+        self.sql_queries = Counter()
+        self.file_io_bytes = Counter()
+        self.file_io_seconds = Counter()
+
+    def current(self):
+        return getattr(self._local, 'request', None)
+
+    def begin_request(self):
+        self._local.request = RequestMetrics()
+        return self._local.request
+
+    def end_request(self, route, status):
+        current = self.current()
+        self._local.request = None
+        if current is None:
+            return None
+        duration = time.perf_counter() - current.start
+        with self._lock:
+            entry = self.requests.get((route, status))
+            if entry is None:
+                entry = self.requests[route, status] = {'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0}
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    entry['buckets'][i] += 1
+            entry['count'] += 1
+            entry['sum'] += duration
+            for phase, seconds in current.phases.items():
+                self.phase_seconds[route, phase] += seconds
+            self.phase_seconds[route, 'other'] += max(duration - sum(current.phases.values()), 0)
+            self.sql_queries[route] += current.sql_queries
+        return duration, current
+
+    def add_phase(self, phase, seconds):
+        current = self.current()
+        if current is not None:
+            current.phases[phase] += seconds
+
+    # Учёт чтения или записи файла: direction - read или write
+    def record_file_io(self, direction, size, seconds):
+        with self._lock:
+            self.file_io_bytes[direction] += size
+            self.file_io_seconds[direction] += seconds
+        self.add_phase('file_io', seconds)
+
+    # Текст в формате Prometheus
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# TYPE store_request_duration_seconds histogram')
+            for (route, status), entry in sorted(self.requests.items()):
+                labels = f'route="{route}",status="{status}"'
+                for bound, count in zip(BUCKETS, entry['buckets']):
+                    lines.append(f'store_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'store_request_duration_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+                lines.append(f'store_request_duration_seconds_sum{{{labels}}} {entry["sum"]:.6f}')
+                lines.append(f'store_request_duration_seconds_count{{{labels}}} {entry["count"]}')
+            lines.append('# TYPE store_request_phase_seconds_total counter')
+            for (route, phase), seconds in sorted(self.phase_seconds.items()):
+                lines.append(f'store_request_phase_seconds_total{{route="{route}",phase="{phase}"}} {seconds:.6f}')
+            lines.append('# TYPE store_sql_queries_total counter')
+            for route, count in sorted(self.sql_queries.items()):
+                lines.append(f'store_sql_queries_total{{route="{route}"}} {count}')
+            lines.append('# TYPE store_file_io_bytes_total counter')
+            for direction, size in sorted(self.file_io_bytes.items()):
+                lines.append(f'store_file_io_bytes_total{{direction="{direction}"}} {size}')
+            lines.append('# TYPE store_file_io_seconds_total counter')
+            for direction, seconds in sorted(self.file_io_seconds.items()):
+                lines.append(f'store_file_io_seconds_total{{direction="{direction}"}} {seconds:.6f}')
+        for name, value in user_cache.stats().items():
+            lines.append(f'# TYPE store_user_cache_{name} gauge')
+            lines.append(f'store_user_cache_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+# Замер участка кода как фазы текущего запроса, например: with phase('password'): ...
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_phase(name, time.perf_counter() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start'].pop()
+    current = metrics.current()
+    if current is not None:
+        current.sql_queries += 1
+        current.phases['sql'] += time.perf_counter() - start
+
+
+def _before_render(sender, template, context, **extra):
+    current = metrics.current()
+    if current is not None:
+        current.template_start = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    current = metrics.current()
+    if current is not None and current.template_start is not None:
+        current.phases['template'] += time.perf_counter() - current.template_start
+        current.template_start = None
+
+
+# Выборочный профилировщик: фоновый поток с интервалом interval снимает стеки потоков,
+# обрабатывающих запросы. Стеки медленных запросов записываются в каталог directory
+# в свёрнутом формате (collapsed stacks), который понимают flamegraph.pl и speedscope
+class SamplingProfiler:
+    def __init__(self, directory='cache/profiles', interval=0.005, threshold=0.5):
+        self.directory = directory
+        self.interval = interval
+        self.threshold = threshold
+        self._active = dict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def begin(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                    self._thread.start()
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    # Завершение замера запроса. Стеки сохраняются, только если запрос был медленным
+    def end(self, route, duration):
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+        if not stacks or duration < self.threshold:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{route}-{int(duration * 1000)}ms.txt')
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in stacks.most_common():
+                file.write(f'{stack} {count}\n')
+        return path
+
+
+# Подключение измерений к приложению. Профилировщик включается настройкой PROFILE_SLOW_REQUESTS_MS:
+# стеки запросов дольше этого времени записываются в PROFILE_DIR
+def init_metrics(app):
+    if not sqlalchemy.event.contains(sqlalchemy.engine.Engine, 'before_cursor_execute', _before_cursor_execute):
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine, 'before_cursor_execute', _before_cursor_execute)
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    profiler = None
+    if app.config.get('PROFILE_SLOW_REQUESTS_MS'):
+        profiler = SamplingProfiler(app.config.get('PROFILE_DIR', 'cache/profiles'),
+                                    threshold=app.config['PROFILE_SLOW_REQUESTS_MS'] / 1000)
+
+    @app.before_request
+    def start_request_metrics():
+        metrics.begin_request()
+        if profiler is not None:
+            profiler.begin()
+
+    # Разбивка времени по фазам передаётся и в заголовке Server-Timing, её видно в инструментах браузера
+    @app.after_request
+    def finish_request_metrics(response):
+        route = request.endpoint or 'unknown'
+        result = metrics.end_request(route, response.status_code)
+        if result is not None:
+            duration, current = result
+            timings = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in current.phases.items() if seconds]
+            timings.append(f'total;dur={duration * 1000:.2f}')
+            response.headers['Server-Timing'] = ', '.join(timings)
+            if profiler is not None:
+                profiler.end(route, duration)
+        return response
+
+    # Запрос, прерванный исключением, не доходит до after_request и учитывается здесь с кодом 500
+    @app.teardown_request
+    def discard_request_metrics(exception=None):
+        if metrics.current() is not None:
+            metrics.end_request(request.endpoint or 'unknown', 500)
+        if profiler is not None:
+            profiler.end(request.endpoint or 'unknown', 0)
+
+    @app.route('/metrics')
+    def metrics_page():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,199 @@
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from flask import request, make_response
+from flask_login import current_user
+from .metrics import metrics
+
+
+# Хранилище страниц в памяти процесса с вытеснением давно не использованных страниц.
+# Страницы разных магазинов хранятся в отдельных разделах по max_entries страниц,
+# поэтому посещаемый магазин не вытесняет страницы остальных
+class MemoryBackend:
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._partitions = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key, partition=''):
+        with self._lock:
+            pages = self._partitions.get(partition)
+            entry = pages.get(key) if pages is not None else None
+            if entry is None:
+                return None
+            if entry['expires'] < time.time():
+                del pages[key]
+                return None
+            pages.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, partition=''):
+        with self._lock:
+            pages = self._partitions.setdefault(partition, OrderedDict())
+            pages[key] = entry
+            pages.move_to_end(key)
+            while len(pages) > self.max_entries:
+                pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+
+
+# Хранилище страниц на диске. Его могут разделять несколько процессов одного сервера.
+# Время изменения файла страницы выставляется равным времени её устаревания, поэтому очистка
+# определяет устаревшие страницы без чтения файлов. Очистка выполняется после каждых sweep_every записей
+# процесса: удаляются устаревшие страницы, а если страниц больше max_entries - и ближайшие к устареванию
+class DiskBackend:
+    def __init__(self, directory='cache/pages', max_entries=1000, sweep_every=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.sweep_every = sweep_every or max(max_entries // 10, 1)
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.page')
+
+    # Раздел магазина уже входит в ключ страницы
+    def get(self, key, partition=''):
+        start = time.perf_counter()
+        try:
+            with open(self._path(key), 'rb') as file:
+                entry = pickle.load(file)
+                metrics.record_file_io('read', file.tell(), time.perf_counter() - start)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if entry['key'] != key or entry['expires'] < time.time():
+            return None
+        return entry
+
+    def set(self, key, entry, partition=''):
+        entry = dict(entry, key=key)
+        # Запись во временный файл с переименованием, чтобы другой процесс не прочитал страницу наполовину
+        start = time.perf_counter()
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, 'wb') as file:
+            pickle.dump(entry, file)
+            size = file.tell()
+        os.utime(temp_path, (entry['expires'], entry['expires']))
+        os.replace(temp_path, self._path(key))
+        metrics.record_file_io('write', size, time.perf_counter() - start)
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes >= self.sweep_every
+            if sweep:
+                self._writes = 0
+        if sweep:
+            self.sweep()
+
+    def _pages(self):
+        pages = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.page'):
+                try:
+                    pages.append((os.stat(os.path.join(self.directory, name)).st_mtime, name))
+                except OSError:
+                    pass
+        return pages
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    # Удаление устаревших страниц и страниц сверх max_entries
+    def sweep(self):
+        now = time.time()
+        pages = sorted(self._pages())
+        expired = sum(1 for expires, _ in pages if expires < now)
+        excess = max(len(pages) - expired - self.max_entries, 0)
+        for _, name in pages[:expired + excess]:
+            self._remove(name)
+
+    def __len__(self):
+        return len(self._pages())
+
+    def clear(self):
+        for _, name in self._pages():
+            self._remove(name)
+
+
+# Кэш готовых страниц для анонимных пользователей.
+# Ключ страницы состоит из версии кэша, магазина, адреса и тех параметров запроса, которые читает
+# представление, поэтому произвольные параметры не плодят копии одной страницы.
+# Клиент может перепроверить страницу заголовком If-None-Match и получить ответ 304
+class PageCache:
+    def __init__(self, backend=None, timeout=300):
+        self.backend = backend or MemoryBackend()
+        self.timeout = timeout
+        # Функция, возвращающая идентификатор магазина текущего запроса
+        self.store_key = lambda: ''
+        self._version = 0
+
+    def configure(self, backend=None, timeout=None, store_key=None):
+        if backend is not None:
+            self.backend = backend
+        if timeout is not None:
+            self.timeout = timeout
+        if store_key is not None:
+            self.store_key = store_key
+
+    # Сброс всех страниц всех магазинов, например после изменения товаров
+    def invalidate(self, *args):
+        self._version += 1
+        self.backend.clear()
+
+    def _make_key(self, store, params):
+        query = '&'.join(f'{name}={value}' for name in params for value in request.args.getlist(name))
+        return f'{self._version}:{store}:{request.path}?{query}'
+
+    def _respond(self, entry):
+        if entry['etag'] in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            response = make_response(entry['body'], entry['status'])
+            response.content_type = entry['content_type']
+        response.set_etag(entry['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        # Магазин страницы зависит от адреса сайта и выбора посетителя, сохранённого в cookie
+        response.vary.update(['Host', 'Cookie'])
+        return response
+
+    # Декоратор представления. Кэшируются только GET-запросы анонимных пользователей.
+    # params - имена параметров запроса, от которых зависит страница, остальные параметры не учитываются
+    def cached(self, timeout=None, params=()):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET' or current_user.is_authenticated:
+                    return view(*args, **kwargs)
+                store = str(self.store_key())
+                key = self._make_key(store, params)
+                entry = self.backend.get(key, store)
+                if entry is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    body = response.get_data()
+                    entry = {
+                        'body': body,
+                        'status': response.status_code,
+                        'content_type': response.content_type,
+                        'etag': hashlib.sha1(body).hexdigest(),
+                        'expires': time.time() + (timeout or self.timeout),
+                    }
+                    self.backend.set(key, entry, store)
+                return self._respond(entry)
+            return wrapper
+        return decorator
+
+
+page_cache = PageCache()
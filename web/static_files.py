@@ -0,0 +1,118 @@
+import json
+import mimetypes
+import os
+import threading
+import time
+from flask import current_app, request, send_file, url_for, abort
+from werkzeug.security import safe_join
+from .metrics import metrics
+
+# Собранные файлы (см. build_assets.py) и копии фотографий (см. build_images.py)
+# имеют хэш содержимого в имени, поэтому браузер может хранить их бессрочно
+FINGERPRINTED_PREFIXES = ('assets/', 'img/derived/')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Сжатые копии в порядке предпочтения: значение Content-Encoding и расширение файла
+ENCODINGS = [('br', 'br'), ('gzip', 'gz')]
+
+
+# JSON-манифест сборки. Перечитывается при изменении файла,
+# поэтому новая сборка подхватывается без перезапуска сервера
+class JsonManifest:
+    def __init__(self, path):
+        self.path = path
+        self._entries = dict()
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def configure(self, path):
+        with self._lock:
+            self.path = path
+            self._mtime = None
+
+    def entries(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            # Сборка ещё не выполнялась, используются исходные файлы
+            return dict()
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        start = time.perf_counter()
+                        with open(self.path, 'r', encoding='utf-8') as file:
+                            self._entries = json.load(file)
+                            metrics.record_file_io('read', file.tell(), time.perf_counter() - start)
+                    except (OSError, ValueError):
+                        return self._entries
+                    self._mtime = mtime
+        return self._entries
+
+
+asset_manifest = JsonManifest('static/assets/manifest.json')
+# Настройки раздачи статических файлов
+settings = {
+    # Время кэширования файлов без хэша в имени
+    'max_age': int(os.environ.get('STATIC_MAX_AGE', 3600)),
+    # Префикс внутреннего адреса nginx для X-Accel-Redirect, None - файлы отдаёт само приложение
+    'accel_redirect': os.environ.get('STATIC_ACCEL_REDIRECT'),
+}
+
+
+# Путь собранной копии файла внутри static или исходный путь, если сборки нет
+def asset_path(filename):
+    entry = asset_manifest.entries().get(filename)
+    return entry['path'] if entry else filename
+
+
+def asset_url(filename):
+    return url_for('static', filename=asset_path(filename))
+
+
+def is_fingerprinted(filename):
+    return filename.startswith(FINGERPRINTED_PREFIXES) and not filename.endswith('.json')
+
+
+# Выбор сжатой копии файла по заголовку Accept-Encoding
+def choose_encoding(path):
+    for encoding, extension in ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.isfile(f'{path}.{extension}'):
+            return encoding, f'{path}.{extension}'
+    return None, path
+
+
+# Раздача статических файлов вместо стандартного обработчика flask.
+# Отдаёт заранее сжатые копии, поддерживает условные запросы и Range (через send_file)
+# и может передать отправку файла веб-серверу через X-Sendfile или X-Accel-Redirect
+def serve_static(filename):
+    static_folder = current_app.static_folder
+    path = safe_join(static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding, send_path = choose_encoding(path)
+    immutable = is_fingerprinted(filename)
+    max_age = 31536000 if immutable else settings['max_age']
+    if settings['accel_redirect']:
+        response = current_app.response_class(mimetype=mimetype)
+        relative = os.path.relpath(send_path, static_folder).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = settings['accel_redirect'].rstrip('/') + '/' + relative
+    else:
+        response = send_file(send_path, mimetype=mimetype, conditional=True, max_age=max_age)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    # Ответ зависит от Accept-Encoding, если у файла есть хотя бы одна сжатая копия
+    if encoding is not None or any(os.path.isfile(f'{path}.{i}') for _, i in ENCODINGS):
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else f'public, max-age={max_age}'
+    response.headers.pop('Expires', None)
+    return response
+
+
+# Подключение раздачи статических файлов к приложению.
+# X-Sendfile включается переменной окружения STATIC_SENDFILE=1
+def init_static_files(app):
+    asset_manifest.configure(os.path.join(app.static_folder, 'assets', 'manifest.json'))
+    app.config['USE_X_SENDFILE'] = os.environ.get('STATIC_SENDFILE') == '1'
+    app.view_functions['static'] = serve_static
+    app.jinja_env.globals.update(asset_url=asset_url)
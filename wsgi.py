@@ -0,0 +1,4 @@
+# Точка входа для WSGI-серверов: gunicorn -c gunicorn.conf.py wsgi:app
+from main import create_app
+
+app = create_app()